@@ -1,9 +1,70 @@
 # -*- coding:utf-8; tab-width:4; mode:python -*-
 
-from .doubles import *
-from .matchers import *
-from .tracer import Tracer
-from .internal import WrongApiUsage
+'''
+Submodules (and hamcrest with them) are imported the first time any of
+their names is required (PEP 562).
+'''
+
+import sys
+import importlib
+
+
+_exports = dict(
+    doubles=['Stub', 'Spy', 'ProxySpy', 'Mock', 'StrictMock', 'Mimic', 'precompile',
+             'method_returning', 'method_raising', 'ANY_ARG'],
+    matchers=['called', 'never', 'all_of_calls', 'called_in_order',
+              'verify', 'any_order_verify',
+              'property_got', 'property_set',
+              'max_concurrency', 'in_flight', 'took',
+              'call_rate', 'burst_size', 'max_gap', 'min_gap',
+              'assert_that', 'wait_that', 'is_', 'instance_of'],
+    tracer=['Tracer'],
+    clock=['RealClock', 'VirtualClock', 'get_clock', 'set_clock'],
+    counters=['stats', 'enable_stats', 'disable_stats', 'reset_stats',
+              'collecting_stats'],
+    memory=['memory_report'],
+    query=['calls_to'],
+    metrics=['record_timestamps'],
+    argstats=['record_argument_stats', 'argument_stats'],
+    report=['set_report_limit'],
+    introspection=['enable_introspection_cache', 'disable_introspection_cache',
+                   'save_introspection_cache'],
+    internal=['WrongApiUsage'],
+)
+
+# exported by 'from doublex import *' since the first releases
+_submodules = ['doubles', 'internal', 'matchers', 'proxy', 'safeunicode', 'tracer']
+_other_submodules = ['argstats', 'clock', 'counters', 'introspection', 'latency',
+                     'lazy', 'memory', 'metrics', 'pairing', 'query', 'report']
+
+_lazy = dict((name, module) for module, names in _exports.items() for name in names)
+
+__all__ = sorted(_lazy) + _submodules + ['set_default_behavior', 'when', 'expect_call']
+
+
+def __getattr__(name):
+    if name in _submodules or name in _other_submodules:
+        return importlib.import_module('.' + name, __name__)
+
+    try:
+        module = _lazy[name]
+    except KeyError:
+        raise AttributeError("module 'doublex' has no attribute '%s'" % name)
+
+    module = importlib.import_module('.' + module, __name__)
+    for key in _exports[module.__name__.split('.')[-1]]:
+        globals()[key] = getattr(module, key)
+
+    return globals()[name]
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy) | set(_submodules))
+
+
+if sys.version_info < (3, 7):
+    for _name in _lazy:
+        __getattr__(_name)
 
 
 def set_default_behavior(double, func):
@@ -11,6 +72,8 @@ def set_default_behavior(double, func):
 
 
 def when(double):
+    from .doubles import Stub, Mock
+    from .internal import WrongApiUsage
     if not isinstance(double, Stub):
         raise WrongApiUsage("when() takes a double, '%s' given" % double)
 
@@ -21,6 +84,8 @@ def when(double):
 
 
 def expect_call(mock):
+    from .doubles import Mock
+    from .internal import WrongApiUsage
     if not isinstance(mock, Mock):
         raise WrongApiUsage("expect_call() takes a mock, '%s' given" % mock)
 
@@ -0,0 +1,280 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+# doublex
+#
+# Copyright © 2012-2018 David Villa Alises
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+'''
+Per method statistics of the argument values a spy receives, updated as
+calls are recorded and bounded in memory: approximate most frequent values
+(Misra-Gries), distinct values (HyperLogLog) and sizes of sized values. They
+are disabled by default, see record_argument_stats().
+'''
+
+import math
+import hashlib
+import reprlib
+import threading
+
+from .internal import Method, SpyBase, MockBase, WrongApiUsage
+from .metrics import LatencyHistogram
+from .query import Arguments
+
+
+__all__ = ['record_argument_stats', 'argument_stats']
+
+
+def record_argument_stats(spy, enabled=True, top=10, history=True):
+    '''keep statistics of the arguments of each method of the spy. Without
+    'history' calls are not recorded, only counted'''
+    if not isinstance(spy, SpyBase):
+        raise WrongApiUsage("record_argument_stats() takes a spy, '%s' given" % spy)
+
+    if not history and isinstance(spy, MockBase):
+        raise WrongApiUsage("mocks must keep their history to be verified")
+
+    spy._recorded.collector = StatsCollector(spy, top, history) if enabled else None
+
+
+def argument_stats(method):
+    'statistics of the arguments of the given spy method'
+    if not isinstance(method, Method) or not isinstance(method.double, SpyBase):
+        raise WrongApiUsage("argument_stats() takes a spy method (got %s instead)" % method)
+
+    collector = method.double._recorded.collector
+    if collector is None:
+        raise WrongApiUsage("%s does not record argument stats. See record_argument_stats()" %
+                            method.double._classname())
+
+    return collector.to_method(method.double._proxy.method_key(method.name), method.name)
+
+
+def encode(value):
+    '''stable bytes for the value, the same in every process (hash() is
+    salted for str and bytes). Equal numbers get the same encoding'''
+    kind = type(value)
+    if kind is str:
+        return b's' + value.encode('utf-8', 'surrogatepass')
+    if kind in (bytes, bytearray):
+        return b'b' + bytes(value)
+    if kind in (bool, int) or (kind is float and value.is_integer()):
+        return b'i%d' % value
+    if kind is tuple:
+        return b't' + b'\0'.join(encode(x) for x in value)
+    if kind in (set, frozenset):
+        return b'f' + b'\0'.join(sorted(encode(x) for x in value))
+    return b'r' + repr(value).encode('utf-8', 'backslashreplace')
+
+
+def hash64(value):
+    '64 bit hash of the stable encoding of the value'
+    digest = hashlib.blake2b(encode(value), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class HyperLogLog(object):
+    '''distinct values estimate in 2**precision one byte registers. Standard
+    error is about 1.04 / sqrt(2**precision)'''
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        x = hash64(value)
+        index = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        retval = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if retval <= 2.5 * m and zeros:
+            retval = m * math.log(float(m) / zeros)  # linear counting
+
+        return int(round(retval))
+
+
+class HeavyHitters(object):
+    '''Misra-Gries summary: values more frequent than 1/(capacity+1) of the
+    total are kept, their counts are underestimated by at most that much'''
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+
+    def add(self, value):
+        counts = self.counts
+        try:
+            counts[value] += 1
+            return
+        except KeyError:
+            pass
+        except TypeError:
+            return self.add(Unhashable(value))
+
+        if len(counts) < self.capacity:
+            counts[value] = 1
+            return
+
+        for key in list(counts):
+            counts[key] -= 1
+            if not counts[key]:
+                del counts[key]
+
+    def top(self, amount):
+        items = sorted(self.counts.items(), key=lambda x: -x[1])[:amount]
+        return [(getattr(value, 'value', value), count) for value, count in items]
+
+
+class Unhashable(object):
+    'unhashable value, counted by its repr()'
+    __slots__ = ('value', 'text')
+
+    def __init__(self, value):
+        self.value = value
+        self.text = repr(value)
+
+    def __hash__(self):
+        return hash(self.text)
+
+    def __eq__(self, other):
+        return isinstance(other, Unhashable) and self.text == other.text
+
+
+class SizeHistogram(LatencyHistogram):
+    'len() of values, in the same bounded log-linear buckets as latencies'
+    def percentile(self, percentile):
+        return self.percentile_ns(percentile)
+
+    @property
+    def max(self):
+        return self.max_ns
+
+    @property
+    def min(self):
+        return self.min_ns or 0
+
+    @property
+    def mean(self):
+        if not self.count:
+            return 0
+        return self.total_ns / self.count
+
+
+class ArgumentStats(object):
+    '''values whose hash() or repr() fail are only counted as
+    unrepresentable, and the ones whose len() fails as unsized'''
+    def __init__(self, top):
+        self._top = top
+        self.count = 0
+        self.unrepresentable = 0
+        self.unsized = 0
+        self.heavy = HeavyHitters(top * 4)
+        self.cardinality = HyperLogLog()
+        self.sizes = SizeHistogram()
+
+    def add(self, value):
+        self.count += 1
+        try:
+            self.cardinality.add(value)
+            self.heavy.add(value)
+        except Exception:
+            self.unrepresentable += 1
+
+        if hasattr(type(value), '__len__'):
+            try:
+                self.sizes.record_ns(len(value))
+            except Exception:
+                self.unsized += 1
+
+    @property
+    def distinct(self):
+        'approximate amount of distinct values'
+        return self.cardinality.estimate()
+
+    def top(self, amount=None):
+        '(value, approximate count) of the most frequent values'
+        return self.heavy.top(amount or self._top)
+
+    def __repr__(self):
+        retval = "<count: %s, distinct: ~%s, top: %s" % (
+            self.count, self.distinct,
+            str.join(', ', ['%s (%s)' % (reprlib.repr(value), count)
+                            for value, count in self.top()]))
+        if self.sizes.count:
+            retval += ", sizes: %s" % self.sizes
+        if self.unrepresentable:
+            retval += ", unrepresentable: %s" % self.unrepresentable
+        if self.unsized:
+            retval += ", unsized: %s" % self.unsized
+        return retval + '>'
+
+
+class MethodStats(object):
+    'call count and ArgumentStats by argument name (see query.Arguments)'
+    def __init__(self, double, name, top):
+        self.name = "%s.%s" % (double._classname(), name)
+        self.calls = 0
+        self.arguments = {}
+        self._names = Arguments(double, name)
+        self._top = top
+
+    def add(self, context):
+        self.calls += 1
+        for position, value in enumerate(context.args):
+            self.to_argument(self._names.name_of(position)).add(value)
+
+        for name, value in context.kargs.items():
+            self.to_argument(name).add(value)
+
+    def to_argument(self, name):
+        try:
+            return self.arguments[name]
+        except KeyError:
+            return self.arguments.setdefault(name, ArgumentStats(self._top))
+
+    def __getitem__(self, name):
+        return self.arguments[name]
+
+    def __str__(self):
+        lines = ["%s: %s calls" % (self.name, self.calls)]
+        for name, stats in sorted(self.arguments.items()):
+            lines.append("  %s: %s" % (name, stats))
+        return str.join('\n', lines)
+
+
+class StatsCollector(object):
+    def __init__(self, double, top, history):
+        self.double = double
+        self.top = top
+        self.history = history
+        self.methods = {}
+        self._lock = threading.Lock()
+
+    def to_method(self, key, name):
+        try:
+            return self.methods[key]
+        except KeyError:
+            return self.methods.setdefault(key, MethodStats(self.double, name, self.top))
+
+    def add(self, key, invocation):
+        with self._lock:
+            self.to_method(key, invocation.name).add(invocation.context)
@@ -0,0 +1,658 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+# doublex
+#
+# Copyright © 2012-2018 David Villa Alises
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Microbenchmarks for doublex hot paths.
+
+  python -m doublex.benchmark -o results.json
+  python -m doublex.benchmark --quick --baseline results.json
+  python -m doublex.benchmark --scaling --max-size 100000
+'''
+
+import os
+import sys
+import json
+import math
+import time
+import platform
+import argparse
+import statistics
+import subprocess
+
+from hamcrest import all_of, greater_than, less_than, starts_with
+from hamcrest.core.string_description import StringDescription
+
+from doublex import (Stub, Spy, ProxySpy, Mock, StrictMock, Mimic, ANY_ARG, precompile,
+                     called, verify, any_order_verify, all_of_calls, called_in_order,
+                     calls_to, record_argument_stats)
+from doublex.internal import Invocation
+
+
+class Collaborator(object):
+    def __init__(self):
+        self._value = 0
+
+    def hello(self):
+        return "hello"
+
+    def add(self, a, b):
+        return a + b
+
+    def send(self, message, priority=0):
+        pass
+
+    def get_value(self):
+        return self._value
+
+    def set_value(self, value):
+        self._value = value
+
+    value = property(get_value, set_value)
+
+
+class Case(object):
+    '''A named benchmark. 'factory(size)' returns the callable to time.
+    Cases with a fixed 'number' are not calibrated (the callable may
+    only be run that number of times per repetition).'''
+
+    def __init__(self, name, factory, size=None, number=None):
+        self.name = name if size is None else "%s/%s" % (name, size)
+        self.factory = factory
+        self.size = size
+        self.number = number
+
+
+CASES = []
+
+
+def case(name, sizes=None, quick_sizes=None, number=None):
+    def decorator(factory):
+        factory.sizes = sizes
+        factory.quick_sizes = quick_sizes or sizes
+        factory.bench_name = name
+        factory.number = number
+        CASES.append(factory)
+        return factory
+    return decorator
+
+
+def expand_cases(quick=False, select=None):
+    retval = []
+    for factory in CASES:
+        sizes = factory.quick_sizes if quick else factory.sizes
+        for size in sizes or [None]:
+            item = Case(factory.bench_name, factory, size, factory.number)
+            if select and not any(s in item.name for s in select):
+                continue
+            retval.append(item)
+
+    return retval
+
+
+# -- import time (includes interpreter startup, compare with import/python)
+
+def importing(code):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    command = [sys.executable, '-c', code]
+    return lambda size: lambda: subprocess.check_call(command, env=env)
+
+
+case('import/python', number=5)(importing('pass'))
+case('import/doublex', number=5)(importing('import doublex'))
+case('import/doublex_Spy', number=5)(importing('from doublex import Spy'))
+case('import/doublex_all', number=5)(importing('from doublex import *'))
+
+
+# -- double creation
+
+def creating(double_class):
+    return lambda size: lambda: double_class(Collaborator)
+
+
+for double_class in [Stub, Spy, Mock]:
+    case('create/%s' % double_class.__name__)(creating(double_class))
+
+
+@case('create/ProxySpy')
+def create_proxyspy(size):
+    collaborator = Collaborator()
+    return lambda: ProxySpy(collaborator)
+
+
+@case('create/Mimic')
+def create_mimic(size):
+    return lambda: Mimic(Spy, Collaborator)
+
+
+@case('create/precompiled_Spy')
+def create_precompiled(size):
+    double_class = precompile(Spy, Collaborator)
+    return lambda: double_class()
+
+
+@case('first_access/Spy', number=200)
+def first_access(size):
+    doubles = iter([Spy(Collaborator) for i in range(200 * 10)])
+    return lambda: next(doubles).hello
+
+
+@case('first_access/precompiled_Spy', number=200)
+def first_access_precompiled(size):
+    double_class = precompile(Spy, Collaborator)
+    doubles = iter([double_class() for i in range(200 * 10)])
+    return lambda: next(doubles).hello
+
+
+# -- stubbed calls
+
+@case('stub_lookup', sizes=[1, 100, 10000], quick_sizes=[1, 100, 1000])
+def stub_lookup(size):
+    with Stub() as stub:
+        for i in range(size):
+            stub.foo(i).returns(i)
+
+    wanted = size // 2
+    return lambda: stub.foo(wanted)
+
+
+@case('stub_any_arg')
+def stub_any_arg(size):
+    with Stub() as stub:
+        stub.foo(ANY_ARG).returns(1)
+
+    return lambda: stub.foo(1, 2, 3)
+
+
+@case('stub_matchers')
+def stub_matchers(size):
+    with Stub() as stub:
+        for i in range(10):
+            stub.foo(all_of(greater_than(i), less_than(100)), starts_with('a')).returns(i)
+
+    return lambda: stub.foo(50, 'abc')
+
+
+# -- spies
+
+@case('spy_record')
+def spy_record(size):
+    spy = Spy(Collaborator)
+    return lambda: spy.add(1, 2)
+
+
+@case('spy_record/argument_stats')
+def spy_record_argument_stats(size):
+    spy = Spy(Collaborator)
+    record_argument_stats(spy, history=False)
+    return lambda: spy.add(1, 2)
+
+
+def spy_with_history(size):
+    spy = Spy()
+    for i in range(size):
+        spy.foo(i % 100)
+    spy.bar()
+    return spy
+
+
+@case('called/no_args', sizes=[1000, 1000000], quick_sizes=[1000, 10000])
+def called_no_args(size):
+    spy = spy_with_history(size)
+    matcher = called()
+    return lambda: matcher.matches(spy.bar)
+
+
+@case('called/with_args', sizes=[1000, 1000000], quick_sizes=[1000, 10000])
+def called_with_args(size):
+    spy = spy_with_history(size)
+    matcher = called().with_args(42)
+    return lambda: matcher.matches(spy.foo)
+
+
+@case('called/failure_report', sizes=[1000, 100000], quick_sizes=[1000])
+def called_failure_report(size):
+    spy = spy_with_history(size)
+    matcher = called().with_args(-1)
+    matcher.matches(spy.foo)
+    return lambda: matcher.describe_mismatch(spy.foo, StringDescription())
+
+
+@case('all_of_calls', sizes=[1000, 100000], quick_sizes=[1000])
+def all_of_calls_history(size):
+    spy = spy_with_history(size)
+    matcher = all_of_calls([(spy.foo, called().with_args(i)) for i in range(40)] +
+                           [(spy.bar, called())])
+    return lambda: matcher.matches(spy)
+
+
+@case('called_in_order', sizes=[1000, 1000000], quick_sizes=[1000, 10000])
+def called_in_order_history(size):
+    spy = spy_with_history(size)
+    other = Spy()
+    other.baz()
+    items = [spy.bar, other.baz]
+    matcher = called_in_order()
+    return lambda: matcher.matches(items)
+
+
+@case('calls_to/group_by', sizes=[1000, 100000], quick_sizes=[1000])
+def calls_to_group_by(size):
+    spy = spy_with_history(size)
+    query = calls_to(spy.foo).where(arg0=less_than(50)).group_by('arg0')
+    return query.count
+
+
+# -- mocks
+
+def mock_with_calls(size, shuffle=False):
+    mock = Mock(Collaborator)
+    with mock:
+        for i in range(size):
+            mock.add(i, i)
+
+    calls = range(size)
+    if shuffle:
+        calls = reversed(calls)
+
+    for i in calls:
+        mock.add(i, i)
+
+    return mock
+
+
+@case('verify', sizes=[100, 1000], quick_sizes=[100])
+def verify_mock(size):
+    mock = mock_with_calls(size)
+    matcher = verify()
+    return lambda: matcher.matches(mock)
+
+
+@case('any_order_verify', sizes=[100, 1000], quick_sizes=[100])
+def any_order_verify_mock(size):
+    mock = mock_with_calls(size, shuffle=True)
+    matcher = any_order_verify()
+    return lambda: matcher.matches(mock)
+
+
+# -- properties
+
+@case('property/get')
+def property_get(size):
+    spy = Spy(Collaborator)
+    return lambda: spy.value
+
+
+@case('property/set')
+def property_set(size):
+    spy = Spy(Collaborator)
+
+    def set_value():
+        spy.value = 1
+
+    return set_value
+
+
+# -- scaling: how operations grow with the amount of stubs or recorded calls
+
+class Scenario(object):
+    def __init__(self, name, factory, expected, max_size=None):
+        self.name = name
+        self.factory = factory
+        self.expected = expected
+        self.max_size = max_size
+
+    @property
+    def sublinear(self):
+        return self.expected in SUBLINEAR
+
+
+SUBLINEAR = ['O(1)', 'O(log n)']
+SCALING = []
+
+
+def scenario(name, expected, max_size=None):
+    def decorator(factory):
+        SCALING.append(Scenario(name, factory, expected, max_size))
+        return factory
+    return decorator
+
+
+def fill(operations, double, name, size):
+    for i in range(size):
+        operations.append(Invocation._from_args(double, name, (i,)))
+
+
+@scenario('lookup/other_methods', 'O(1)')
+def lookup_other_methods(size):
+    stub = Stub()
+    fill(stub._stubs, stub, 'foo', 1)
+    fill(stub._stubs, stub, 'bar', size)
+    wanted = Invocation._from_args(stub, 'foo', (0,))
+    return lambda: stub._stubs.lookup(wanted)
+
+
+@scenario('lookup/same_method', 'O(1)')
+def lookup_same_method(size):
+    stub = Stub()
+    fill(stub._stubs, stub, 'foo', size)
+    missing = Invocation._from_args(stub, 'foo', (-1,))
+    return lambda: stub._stubs.find(missing)
+
+
+@scenario('count/other_methods', 'O(1)')
+def count_other_methods(size):
+    spy = Spy()
+    fill(spy._recorded, spy, 'foo', 1)
+    fill(spy._recorded, spy, 'bar', size)
+    wanted = Invocation._from_args(spy, 'foo', (0,))
+    return lambda: spy._recorded.count(wanted)
+
+
+@scenario('count/same_method', 'O(n)')
+def count_same_method(size):
+    spy = Spy()
+    fill(spy._recorded, spy, 'foo', size)
+    wanted = Invocation._from_args(spy, 'foo', (0,))
+    return lambda: spy._recorded.count(wanted)
+
+
+@scenario('get_invocations_to', 'O(1)')
+def get_invocations_to(size):
+    spy = Spy()
+    fill(spy._recorded, spy, 'foo', 1)
+    fill(spy._recorded, spy, 'bar', size)
+    return lambda: spy._get_invocations_to('foo')
+
+
+@scenario('called/other_methods', 'O(1)')
+def called_other_methods(size):
+    spy = Spy()
+    fill(spy._recorded, spy, 'foo', 1)
+    fill(spy._recorded, spy, 'bar', size)
+    matcher = called().with_args(0)
+    return lambda: matcher.matches(spy.foo)
+
+
+@scenario('verify', 'O(n)', max_size=10000)
+def verify_scaling(size):
+    mock = Mock()
+    fill(mock._stubs, mock, 'foo', size)
+    fill(mock._recorded, mock, 'foo', size)
+    matcher = verify()
+    return lambda: matcher.matches(mock)
+
+
+@scenario('mock/call', 'O(1)')
+def mock_call(size):
+    mock = Mock()
+    fill(mock._stubs, mock, 'foo', size)
+
+    def call():
+        mock._expectations.used.clear()
+        mock.foo(size - 1)
+
+    return call
+
+
+@scenario('mock/unexpected_call', 'O(1)')
+def mock_unexpected_call(size):
+    mock = Mock()
+    mock._stubs.append(Invocation._from_args(mock, 'foo', (greater_than(-1),)))
+    fill(mock._stubs, mock, 'foo', size)
+    for i in range(size):
+        mock.foo(i)
+    mock.foo(size)  # reassigns: foo(0) takes its literal expectation
+
+    unexpected = Invocation._from_args(mock, 'bar', ())
+    return lambda: mock._expectations.consume(unexpected)
+
+
+@scenario('strict_mock/call', 'O(1)')
+def strict_mock_call(size):
+    mock = StrictMock()
+    fill(mock._stubs, mock, 'foo', size)
+
+    def call():
+        mock._cursor = mock._index = size - 1
+        mock._repeats = 0
+        mock.foo(size - 1)
+
+    return call
+
+
+def wide_class(size):
+    def method(self, a):
+        pass
+
+    return type('Wide%s' % size, (object,),
+                dict(('method%s' % i, method) for i in range(size)))
+
+
+@scenario('create/Spy', 'O(1)', max_size=10000)
+def create_wide_spy(size):
+    collaborator = wide_class(size)
+    Spy(collaborator)
+    return lambda: Spy(collaborator)
+
+
+@scenario('create/precompiled_Spy', 'O(1)', max_size=10000)
+def create_wide_precompiled(size):
+    double_class = precompile(Spy, wide_class(size))
+    return lambda: double_class()
+
+
+def least_squares(xs, ys):
+    mean_x, mean_y = statistics.mean(xs), statistics.mean(ys)
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    slope = sxy / sxx if sxx else 0
+    return slope, mean_y - slope * mean_x
+
+
+def classify(sizes, timings):
+    '''fit the growth curve. Returns (complexity, log-log slope)'''
+    slope, _ = least_squares([math.log(n) for n in sizes],
+                             [math.log(t) for t in timings])
+    if slope >= 1.5:
+        return 'O(n^2)', slope
+
+    if slope >= 0.6:
+        return 'O(n)', slope
+
+    logs = [math.log(n) for n in sizes]
+    log_slope, intercept = least_squares(logs, timings)
+    start = intercept + log_slope * logs[0]
+    growth = log_slope * (logs[-1] - logs[0]) / start if start > 0 else 0
+    if slope < 0.1 or growth < 0.5:
+        return 'O(1)', slope
+
+    return 'O(log n)', slope
+
+
+def sweep_sizes(min_size=10, max_size=10 ** 6):
+    retval = []
+    size = min_size
+    while size <= max_size:
+        retval.append(size)
+        size *= 10
+
+    return retval
+
+
+def run_scenario(item, sizes, repeat=3, min_time=0.01):
+    if item.max_size:
+        sizes = [n for n in sizes if n <= item.max_size]
+
+    timings = []
+    for size in sizes:
+        timings.append(measure(Case(item.name, item.factory, size),
+                               repeat, min_time)['best'])
+
+    complexity, slope = classify(sizes, timings)
+    return dict(expected=item.expected, complexity=complexity, slope=slope,
+                sizes=sizes, timings=timings,
+                regressed=item.sublinear and complexity not in SUBLINEAR)
+
+
+def run_scaling(min_size=10, max_size=10 ** 6, select=None, repeat=3, out=None):
+    results = {}
+    for item in SCALING:
+        if select and not any(s in item.name for s in select):
+            continue
+
+        results[item.name] = result = run_scenario(
+            item, sweep_sizes(min_size, max_size), repeat)
+        if out:
+            out.write("%-24s expected %-9s got %-9s (slope %.2f)%s\n" % (
+                item.name, result['expected'], result['complexity'], result['slope'],
+                '  REGRESSION' if result['regressed'] else ''))
+            out.flush()
+
+    return dict(
+        doublex=doublex_version(),
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        scaling=results)
+
+
+def timed(func, number):
+    start = time.perf_counter()
+    for i in range(number):
+        func()
+    return time.perf_counter() - start
+
+
+def measure(item, repeat=5, min_time=0.05):
+    func = item.factory(item.size)
+
+    number = item.number
+    if number is None:
+        number = 1
+        while number < 10 ** 6 and timed(func, number) < min_time / 5:
+            number *= 10
+
+    timings = [timed(func, number) / number for i in range(repeat)]
+    return dict(number=number, repeat=repeat,
+                best=min(timings), median=statistics.median(timings))
+
+
+def run(quick=False, select=None, repeat=5, min_time=0.05, out=None):
+    results = {}
+    for item in expand_cases(quick, select):
+        results[item.name] = measure(item, repeat, min_time)
+        if out:
+            out.write("%-28s %12s/op\n" % (item.name,
+                                           format_time(results[item.name]['best'])))
+            out.flush()
+
+    return dict(
+        doublex=doublex_version(),
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        quick=quick,
+        results=results)
+
+
+def doublex_version():
+    try:
+        from importlib.metadata import version
+        return version('doublex')
+    except Exception:
+        return None
+
+
+def format_time(seconds):
+    for unit, scale in [('s', 1), ('ms', 1e3), ('us', 1e6)]:
+        if seconds >= 1 / scale:
+            return "%.3f %s" % (seconds * scale, unit)
+
+    return "%.1f ns" % (seconds * 1e9)
+
+
+def compare(current, baseline, max_slowdown=1.2):
+    '''returns [(name, baseline, current, ratio, regressed)] for cases
+    present in both reports'''
+    retval = []
+    previous = baseline['results']
+    for name, result in sorted(current['results'].items()):
+        if name not in previous:
+            continue
+
+        before, now = previous[name]['best'], result['best']
+        ratio = now / before if before else float('inf')
+        retval.append((name, before, now, ratio, ratio > max_slowdown))
+
+    return retval
+
+
+def show_comparison(rows, out):
+    out.write("\n%-28s %14s %14s %8s\n" % ('case', 'baseline', 'current', 'ratio'))
+    for name, before, now, ratio, regressed in rows:
+        out.write("%-28s %14s %14s %7.2fx%s\n" % (
+            name, format_time(before), format_time(now), ratio,
+            '  REGRESSION' if regressed else ''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m doublex.benchmark', description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-o', '--output', help='write JSON results to this file')
+    parser.add_argument('-b', '--baseline', help='JSON results to compare with')
+    parser.add_argument('-k', dest='select', action='append',
+                        help='run only cases containing this text')
+    parser.add_argument('--quick', action='store_true',
+                        help='use smaller sizes and fewer repetitions')
+    parser.add_argument('--max-slowdown', type=float, default=1.2,
+                        help='ratio over baseline considered a regression (default: 1.2)')
+    parser.add_argument('--scaling', action='store_true',
+                        help='sweep sizes and check the complexity of each operation')
+    parser.add_argument('--min-size', type=int, default=10)
+    parser.add_argument('--max-size', type=int, default=10 ** 6)
+    args = parser.parse_args(argv)
+
+    repeat = 3 if args.quick else 5
+    if args.scaling:
+        report = run_scaling(args.min_size, args.max_size, args.select, out=sys.stderr)
+    else:
+        report = run(args.quick, args.select, repeat, out=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(report, fd, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+    if args.scaling:
+        return 1 if any(r['regressed'] for r in report['scaling'].values()) else 0
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as fd:
+        rows = compare(report, json.load(fd), args.max_slowdown)
+
+    show_comparison(rows, sys.stderr)
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
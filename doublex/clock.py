@@ -0,0 +1,172 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+# doublex
+#
+# Copyright © 2012-2018 David Villa Alises
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+import abc
+import time
+import threading
+
+
+__all__ = ['RealClock', 'VirtualClock', 'get_clock', 'set_clock']
+
+
+def to_ns(seconds):
+    return int(round(seconds * 1e9))
+
+
+class Clock(abc.ABC):
+    '''Time source behind every doublex timing. A clock may be installed
+    for a block using it as context manager.'''
+
+    @abc.abstractmethod
+    def now(self):
+        pass
+
+    @abc.abstractmethod
+    def now_ns(self):
+        pass
+
+    @abc.abstractmethod
+    def sleep(self, seconds):
+        pass
+
+    @abc.abstractmethod
+    def wait(self, event, timeout):
+        pass
+
+    @abc.abstractmethod
+    async def async_sleep(self, seconds):
+        pass
+
+    def __enter__(self):
+        self._previous = set_clock(self)
+        return self
+
+    def __exit__(self, *args):
+        set_clock(self._previous)
+
+
+class RealClock(Clock):
+    def now(self):
+        return time.monotonic()
+
+    def now_ns(self):
+        if hasattr(time, 'monotonic_ns'):
+            return time.monotonic_ns()
+
+        return to_ns(time.monotonic())
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, event, timeout):
+        return event.wait(timeout)
+
+    async def async_sleep(self, seconds):
+        import asyncio
+        await asyncio.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    '''Clock advanced by hand. With 'autojump' enabled, sleeps and timeouts
+    are consumed at once, moving the clock forward instead of blocking.
+    Otherwise they block until some other thread calls advance().'''
+
+    poll_interval = 0.005
+
+    def __init__(self, start=0, autojump=True):
+        self._ns = to_ns(start)
+        self.autojump = autojump
+        self._condition = threading.Condition()
+
+    def now(self):
+        return self._ns / 1e9
+
+    def now_ns(self):
+        return self._ns
+
+    def advance(self, seconds):
+        if seconds < 0:
+            raise ValueError("clock can not go backwards (got %s)" % seconds)
+
+        with self._condition:
+            self._ns += to_ns(seconds)
+            self._condition.notify_all()
+
+    def _jump_to(self, deadline):
+        with self._condition:
+            self._ns = max(self._ns, deadline)
+            self._condition.notify_all()
+
+    def sleep(self, seconds):
+        deadline = self._ns + to_ns(seconds)
+        if self.autojump:
+            self._jump_to(deadline)
+            return
+
+        with self._condition:
+            while self._ns < deadline:
+                self._condition.wait()
+
+    def wait(self, event, timeout):
+        if event.is_set():
+            return True
+
+        if timeout is None:
+            return event.wait()
+
+        deadline = self._ns + to_ns(timeout)
+        if self.autojump:
+            self._jump_to(deadline)
+            return event.is_set()
+
+        with self._condition:
+            while not event.is_set() and self._ns < deadline:
+                self._condition.wait(self.poll_interval)
+
+        return event.is_set()
+
+    async def async_sleep(self, seconds):
+        import asyncio
+        deadline = self._ns + to_ns(seconds)
+        if self.autojump:
+            self._jump_to(deadline)
+            await asyncio.sleep(0)
+            return
+
+        while self._ns < deadline:
+            await asyncio.sleep(self.poll_interval)
+
+    def __repr__(self):
+        return "VirtualClock(%s)" % self.now()
+
+
+_clock = RealClock()
+
+
+def get_clock():
+    return _clock
+
+
+def set_clock(clock):
+    'install the given clock, returns the previous one'
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
@@ -0,0 +1,111 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+# doublex
+#
+# Copyright © 2012-2018 David Villa Alises
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Internal hot-path counters. They are disabled by default, call sites must
+check 'counters.enabled' before calling incr(). Per double counters are kept
+in the double proxy.
+'''
+
+import threading
+import collections
+from contextlib import contextmanager
+
+
+__all__ = ['stats', 'enable_stats', 'disable_stats', 'reset_stats',
+           'collecting_stats']
+
+
+enabled = False
+_global = collections.Counter()
+_local = threading.local()
+
+
+def incr(owner, name, amount=1):
+    _global[name] += amount
+
+    owner = owner or getattr(_local, 'owner', None)
+    if owner is None:
+        return
+
+    try:
+        owner._counters[name] += amount
+    except AttributeError:
+        owner._counters = collections.Counter({name: amount})
+
+
+@contextmanager
+def owner(proxy):
+    'attribute counts without explicit owner to the given proxy'
+    previous = getattr(_local, 'owner', None)
+    _local.owner = proxy
+    try:
+        yield
+    finally:
+        _local.owner = previous
+
+
+def stats(double=None):
+    '''snapshot of the counters for the given double, or the global ones'''
+    if double is None:
+        return dict(_global)
+
+    proxy = double.__dict__.get('_proxy')
+    return dict(getattr(proxy, '_counters', {}))
+
+
+def enable_stats():
+    global enabled
+    enabled = True
+
+
+def disable_stats():
+    global enabled
+    enabled = False
+
+
+def reset_stats():
+    _global.clear()
+
+
+class StatsScope(object):
+    def __init__(self):
+        self._start = collections.Counter(_global)
+        self.stats = None
+
+    def snapshot(self):
+        delta = collections.Counter(_global)
+        delta.subtract(self._start)
+        return dict((k, v) for k, v in delta.items() if v)
+
+
+@contextmanager
+def collecting_stats():
+    '''enable counters for a block. The yielded scope provides the counts
+    within the block as 'scope.stats' once finished'''
+    global enabled
+    previous = enabled
+    enabled = True
+    scope = StatsScope()
+    try:
+        yield scope
+    finally:
+        scope.stats = scope.snapshot()
+        enabled = previous
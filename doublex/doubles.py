@@ -18,19 +18,24 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
-
-import inspect
-from typing import Generic
-
-import hamcrest
-
-from .internal import (ANY_ARG, OperationList, Method, MockBase, SpyBase,
-                       AttributeFactory, WrongApiUsage)
+import threading
+
+from .internal import (ANY_ARG, InvocationRecord, Method, Property,
+                       MockBase, SpyBase, ProxySpyBase, AttributeFactory,
+                       MethodSlot, PropertySlot, WrongApiUsage,
+                       Expectations, same_invocation, same_invocations)
+from .metrics import CallProbe
+from . import counters
 from .proxy import create_proxy, get_class
-from .matchers import MockIsExpectedInvocation
+from .lazy import LazyModule
 
+inspect = LazyModule('inspect')
+typing = LazyModule('typing')
+hamcrest = LazyModule('hamcrest')
+matchers = LazyModule('doublex.matchers')
 
-__all__ = ['Stub', 'Spy', 'ProxySpy', 'Mock', 'Mimic',
+
+__all__ = ['Stub', 'Spy', 'ProxySpy', 'Mock', 'StrictMock', 'Mimic', 'precompile',
            'method_returning', 'method_raising',
            'ANY_ARG']
 
@@ -38,6 +43,7 @@ __all__ = ['Stub', 'Spy', 'ProxySpy', 'Mock', 'Mimic',
 class Stub(object):
     _default_behavior = lambda x: None
     _new_attr_hooks = []
+    _precompiled = False
 
     def __new__(cls, collaborator=None):
         '''Creates a fresh class clone per instance. This is required due to
@@ -51,11 +57,14 @@ class Stub(object):
 
     def __init__(self, collaborator=None):
         self._proxy = create_proxy(collaborator)
-        self._stubs = OperationList()
+        self._stubs = InvocationRecord('stubs')
         self._setting_up = False
         self._new_attr_hooks = self._new_attr_hooks[:]
         self._deactivate = False
-        self.__class__.__setattr__ = self.__setattr__hook
+        if not self._precompiled:
+            if counters.enabled:
+                counters.incr(self._proxy, 'class_clones')
+            self.__class__.__setattr__ = self.__setattr__hook
 
     def _activate_next(self):
         self.__enter__()
@@ -79,8 +88,8 @@ class Stub(object):
         self._prepare_invocation(invocation)
 
         stubbed_retval = self._default_behavior()
-        if invocation in self._stubs:
-            stubbed = self._stubs.lookup(invocation)
+        stubbed = self._find_stub(invocation)
+        if stubbed is not None:
             stubbed_retval = stubbed._apply_stub(invocation)
 
         actual_retval = self._perform_invocation(invocation)
@@ -92,6 +101,9 @@ class Stub(object):
     def _prepare_invocation(self, invocation):
         pass
 
+    def _find_stub(self, invocation):
+        return self._stubs.find(invocation)
+
     def _perform_invocation(self, invocation):
         return None
 
@@ -120,7 +132,7 @@ class Stub(object):
 
 class Spy(Stub, SpyBase):
     def __init__(self, collaborator=None):
-        self._recorded = OperationList()
+        self._recorded = InvocationRecord()
         super(Spy, self).__init__(collaborator)
 
     def _prepare_invocation(self, invocation):
@@ -131,31 +143,117 @@ class Spy(Stub, SpyBase):
             self._recorded.count(invocation, cmp_pred))
 
     def _get_invocations_to(self, name):
-        return [i for i in self._recorded
-                if self._proxy.same_method(name, i.name)]
+        return self._recorded.to_method(self._proxy.method_key(name)).invocations
 
+    def _get_timestamps(self, name):
+        if not self._recorded.timestamps:
+            raise WrongApiUsage(
+                "%s does not record timestamps. See record_timestamps()" % self._classname())
 
-class ProxySpy(Spy):
+        return self._recorded.to_method(self._proxy.method_key(name)).timestamps
+
+
+class ProxySpy(Spy, ProxySpyBase):
     def __init__(self, collaborator):
         self._assure_is_instance(collaborator)
+        self._probes = {}
         super(ProxySpy, self).__init__(collaborator)
 
     def _assure_is_instance(self, thing):
         if thing is None or inspect.isclass(thing):
             raise TypeError("ProxySpy takes an instance (got %s instead)" % thing)
 
+    def _get_probe(self, name):
+        probe = self._probes.get(name)
+        if probe is None:
+            probe = self._probes.setdefault(name, CallProbe())
+        return probe
+
     def _perform_invocation(self, invocation):
-        return invocation._apply_on_collaborator()
+        probe = self._get_probe(invocation.name)
+        start = probe.enter()
+        try:
+            retval = invocation._apply_on_collaborator()
+        except BaseException:
+            probe.exit(start)
+            raise
+
+        if inspect.iscoroutine(retval):
+            probe.concurrency.exit()
+            return self._awaited(probe, retval)
+
+        probe.exit(start)
+        return retval
+
+    async def _awaited(self, probe, coroutine):
+        'calls to async collaborator methods are measured while awaited'
+        start = probe.enter()
+        try:
+            return await coroutine
+        finally:
+            probe.exit(start)
 
 
 class Mock(Spy, MockBase):
+    def __init__(self, collaborator=None):
+        super(Mock, self).__init__(collaborator)
+        self._expectations = Expectations(self._stubs, self._recorded)
+
     def _prepare_invocation(self, invocation):
-        hamcrest.assert_that(self, MockIsExpectedInvocation(invocation))
+        hamcrest.assert_that(self, matchers.MockIsExpectedInvocation(invocation))
         super(Mock, self)._prepare_invocation(invocation)
 
+    def _expectations_met(self):
+        return same_invocations(self._stubs.expanded(), self._recorded)
+
+
+class StrictMock(Mock):
+    '''Mock whose expectations must be met in the given order. Each call is
+    checked against the next expectation only and fails right away'''
+    def __init__(self, collaborator=None):
+        self._cursor = self._index = self._repeats = 0
+        self._lock = threading.Lock()
+        super(StrictMock, self).__init__(collaborator)
+
+    def _next_expectation(self):
+        while self._index < len(self._stubs) and \
+                self._repeats >= self._stubs[self._index].expected_times:
+            self._index += 1
+            self._repeats = 0
+
+        if self._index < len(self._stubs):
+            return self._stubs[self._index]
+
+    def _take_next(self, invocation):
+        '''the position and the next expectation, and whether the invocation
+        meets (and takes) it'''
+        with self._lock:
+            position, expected = self._cursor, self._next_expectation()
+            taken = expected is not None and same_invocation(expected, invocation)
+            if taken:
+                self._cursor += 1
+                self._repeats += 1
+                invocation.expectation = expected
+
+            return position, expected, taken
+
+    def _prepare_invocation(self, invocation):
+        hamcrest.assert_that(self, matchers.MockIsNextInvocation(invocation))
+        Spy._prepare_invocation(self, invocation)
+
+    def _find_stub(self, invocation):
+        return invocation.expectation
+
+    def _expectations_met(self):
+        return self._cursor == self._stubs.expected_count()
+
 
 def Mimic(double, collab):
     def __getattribute__hook(self, key):
+        if counters.enabled:
+            proxy = object.__getattribute__(self, '__dict__').get('_proxy')
+            counters.incr(proxy, 'mimic_hooks')
+
         if key in ['__class__', '__dict__',
                    '_get_method', '_methods'] or \
                 key in [x[0] for x in inspect.getmembers(double)] or \
@@ -180,7 +278,7 @@ def Mimic(double, collab):
         "Mimic() takes a double class as first argument (got %s instead)" & double
 
     collab_class = get_class(collab)
-    base_classes = tuple(base for base in collab_class.__bases__ if base is not Generic)
+    base_classes = tuple(base for base in collab_class.__bases__ if base is not typing.Generic)
     generated_class = type(
         "Mimic_%s_for_%s" % (double.__name__, collab_class.__name__),
         (double, collab_class) + base_classes,
@@ -190,6 +288,43 @@ def Mimic(double, collab):
     return generated_class(collab)
 
 
+def precompile(double_class, collaborator_class):
+    '''Creates a double class for the given collaborator class with all its
+    methods and properties already in place, so instances do not need a
+    class clone nor attribute lookups on the collaborator'''
+    if not (inspect.isclass(double_class) and issubclass(double_class, Stub)):
+        raise WrongApiUsage(
+            "precompile() takes a double class (got %s instead)" % double_class)
+
+    proxy = create_proxy(collaborator_class)
+    attrs = dict(_precompiled=True)
+    for name in dir(collaborator_class):
+        if name.startswith('__') or hasattr(double_class, name):
+            continue
+
+        try:
+            factory = AttributeFactory.typemap.get(proxy.get_attr_typename(name))
+        except AttributeError:
+            continue
+
+        if factory is Method:
+            attrs[name] = MethodSlot(name)
+        elif factory is Property:
+            attrs[name] = PropertySlot(name)
+
+    def __new__(cls, collaborator=None):
+        return object.__new__(cls)
+
+    def __init__(self, collaborator=None):
+        self._properties = {}
+        if collaborator is None:
+            collaborator = collaborator_class
+        double_class.__init__(self, collaborator)
+
+    attrs.update(__new__=__new__, __init__=__init__)
+    return type(double_class.__name__, (double_class,), attrs)
+
+
 def method_returning(value):
     with Spy() as spy:
         method = Method(spy, 'orphan')
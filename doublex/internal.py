@@ -20,11 +20,13 @@
 
 
 import sys
+import array
 import threading
 import functools
+import itertools
 from enum import Enum
-
-import six
+from itertools import zip_longest
+from collections import deque
 
 if sys.version_info > (3, 3):
     from collections.abc import Callable as abc_Callable, Mapping as abc_Mapping
@@ -32,16 +34,25 @@ else:
     from collections import Callable as abc_Callable, Mapping as abc_Mapping
 
 
-import hamcrest
-from hamcrest.core.base_matcher import BaseMatcher
-
 try:
     from functools import total_ordering
 except ImportError:
     from .py27_backports import total_ordering
 
 
+from .lazy import LazyModule
 from .safeunicode import get_string
+from .latency import create_latency
+from .clock import get_clock
+from . import counters
+
+hamcrest = LazyModule('hamcrest')
+base_matcher = LazyModule('hamcrest.core.base_matcher')
+
+# process wide, so calls to different doubles may be ordered. Numbers are
+# taken with the record lock held, so they are stored in order
+sequence = itertools.count()
+record_lock = threading.Lock()
 
 
 class WrongApiUsage(Exception):
@@ -65,6 +76,70 @@ ANY_ARG = Constant.ANY_ARG
 UNSPECIFIED = Constant.UNSPECIFIED
 
 
+LITERAL_TYPES = frozenset([type(None), bool, int, float, complex, str, bytes])
+
+
+def is_literal(value):
+    '''values hamcrest would just compare with ==. Types, matchers and
+    any other object (they may override __eq__) are not'''
+    kind = type(value)
+    if kind in LITERAL_TYPES:
+        return value == value  # NaN
+
+    if kind is tuple or kind is frozenset:
+        return all(is_literal(x) for x in value)
+
+    return False
+
+
+def canonical_value(value):
+    if type(value) is dict:
+        if not all(is_literal(x) for x in value.values()):
+            raise ValueError
+        return (dict, frozenset(value.items()))
+
+    if not is_literal(value):
+        raise ValueError
+
+    return value
+
+
+def typed_value(value):
+    'canonical value that also tells apart equal values of different types'
+    kind = type(value)
+    if kind is tuple or kind is frozenset:
+        return (kind, kind(typed_value(x) for x in value))
+
+    return (kind, value)
+
+
+def same_invocation(expected, actual):
+    '''expected == actual. Invocations with literal arguments are compared
+    by key, matchers are evaluated only for the rest'''
+    e_key, a_key = expected.literal_key(), actual.literal_key()
+    if e_key is not None and e_key == a_key:
+        return True
+
+    if e_key is not None and a_key is not None:
+        if e_key[0] != a_key[0]:
+            return False
+
+        e_args = expected.canonical()
+        if e_args is not None and e_args == actual.canonical():
+            return True
+
+    return expected is actual or expected == actual
+
+
+def same_invocations(expected, actual):
+    'expected == actual (sequences)'
+    for e, a in zip_longest(expected, actual):
+        if e is None or a is None or not same_invocation(e, a):
+            return False
+
+    return True
+
+
 def add_indent(text, indent=0):
     return "%s%s" % (' ' * indent, text)
 
@@ -80,6 +155,10 @@ class OperationList(list):
         if not self:
             return add_indent("No one", indent)
 
+        from . import report
+        if report.needs_summary(self):
+            return report.summarize(self, indent)
+
         lines = [add_indent(i, indent) for i in self]
         return str.join('\n', lines)
 
@@ -90,6 +169,247 @@ class OperationList(list):
         return [predicate(invocation, i) for i in self].count(True)
 
 
+class MethodRecord(object):
+    '''invocations to a single method, their sequence numbers and their
+    timestamps when enabled. Positions of the literal ones by bound arguments
+    are indexed on demand'''
+    __slots__ = ('invocations', 'sequence', 'timestamps', 'by_key', 'loose',
+                 'indexed')
+
+    def __init__(self):
+        self.invocations = []
+        self.sequence = array.array('q')
+        self.timestamps = array.array('q')
+        self.by_key = self.loose = None
+        self.indexed = 0
+
+    def update_index(self):
+        if self.by_key is None:
+            self.by_key, self.loose = {}, []
+
+        start, self.indexed = self.indexed, len(self.invocations)
+        for index in range(start, self.indexed):
+            key = self.invocations[index].canonical()
+            if key is None:
+                self.loose.append(index)
+            else:
+                self.by_key.setdefault(key, []).append(index)
+
+
+class InvocationRecord(OperationList):
+    '''invocations indexed per method. Searching for an invocation only
+    compares it with the ones to the same method'''
+    def __init__(self, kind='recorded'):
+        super(InvocationRecord, self).__init__()
+        self.kind = kind
+        self._methods = {}
+        self.timestamps = False
+        self.collector = None
+
+    def append(self, invocation):
+        key = self._key(invocation)
+        if self.collector is not None:
+            self.collector.add(key, invocation)
+            if not self.collector.history:
+                return
+
+        with record_lock:
+            list.append(self, invocation)
+            method = self.to_method(key)
+            method.invocations.append(invocation)
+            method.sequence.append(next(sequence))
+
+            if self.timestamps:
+                invocation.timestamp = get_clock().now_ns()
+                invocation.thread = threading.get_ident()
+                method.timestamps.append(invocation.timestamp)
+
+    @classmethod
+    def _key(cls, invocation):
+        return invocation.double._proxy.method_key(invocation.name)
+
+    def to_method(self, key):
+        try:
+            return self._methods[key]
+        except KeyError:
+            return self._methods.setdefault(key, MethodRecord())
+
+    def _candidates(self, invocation):
+        method = self._methods.get(self._key(invocation))
+        retval = method.invocations if method else []
+        if counters.enabled:
+            proxy = invocation.double._proxy
+            counters.incr(proxy, '%s_scans' % self.kind)
+            counters.incr(proxy, '%s_scanned' % self.kind, len(retval))
+
+        return retval
+
+    def __contains__(self, invocation):
+        return any(i is invocation or i == invocation
+                   for i in self._candidates(invocation))
+
+    def find(self, invocation):
+        'the last invocation equal to the given one, None if there is not'
+        candidates = self._candidates(invocation)
+        if not candidates:
+            return None
+
+        method = self._methods[self._key(invocation)]
+        method.update_index()
+        key = invocation.canonical() if method.by_key else None
+        if key is None:
+            for i in reversed(candidates):
+                if invocation == i:
+                    return i
+            return None
+
+        literal = method.by_key.get(key)
+        last = literal[-1] if literal else -1
+        for index in reversed(method.loose):
+            if index < last:
+                break
+
+            if invocation == candidates[index]:
+                return candidates[index]
+
+        if literal:
+            return candidates[last]
+
+    def lookup(self, invocation):
+        retval = self.find(invocation)
+        if retval is None:
+            raise LookupError
+
+        return retval
+
+    def count(self, invocation, predicate=None):
+        candidates = self._candidates(invocation)
+        if predicate is None:
+            return list.count(candidates, invocation)
+
+        return [predicate(invocation, i) for i in candidates].count(True)
+
+    def expanded(self):
+        'each invocation repeated as many times as expected (see times())'
+        for invocation in self:
+            for i in range(invocation.expected_times):
+                yield invocation
+
+    def expected_count(self):
+        return sum(i.expected_times for i in self)
+
+    def show(self, indent=0):
+        return OperationList.show(list(self.expanded()), indent)
+
+
+class MethodExpectations(object):
+    '''pending expectations to a single method. Literal ones are indexed by
+    their bound arguments, the rest are scanned from the first pending one'''
+    def __init__(self):
+        self.items = []
+        self.by_key = {}
+        self.loose = []
+        self.loose_start = 0
+
+    def add(self, expectation):
+        index = len(self.items)
+        self.items.append(expectation)
+        key = expectation.canonical()
+        if key is None:
+            self.loose.append(index)
+        else:
+            self.by_key.setdefault(key, deque()).append(index)
+
+
+class Expectations(object):
+    '''calls left for each mock expectation. Each call takes the first
+    pending expectation it matches, in programmed order. When there is not
+    any, earlier calls may be given to other expectations (as long as all of
+    them get one) before the call is considered unexpected'''
+    def __init__(self, stubs, recorded):
+        self.stubs = stubs
+        self.recorded = recorded
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.used = {}
+        self.methods = {}
+        self.pairing = None
+        self.paired_stubs = 0
+
+    def _method(self, key):
+        method = self.methods.get(key)
+        if method is None:
+            method = self.methods[key] = MethodExpectations()
+
+        invocations = self.stubs.to_method(key).invocations
+        for expectation in invocations[len(method.items):]:
+            method.add(expectation)
+
+        return method
+
+    def _pending(self, expectation):
+        return self.used.get(id(expectation), 0) < expectation.expected_times
+
+    def consume(self, invocation):
+        with self._lock:
+            if self.pairing is not None:
+                return self._pair(invocation)
+
+            method = self._method(self.stubs._key(invocation))
+            expectation = self._first_pending(method, invocation)
+            if expectation is None:
+                return self._reassign(invocation)
+
+            self.used[id(expectation)] = self.used.get(id(expectation), 0) + 1
+            return True
+
+    def _first_pending(self, method, invocation):
+        limit = len(method.items)
+        key = invocation.canonical() if method.by_key else None
+        indexes = method.by_key.get(key) if key is not None else None
+        while indexes and not self._pending(method.items[indexes[0]]):
+            indexes.popleft()
+        if indexes:
+            limit = indexes[0]
+
+        loose = method.loose
+        while method.loose_start < len(loose) and \
+                not self._pending(method.items[loose[method.loose_start]]):
+            method.loose_start += 1
+
+        for index in loose[method.loose_start:]:
+            if index > limit:
+                break
+
+            expectation = method.items[index]
+            if self._pending(expectation) and same_invocation(expectation, invocation):
+                return expectation
+
+        if limit < len(method.items):
+            return method.items[limit]
+
+    def _reassign(self, invocation):
+        '''pair all the calls at once. Later calls are added to that pairing,
+        moving only the calls on their augmenting path'''
+        from .pairing import Pairing
+        actual = list(self.recorded) + [invocation]
+        pairing = Pairing(self.stubs.expanded(), actual)
+        if pairing.paired() < len(actual):
+            return False
+
+        self.pairing = pairing
+        self.paired_stubs = len(self.stubs)
+        return True
+
+    def _pair(self, invocation):
+        if len(self.stubs) != self.paired_stubs:
+            return self._reassign(invocation)
+
+        return self.pairing.add(invocation)
+
+
 class Observable(object):
     def __init__(self):
         self.observers = []
@@ -97,6 +417,9 @@ class Observable(object):
     def attach(self, observer):
         self.observers.append(observer)
 
+    def detach(self, observer):
+        self.observers.remove(observer)
+
     def notify(self, *args, **kargs):
         for ob in self.observers:
             ob(*args, **kargs)
@@ -107,25 +430,49 @@ class Observable(object):
 
 
 class Method(Observable):
+    '''Methods without observers skip notification. Attaching the first
+    observer turns the method into an ObservedMethod, and detaching the last
+    one turns it back'''
+
+    _event_lock = threading.Lock()
+
     def __init__(self, double, name):
         super(Method, self).__init__()
         # FIXME: assert isinstance(double, Stub)
         self.double = double
         self.name = name
         self.__name__ = name
-        self._event = threading.Event()
+        self._event = None
 
     def __call__(self, *args, **kargs):
         invocation = self._create_invocation(args, kargs)
         retval = self.double._manage_invocation(invocation)
 
-        if not self.double._setting_up:
+        if self._event is not None and not self.double._setting_up:
             self._event.set()
-            self.notify(*args, **kargs)
 
         self._apply_deactivation(self.double)
         return retval
 
+    def attach(self, observer):
+        super(Method, self).attach(observer)
+        if type(self) is Method:
+            self.__class__ = ObservedMethod
+
+    def detach(self, observer):
+        super(Method, self).detach(observer)
+        if not self.observers and type(self) is ObservedMethod:
+            self.__class__ = Method
+
+    def _get_event(self):
+        '''set on the first invocation after it is requested (async_mode)'''
+        if self._event is None:
+            with self._event_lock:
+                if self._event is None:
+                    self._event = threading.Event()
+
+        return self._event
+
     def _create_invocation(self, args, kargs):
         return Invocation._from_args(self.double, self.name, args, kargs)
 
@@ -135,6 +482,26 @@ class Method(Observable):
             raise WrongApiUsage("Only Spy derivates store invocations")
         return [x.context for x in self.double._get_invocations_to(self.name)]
 
+    @property
+    def concurrency(self):
+        return self._get_probe().concurrency
+
+    @property
+    def latency(self):
+        return self._get_probe().latency
+
+    @property
+    def timestamps(self):
+        'monotonic nanoseconds of each invocation (see record_timestamps())'
+        if not isinstance(self.double, SpyBase):
+            raise WrongApiUsage("Only Spy derivates store invocations")
+        return self.double._get_timestamps(self.name)
+
+    def _get_probe(self):
+        if not isinstance(self.double, ProxySpyBase):
+            raise WrongApiUsage("Only ProxySpy derivates measure invocations")
+        return self.double._get_probe(self.name)
+
     def _was_called(self, context, times):
         invocation = Invocation(self.double, self.name, context)
         return self.double._received_invocation(invocation, times)
@@ -161,6 +528,20 @@ class Method(Observable):
         return retval
 
 
+class ObservedMethod(Method):
+    def __call__(self, *args, **kargs):
+        invocation = self._create_invocation(args, kargs)
+        retval = self.double._manage_invocation(invocation)
+
+        if not self.double._setting_up:
+            if self._event is not None:
+                self._event.set()
+            self.notify(*args, **kargs)
+
+        self._apply_deactivation(self.double)
+        return retval
+
+
 def func_returning(value=None):
     return lambda *args, **kargs: value
 
@@ -187,12 +568,16 @@ def func_raising(e):
 
 @total_ordering
 class Invocation(object):
+    expected_times = 1
+
     def __init__(self, double, name, context=None):
         self.double = double
         self.name = name
         self.context = context or InvocationContext()
         self.context.signature = double._proxy.get_signature(name)
         self.__delegate = func_returning(None)
+        self.__latency = None
+        self.__async_latency = False
 
     @classmethod
     def _from_args(cls, double, name, args=(), kargs={}):
@@ -201,44 +586,123 @@ class Invocation(object):
     def delegates(self, delegate):
         if isinstance(delegate, abc_Callable):
             self.__delegate = delegate
-            return
+            return self
 
         if isinstance(delegate, abc_Mapping):
             self.__delegate = delegate.get
-            return
+            return self
 
         try:
-            self.__delegate = functools.partial(six.next, iter(delegate))
+            self.__delegate = functools.partial(next, iter(delegate))
         except TypeError:
             reason = "delegates() must be called with callable or iterable instance (got '%s' instead)" % delegate
             raise WrongApiUsage(reason)
 
+        return self
+
     def returns(self, value):
         self.context.retval = value
-        self.delegates(func_returning(value))
+        return self.delegates(func_returning(value))
 
     def returns_input(self):
         if not self.context.args:
             raise TypeError("%s has no input args" % self)
 
-        self.delegates(func_returning_input(self))
+        return self.delegates(func_returning_input(self))
 
     def raises(self, e):
-        self.delegates(func_raising(e))
+        return self.delegates(func_raising(e))
+
+    def with_latency(self, latency, async_mode=False):
+        '''Delay the stub response. 'latency' may be a number of seconds, a
+        Latency instance or an iterable of per-call delays. In async_mode
+        the stub returns an awaitable instead of blocking.'''
+        try:
+            self.__latency = create_latency(latency)
+        except TypeError:
+            reason = "with_latency() must be called with number, Latency or iterable instance (got '%s' instead)" % latency
+            raise WrongApiUsage(reason)
+
+        self.__async_latency = async_mode
+        return self
 
     def times(self, n):
         if n < 1:
             raise WrongApiUsage("times must be >= 1. Use is_not(called()) for 0 times")
 
-        for i in range(1, n):
-            self.double._manage_invocation(self)
+        self.expected_times = n
 
     def _apply_stub(self, actual_invocation):
+        if self.__latency is None:
+            return actual_invocation.context.apply_on(self.__delegate)
+
+        if self.__async_latency:
+            return self._apply_stub_async(actual_invocation)
+
+        self.__latency.wait()
+        return actual_invocation.context.apply_on(self.__delegate)
+
+    async def _apply_stub_async(self, actual_invocation):
+        await self.__latency.wait_async()
         return actual_invocation.context.apply_on(self.__delegate)
 
     def _apply_on_collaborator(self):
         return self.double._proxy.perform_invocation(self)
 
+    def literal_key(self):
+        '''hashable (method, args, kargs) key when all arguments are literals,
+        None otherwise. Invocations with the same key are equal'''
+        retval = self.__dict__.get('_literal_key', UNSPECIFIED)
+        if retval is UNSPECIFIED:
+            retval = self._literal_key = self._get_literal_key()
+        return retval
+
+    def _get_literal_key(self):
+        context = self.context
+        if context.check_some_args or \
+                not all(is_literal(x) for x in context.args) or \
+                not all(is_literal(x) for x in context.kargs.values()):
+            return None
+
+        return (self.double._proxy.method_key(self.name),
+                context.args, frozenset(context.kargs.items()))
+
+    def canonical(self):
+        '''as literal_key() but with arguments bound to the collaborator
+        signature, so positional and keyword forms of a call are the same'''
+        retval = self.__dict__.get('_canonical', UNSPECIFIED)
+        if retval is UNSPECIFIED:
+            retval = self._canonical = self._get_canonical()
+        return retval
+
+    def _get_canonical(self):
+        key = self.literal_key()
+        if key is None:
+            return None
+
+        try:
+            call_args = self.context.signature.get_call_args(self.context)
+            values = frozenset((k, canonical_value(v)) for k, v in call_args.items())
+        except (TypeError, ValueError):
+            return None
+
+        return (key[0], values)
+
+    def exact_key(self):
+        '''as canonical() but equal only for arguments of the same types, so
+        no matcher can tell apart invocations with the same key'''
+        retval = self.__dict__.get('_exact_key', UNSPECIFIED)
+        if retval is UNSPECIFIED:
+            retval = self._exact_key = self._get_exact_key()
+        return retval
+
+    def _get_exact_key(self):
+        key = self.canonical()
+        if key is None:
+            return None
+
+        return (key[0], frozenset((k, typed_value(v)) for k, v in key[1]))
+
     def __eq__(self, other):
         return self.double._proxy.same_method(self.name, other.name) and \
             self.context.matches(other.context)
@@ -311,9 +775,12 @@ class InvocationContext(object):
         if all(isinstance(x, dict) for x in (a, b)):
             return cls._assert_kargs_match(a, b)
 
-        if isinstance(a, BaseMatcher):
+        if isinstance(a, base_matcher.BaseMatcher):
             a, b = b, a
 
+        if counters.enabled:
+            counters.incr(None, 'matcher_evaluations')
+
         hamcrest.assert_that(a, hamcrest.is_(b))
 
     @classmethod
@@ -358,6 +825,13 @@ class InvocationContext(object):
         return retval
 
     def matches(self, other):
+        if counters.enabled:
+            with counters.owner(getattr(self.signature, 'proxy', None)):
+                return self._matches(other)
+
+        return self._matches(other)
+
+    def _matches(self, other):
         if ANY_ARG.is_in(self.args):
             matcher, actual = self, other
         else:
@@ -375,6 +849,8 @@ class InvocationContext(object):
             self._assert_kargs_match(matcher_call_args, actual_call_args)
             return True
         except AssertionError:
+            if counters.enabled:
+                counters.incr(None, 'hamcrest_exceptions')
             return False
 
     def add_unspecifed_args(self, context):
@@ -412,14 +888,17 @@ class InvocationFormatter(object):
         self.context = context
 
     def __str__(self):
-        arg_values = self._format_args(self.context.args)
-        arg_values.extend(self._format_kargs(self.context.kargs))
-
-        retval = "(%s)" % str.join(', ', arg_values)
+        retval = self.format_call(self.context.args, self.context.kargs)
         if self.context.retval is not None:
             retval += "-> %s" % repr(self.context.retval)
         return retval
 
+    @classmethod
+    def format_call(cls, args, kargs):
+        arg_values = cls._format_args(args)
+        arg_values.extend(cls._format_kargs(kargs))
+        return "(%s)" % str.join(', ', arg_values)
+
     @classmethod
     def _format_args(cls, args):
         return [cls._format_value(arg) for arg in args]
@@ -431,7 +910,7 @@ class InvocationFormatter(object):
 
     @classmethod
     def _format_value(cls, arg):
-        if isinstance(arg, six.text_type):
+        if isinstance(arg, str):
             arg = get_string(arg)
 
         if isinstance(arg, (int, str, dict)):
@@ -440,6 +919,9 @@ class InvocationFormatter(object):
 
 
 class PropertyInvocation(Invocation):
+    def _get_literal_key(self):
+        return None
+
     def __eq__(self, other):
         return self.name == other.name
 
@@ -485,7 +967,7 @@ class Property(property, Observable):
         return self.double._manage_invocation(invocation)
 
     def get_value(self, obj):
-        if not self.double._setting_up:
+        if self.observers and not self.double._setting_up:
             self.notify()
 
         property_get = self.manage(PropertyGet(self.double, self.key))
@@ -501,7 +983,7 @@ class Property(property, Observable):
 
         if self.double._setting_up:
             invocation.returns(value)
-        else:
+        elif self.observers:
             self.notify(value)
 
         self._apply_deactivation(self.double)
@@ -537,9 +1019,61 @@ class AttributeFactory(object):
             hook(attr)
 
 
+class MethodSlot(object):
+    '''precompiled double method. The Method is created on first access
+    and then found in the instance dict'''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, double, owner=None):
+        if double is None:
+            return self
+
+        method = Method(double, self.name)
+        double.__dict__[self.name] = method
+        for hook in double._new_attr_hooks:
+            hook(method)
+
+        return method
+
+
+class PropertySlot(object):
+    '''precompiled double property. Delegates on a Property per instance,
+    so the class may be shared by all of them'''
+
+    def __init__(self, name):
+        self.name = name
+
+    def get_property(self, double):
+        try:
+            return double._properties[self.name]
+        except KeyError:
+            pass
+
+        prop = double._properties[self.name] = Property(double, self.name)
+        for hook in double._new_attr_hooks:
+            hook(prop)
+
+        return prop
+
+    def __get__(self, double, owner=None):
+        if double is None:
+            return self
+
+        return self.get_property(double).get_value(double)
+
+    def __set__(self, double, value):
+        self.get_property(double).set_value(double, value)
+
+
 class SpyBase(object):
     pass
 
 
+class ProxySpyBase(object):
+    pass
+
+
 class MockBase(object):
     pass
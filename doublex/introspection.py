@@ -0,0 +1,242 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+# doublex
+#
+# Copyright © 2012-2018 David Villa Alises
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Per collaborator class introspection results: attribute kinds and argument
+layouts. They are computed once per process and, when the cache is enabled,
+kept on disk across test runs. Each entry remembers the class attribute it
+was computed from and is computed again if that attribute is replaced.
+Entries are keyed by the module, qualified name and a fingerprint of the
+attributes and bytecode of every class in the MRO, so they are invalidated
+when any of them changes.
+'''
+
+import os
+import atexit
+import hashlib
+import weakref
+
+from .lazy import LazyModule
+
+inspect = LazyModule('inspect')
+json = LazyModule('json')
+tempfile = LazyModule('tempfile')
+
+
+__all__ = ['enable_introspection_cache', 'disable_introspection_cache',
+           'save_introspection_cache']
+
+
+ENVIRON_KEY = 'DOUBLEX_INTROSPECTION_CACHE'
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'doublex')
+
+_infos = weakref.WeakKeyDictionary()
+_store = None
+
+TABLES = ['typenames', 'kinds', 'layouts']
+MISSING = object()
+
+
+def static_attr(cls, name):
+    'the class attribute as stored, without running descriptors'
+    for klass in cls.__mro__:
+        try:
+            return vars(klass)[name]
+        except KeyError:
+            pass
+
+    return MISSING
+
+
+def identity(attr):
+    try:
+        return id(attr), weakref.ref(attr)
+    except TypeError:
+        return id(attr), None
+
+
+class ClassInfo(object):
+    def __init__(self, key=None, data=None):
+        data = data or {}
+        self.key = key
+        self.typenames = data.get('typenames', {})
+        self.kinds = data.get('kinds', {})
+        self.layouts = data.get('layouts', {})
+        self.owner = None
+        self.attrs = {}
+        self.dirty = False
+
+    def track(self, cls):
+        '''take the current class attributes as the ones the entries were
+        computed from'''
+        self.owner = weakref.ref(cls)
+        for table in TABLES:
+            for name in getattr(self, table):
+                self.attrs[name] = identity(static_attr(cls, name))
+
+    def get(self, table, name):
+        '''the entry for the attribute, None if there is not or the attribute
+        was replaced since it was computed'''
+        value = getattr(self, table).get(name)
+        if value is None or self.owner is None:
+            return value
+
+        ident, ref = self.attrs.get(name, (None, None))
+        attr = static_attr(self.owner(), name)
+        if id(attr) == ident and (ref is None or ref() is attr):
+            return value
+
+        self.forget(name)
+        return None
+
+    def forget(self, name):
+        for table in TABLES:
+            getattr(self, table).pop(name, None)
+
+        # the class does not match its fingerprint any more
+        self.key = None
+        self.dirty = False
+
+    def set(self, table, name, value):
+        getattr(self, table)[name] = value
+        if self.owner is not None:
+            self.attrs[name] = identity(static_attr(self.owner(), name))
+        self.dirty = self.key is not None
+        return value
+
+    def argspec(self, name, method):
+        '''inspect.getfullargspec() for the given collaborator method. Only
+        the layout is cached, defaults come from the actual function'''
+        func = getattr(method, '__func__', method)
+        if not inspect.isfunction(func):
+            return inspect.getfullargspec(method)
+
+        layout = self.get('layouts', name)
+        if layout is None:
+            spec = inspect.getfullargspec(method)
+            self.set('layouts', name, [list(spec.args), spec.varargs, spec.varkw,
+                                       list(spec.kwonlyargs)])
+            return spec
+
+        args, varargs, varkw, kwonlyargs = layout
+        return inspect.FullArgSpec(
+            list(args), varargs, varkw, func.__defaults__ or None,
+            list(kwonlyargs), func.__kwdefaults__ or None,
+            dict(func.__annotations__))
+
+    def to_dict(self):
+        return dict(typenames=self.typenames, kinds=self.kinds, layouts=self.layouts)
+
+
+def class_info(cls):
+    try:
+        return _infos[cls]
+    except KeyError:
+        pass
+    except TypeError:
+        return ClassInfo()
+
+    info = _store.load(cls) if _store else ClassInfo()
+    info.track(cls)
+    _infos[cls] = info
+    return info
+
+
+def bytecode_hash(cls):
+    digest = hashlib.sha1()
+    for name, attr in sorted(vars(cls).items()):
+        func = getattr(attr, '__func__', attr)
+        code = getattr(func, '__code__', None)
+        digest.update(("%s:%s" % (name, type(attr).__name__)).encode())
+        if code is not None:
+            digest.update(code.co_code)
+            digest.update(repr((code.co_varnames, code.co_argcount,
+                                code.co_kwonlyargcount, code.co_flags)).encode())
+
+    return digest.hexdigest()
+
+
+def fingerprint(cls):
+    parts = []
+    for klass in cls.__mro__:
+        parts.append("%s:%s" % (klass.__module__, klass.__qualname__))
+        if klass.__module__ != 'builtins':
+            parts.append(bytecode_hash(klass))
+
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()
+
+
+class DiskStore(object):
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def load(self, cls):
+        key = fingerprint(cls)
+        try:
+            with open(self.path(key)) as fd:
+                return ClassInfo(key, json.load(fd))
+        except (IOError, OSError, ValueError):
+            return ClassInfo(key)
+
+    def save(self, info):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as out:
+            json.dump(info.to_dict(), out)
+        os.replace(tmp, self.path(info.key))
+        info.dirty = False
+
+
+def enable_introspection_cache(directory=None):
+    '''keep collaborator introspection results in the given directory
+    (default: ~/.cache/doublex) across test runs'''
+    global _store
+    _store = DiskStore(directory or DEFAULT_DIR)
+    _infos.clear()
+
+
+def disable_introspection_cache():
+    global _store
+    save_introspection_cache()
+    _store = None
+    _infos.clear()
+
+
+def save_introspection_cache():
+    if _store is None:
+        return
+
+    for info in list(_infos.values()):
+        if info.dirty:
+            try:
+                _store.save(info)
+            except (IOError, OSError):
+                pass
+
+
+atexit.register(save_introspection_cache)
+
+if os.environ.get(ENVIRON_KEY):
+    enable_introspection_cache(os.environ[ENVIRON_KEY])
@@ -0,0 +1,141 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+# doublex
+#
+# Copyright © 2012-2018 David Villa Alises
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+import abc
+import random
+import numbers
+import bisect
+
+from .clock import get_clock
+
+
+__all__ = ['Fixed', 'Uniform', 'Exponential', 'Empirical', 'DelaySequence']
+
+
+class Latency(abc.ABC):
+    'delay applied by stubs before running their delegate'
+
+    @abc.abstractmethod
+    def next_delay(self):
+        pass
+
+    def wait(self):
+        get_clock().sleep(self.next_delay())
+
+    async def wait_async(self):
+        await get_clock().async_sleep(self.next_delay())
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, self.describe())
+
+    def describe(self):
+        return ''
+
+
+class Fixed(Latency):
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def next_delay(self):
+        return self.seconds
+
+    def describe(self):
+        return str(self.seconds)
+
+
+class Uniform(Latency):
+    def __init__(self, low, high, seed=None):
+        self.low = low
+        self.high = high
+        self.random = random.Random(seed)
+
+    def next_delay(self):
+        return self.random.uniform(self.low, self.high)
+
+    def describe(self):
+        return "%s, %s" % (self.low, self.high)
+
+
+class Exponential(Latency):
+    def __init__(self, mean, seed=None):
+        self.mean = mean
+        self.random = random.Random(seed)
+
+    def next_delay(self):
+        return self.random.expovariate(1.0 / self.mean)
+
+    def describe(self):
+        return "mean=%s" % self.mean
+
+
+class Empirical(Latency):
+    '''Delays following the given percentiles, ie: {50: 0.01, 99: 0.2}.
+    Values between percentiles are linearly interpolated.'''
+
+    def __init__(self, percentiles, seed=None):
+        if not percentiles:
+            raise ValueError("Empirical latency requires some percentile")
+
+        points = sorted(percentiles.items())
+        self.ranks = [p for p, _ in points]
+        self.delays = [d for _, d in points]
+        self.random = random.Random(seed)
+
+    def next_delay(self):
+        return self.delay_at(self.random.uniform(0, 100))
+
+    def delay_at(self, rank):
+        index = bisect.bisect_left(self.ranks, rank)
+        if index == 0:
+            return self.delays[0]
+
+        if index == len(self.ranks):
+            return self.delays[-1]
+
+        low, high = self.ranks[index - 1], self.ranks[index]
+        fraction = (rank - low) / float(high - low)
+        return self.delays[index - 1] + \
+            fraction * (self.delays[index] - self.delays[index - 1])
+
+    def describe(self):
+        return str(dict(zip(self.ranks, self.delays)))
+
+
+class DelaySequence(Latency):
+    'per-call delays. The last one is kept once the sequence is exhausted'
+
+    def __init__(self, delays):
+        self.delays = iter(delays)
+        self.last = 0
+
+    def next_delay(self):
+        self.last = next(self.delays, self.last)
+        return self.last
+
+
+def create_latency(spec):
+    if isinstance(spec, Latency):
+        return spec
+
+    if isinstance(spec, numbers.Real):
+        return Fixed(spec)
+
+    return DelaySequence(spec)
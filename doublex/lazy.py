@@ -0,0 +1,38 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+# doublex
+#
+# Copyright © 2012-2018 David Villa Alises
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import importlib
+
+
+class LazyModule(object):
+    '''Stands for a module that is imported when any of its attributes is
+    first required. Retrieved attributes are kept in the instance, so later
+    accesses cost a plain attribute lookup'''
+
+    def __init__(self, name):
+        self.__name = name
+
+    def __getattr__(self, key):
+        value = getattr(importlib.import_module(self.__name), key)
+        setattr(self, key, value)
+        return value
+
+    def __repr__(self):
+        return "<lazy module '%s'>" % self.__name
@@ -18,21 +18,31 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import abc
 import sys
-import time
+import heapq
+import bisect
 import hamcrest
 from hamcrest.core.matcher import Matcher
 from hamcrest.core.base_matcher import BaseMatcher
 from hamcrest import is_, instance_of
 
 from .internal import (
-    Method, InvocationContext, ANY_ARG, MockBase, SpyBase,
-    PropertyGet, PropertySet, WrongApiUsage, Invocation)
+    Method, InvocationContext, ANY_ARG, MockBase, SpyBase, ProxySpyBase,
+    PropertyGet, PropertySet, WrongApiUsage, Invocation, OperationList,
+    same_invocation, add_indent)
+from .pairing import unmatched_invocations, matches_any_call, tally
+from . import report
+from .clock import get_clock, to_ns
+from .metrics import max_calls_in_window, longest_burst, gap_bounds
 
 __all__ = ['called',
            'never',
+           'all_of_calls', 'called_in_order',
            'verify', 'any_order_verify',
            'property_got', 'property_set',
+           'max_concurrency', 'in_flight', 'took',
+           'call_rate', 'burst_size', 'max_gap', 'min_gap',
            'assert_that', 'wait_that',
            'is_', 'instance_of']
 
@@ -59,11 +69,12 @@ def wait_that(actual, matcher, reason='', delta=1, timeout=5):
     matches 'actual' or 'timeout' is reached.
     '''
     exc = None
-    init = time.time()
+    clock = get_clock()
+    init = clock.now()
     timeout_reached = False
     while 1:
         try:
-            if time.time() - init > timeout:
+            if clock.now() - init > timeout:
                 timeout_reached = True
                 break
 
@@ -71,11 +82,11 @@ def wait_that(actual, matcher, reason='', delta=1, timeout=5):
             break
 
         except AssertionError as e:
-            time.sleep(delta)
+            clock.sleep(delta)
             exc = e
 
     if timeout_reached:
-        msg = exc.args[0] + ' after {0} seconds'.format(timeout)
+        msg = str(exc.args[0]) + ' after {0} seconds'.format(timeout)
         exc.args = msg,
         raise exc
 
@@ -96,11 +107,15 @@ class MethodCalled(OperationMatcher):
         if not self._async_timeout:
             return method._was_called(self.context, self._times)
 
-        if self._async_timeout:
-            if self._times != any_time:
-                raise WrongApiUsage("'times' and 'async_mode' are exclusive")
-            self.method._event.wait(self._async_timeout)
+        if self._times != any_time:
+            raise WrongApiUsage("'times' and 'async_mode' are exclusive")
+
+        # the event must exist before checking, or a call in between is lost
+        event = method._get_event()
+        if method._was_called(self.context, self._times):
+            return True
 
+        get_clock().wait(event, self._async_timeout)
         return method._was_called(self.context, self._times)
 
     def _assure_is_spied_method(self, method):
@@ -118,6 +133,21 @@ class MethodCalled(OperationMatcher):
         description.append_text("calls that actually ocurred were:\n")
         description.append_text(self.method.double._recorded.show(indent=10))
 
+        closest = self._closest_calls()
+        if closest:
+            description.append_text("\n     closest calls to %s were:\n" % self.method)
+            description.append_text(
+                str.join('\n', [add_indent(x, 10) for x in closest]))
+
+    def _closest_calls(self):
+        'calls to the method, when none of them has the expected arguments'
+        if ANY_ARG.is_in(self.context.args) or not report.closest:
+            return None
+
+        expected = Invocation(self.method.double, self.method.name, self.context)
+        recorded = self.method.double._recorded
+        return report.closest_calls(expected, recorded._candidates(expected))
+
     def with_args(self, *args, **kargs):
         self.context.update_args(args, kargs)
         return self
@@ -162,21 +192,189 @@ class never(BaseMatcher):
         self.matcher.describe_mismatch(actual, description)
 
 
+class all_of_calls(BaseMatcher):
+    '''check many (spy method, matcher) pairs at once. called() matchers,
+    even within never(), are evaluated together in a single pass over the
+    spy recorded invocations'''
+    def __init__(self, items):
+        self.items = list(items)
+        for item in self.items:
+            if not isinstance(item, tuple) or len(item) != 2 or \
+                    not isinstance(item[1], Matcher):
+                raise WrongApiUsage("takes (method, matcher) pairs (got %s instead)" %
+                                    type(item).__name__)
+
+    def _matches(self, spy):
+        if not isinstance(spy, SpyBase):
+            raise WrongApiUsage("takes Spy instance (got %s instead)" % spy)
+
+        self.spy = spy
+        failed = set()
+        batched = []
+        for index, (method, matcher) in enumerate(self.items):
+            called = matcher.matcher if isinstance(matcher, never) else matcher
+            if isinstance(called, MethodCalled) and not called._async_timeout and \
+                    isinstance(method, Method) and method.double is spy:
+                batched.append((index, matcher, called))
+            elif not matcher.matches(method):
+                failed.add(index)
+
+        invocations = [Invocation(spy, self.items[index][0].name, called.context)
+                       for index, matcher, called in batched]
+        counts = tally(invocations, spy._recorded)
+        for (index, matcher, called), count in zip(batched, counts):
+            if is_(called._times).matches(count) != (matcher is called):
+                failed.add(index)
+
+        self.batched = set(index for index, matcher, called in batched)
+        self.failed = sorted(failed)
+        return not self.failed
+
+    def describe_to(self, description):
+        description.append_text("all these calls:\n")
+        for i, index in enumerate(self.failed):
+            method, matcher = self.items[index]
+            if i:
+                description.append_text('\n')
+
+            prefix = ''
+            if isinstance(matcher, never):
+                prefix = 'none of '
+                matcher = matcher.matcher
+
+            if index not in self.batched:
+                description.append_text(add_indent(prefix, 10))
+                description.append_description_of(matcher)
+                continue
+
+            text = "%s%s%s" % (prefix, method._show(), matcher.context)
+            if matcher._times != any_time:
+                text += ' -- times: %s' % matcher._times
+            description.append_text(add_indent(text, 10))
+
+    def describe_mismatch(self, actual, description):
+        description.append_text("calls that actually ocurred were:\n")
+        description.append_text(self.spy._recorded.show(indent=10))
+
+
+class called_in_order(BaseMatcher):
+    '''the given spy methods were called in that order, maybe along with
+    other calls. Items may also be (method, called()) pairs. Calls to any
+    double are ordered by their sequence number'''
+    def _matches(self, items):
+        self.expected = [self._to_invocation(x) for x in items]
+        if not self.expected:
+            raise WrongApiUsage("takes a list of spy methods")
+
+        self.failed = None
+        last = -1
+        for index, invocation in enumerate(self.expected):
+            last = self._next_call(invocation, last)
+            if last is None:
+                self.failed = index
+                return False
+
+        return True
+
+    @classmethod
+    def _to_invocation(cls, item):
+        method, matcher = item if isinstance(item, tuple) else (item, called())
+        if not isinstance(method, Method) or not isinstance(method.double, SpyBase):
+            raise WrongApiUsage("takes spy methods (got %s instead)" % method)
+
+        if type(matcher) is not MethodCalled or matcher._times != any_time:
+            raise WrongApiUsage("takes called() matchers, without times()")
+
+        return Invocation(method.double, method.name, matcher.context)
+
+    @classmethod
+    def _next_call(cls, invocation, last):
+        '''sequence number of the first call after the given one. Only the
+        calls to the method are searched, from that point on'''
+        record = invocation.double._recorded
+        method = record._methods.get(record._key(invocation))
+        if method is None:
+            return None
+
+        start = bisect.bisect_right(method.sequence, last)
+        if matches_any_call(invocation):
+            return method.sequence[start] if start < len(method.sequence) else None
+
+        for index in range(start, len(method.invocations)):
+            if same_invocation(invocation, method.invocations[index]):
+                return method.sequence[index]
+
+        return None
+
+    def describe_to(self, description):
+        description.append_text("calls in this order:\n")
+        description.append_text(str.join('\n', [x._show(indent=10) for x in self.expected]))
+
+    def describe_mismatch(self, actual, description):
+        invocation = self.expected[self.failed]
+        if self.failed:
+            description.append_text("%s was not called after %s\n" % (
+                invocation, self.expected[self.failed - 1]))
+        else:
+            description.append_text("%s was not called\n" % invocation)
+
+        description.append_text("     calls that actually ocurred were:\n")
+        description.append_text(self._calls().show(indent=10))
+
+    def _calls(self):
+        'recorded calls to the given methods, merged by sequence number'
+        methods = {}
+        for invocation in self.expected:
+            record = invocation.double._recorded
+            method = record._methods.get(record._key(invocation))
+            if method is not None:
+                methods[id(method)] = method
+
+        merged = heapq.merge(*[zip(x.sequence, x.invocations) for x in methods.values()],
+                             key=lambda x: x[0])
+        return OperationList(invocation for number, invocation in merged)
+
+
 class MockIsExpectedInvocation(BaseMatcher):
-    'assert the invocation is a mock expectation'
+    'assert the invocation is a pending mock expectation, and take it'
     def __init__(self, invocation):
         self.invocation = invocation
 
     def _matches(self, mock):
         self.mock = mock
-        return self.invocation in mock._stubs
+        return mock._expectations.consume(self.invocation)
 
     def describe_to(self, description):
         description.append_text("these calls:\n")
         description.append_text(self.mock._stubs.show(indent=10))
 
     def describe_mismatch(self, actual, description):
-        description.append_text("this call was not expected:\n")
+        if self.invocation in self.mock._stubs:
+            description.append_text("this call was expected fewer times:\n")
+        else:
+            description.append_text("this call was not expected:\n")
+        description.append_text(self.invocation._show(indent=10))
+
+
+class MockIsNextInvocation(BaseMatcher):
+    'assert the invocation is the next expectation of a strict mock'
+    def __init__(self, invocation):
+        self.invocation = invocation
+
+    def _matches(self, mock):
+        self.position, self.expected, taken = mock._take_next(self.invocation)
+        return taken
+
+    def describe_to(self, description):
+        if self.expected is None:
+            description.append_text("no more calls after %s" % self.position)
+            return
+
+        description.append_text("call #%s to be:\n" % (self.position + 1))
+        description.append_text(self.expected._show(indent=10))
+
+    def describe_mismatch(self, actual, description):
+        description.append_text("this call was received:\n")
         description.append_text(self.invocation._show(indent=10))
 
 
@@ -189,7 +387,7 @@ class verify(BaseMatcher):
         return self._expectations_match()
 
     def _expectations_match(self):
-        return self.mock._stubs == self.mock._recorded
+        return self.mock._expectations_met()
 
     def describe_to(self, description):
         description.append_text("these calls:\n")
@@ -202,7 +400,15 @@ class verify(BaseMatcher):
 
 class any_order_verify(verify):
     def _expectations_match(self):
-        return sorted(self.mock._stubs) == sorted(self.mock._recorded)
+        stubs, recorded = self.mock._stubs, self.mock._recorded
+        self.unmatched = unmatched_invocations(stubs.expanded(), recorded)
+        return not self.unmatched and stubs.expected_count() == len(recorded)
+
+    def describe_mismatch(self, actual, description):
+        super(any_order_verify, self).describe_mismatch(actual, description)
+        if self.unmatched:
+            description.append_text('\n     expectations not matched:\n')
+            description.append_text(OperationList(self.unmatched).show(indent=10))
 
 
 class property_got(OperationMatcher):
@@ -262,3 +468,165 @@ class property_set(OperationMatcher):
     def describe_mismatch(self, actual, description):
         description.append_text('calls that actually ocurred were:\n')
         description.append_text(self.double._recorded.show(indent=10))
+
+
+def assure_is_proxied_method(method):
+    if not isinstance(method, Method) or not isinstance(method.double, ProxySpyBase):
+        raise WrongApiUsage("takes a ProxySpy method (got %s instead)" % method)
+
+
+class MeasureMatcher(OperationMatcher, abc.ABC):
+    '''checks a single value measured on a method'''
+    title = None
+
+    def __init__(self, value):
+        self.value = value
+
+    def _matches(self, method):
+        self._assure_is_valid_method(method)
+        self.method = method
+        self.measured = self._measure(method)
+        if self.measured is None:
+            return False
+
+        return hamcrest.is_(self.value).matches(self.measured)
+
+    def _assure_is_valid_method(self, method):
+        pass
+
+    @abc.abstractmethod
+    def _measure(self, method):
+        pass
+
+    def describe_to(self, description):
+        description.append_text('%s of %s: ' % (self.title, self.method))
+        description.append_description_of(hamcrest.is_(self.value))
+
+    def describe_mismatch(self, actual, description):
+        description.append_text('was %s' % self.measured)
+
+
+class max_concurrency(MeasureMatcher):
+    'peak of simultaneous invocations to a ProxySpy method'
+    title = 'peak concurrency'
+
+    def _assure_is_valid_method(self, method):
+        assure_is_proxied_method(method)
+
+    def _measure(self, method):
+        return method.concurrency.peak
+
+
+class in_flight(max_concurrency):
+    'invocations to a ProxySpy method running right now'
+    title = 'in-flight calls'
+
+    def _measure(self, method):
+        return method.concurrency.current
+
+
+class TimingMatcher(MeasureMatcher):
+    '''computed over the invocation timestamps of a spy method. Timestamps
+    are not recorded by default, see record_timestamps()'''
+
+    def _assure_is_valid_method(self, method):
+        if not isinstance(method, Method) or not isinstance(method.double, SpyBase):
+            raise WrongApiUsage("takes a spy method (got %s instead)" % method)
+
+
+class call_rate(TimingMatcher):
+    '''max amount of calls in any 'per' seconds sliding window, ie:
+    call_rate(at_most(100), per=1)'''
+
+    def __init__(self, value, per=1):
+        super(call_rate, self).__init__(value)
+        self.per = per
+        self.title = 'calls per %s seconds' % per
+
+    def _measure(self, method):
+        return max_calls_in_window(method.timestamps, to_ns(self.per))
+
+
+class burst_size(TimingMatcher):
+    '''longest run of calls closer than 'gap' seconds to the previous one'''
+
+    def __init__(self, value, gap):
+        super(burst_size, self).__init__(value)
+        self.gap = gap
+        self.title = 'burst size (gap %s seconds)' % gap
+
+    def _measure(self, method):
+        return longest_burst(method.timestamps, to_ns(self.gap))
+
+
+class max_gap(TimingMatcher):
+    '''longest time (seconds) between consecutive calls, ie:
+    max_gap(at_most(0.2))'''
+    title = 'longest gap between calls'
+
+    def _measure(self, method):
+        gap = gap_bounds(method.timestamps)[1]
+        return None if gap is None else gap / 1e9
+
+
+class min_gap(TimingMatcher):
+    '''shortest time (seconds) between consecutive calls'''
+    title = 'shortest gap between calls'
+
+    def _measure(self, method):
+        gap = gap_bounds(method.timestamps)[0]
+        return None if gap is None else gap / 1e9
+
+
+class took(OperationMatcher):
+    '''latency distribution of a ProxySpy method, ie:
+    took(p99=less_than(0.05), max=less_than(1))'''
+
+    def __init__(self, **stats):
+        if not stats:
+            raise WrongApiUsage("took() requires some statistic (p50, p99, max...)")
+
+        self.stats = dict((name, hamcrest.is_(value))
+                          for name, value in stats.items())
+        for name in self.stats:
+            self._get_stat(None, name)
+
+    @classmethod
+    def _get_stat(cls, histogram, name):
+        if name in ['count', 'max', 'min', 'mean']:
+            return getattr(histogram, name, None)
+
+        digits = name[1:]
+        if name[:1] == 'p' and digits.isdigit():
+            if int(digits) <= 100:
+                percentile = float(digits)
+            elif digits.startswith('99'):
+                percentile = float('99.' + digits[2:])
+            else:
+                raise WrongApiUsage("unknown latency statistic '%s'" % name)
+
+            return histogram and histogram.percentile(percentile)
+
+        raise WrongApiUsage("unknown latency statistic '%s'" % name)
+
+    def _matches(self, method):
+        assure_is_proxied_method(method)
+        self.method = method
+        self.failed = []
+        histogram = method.latency
+        for name, matcher in sorted(self.stats.items()):
+            value = self._get_stat(histogram, name)
+            if not matcher.matches(value):
+                self.failed.append((name, value))
+
+        return not self.failed
+
+    def describe_to(self, description):
+        description.append_text('latency of %s:' % self.method)
+        for name, matcher in sorted(self.stats.items()):
+            description.append_text('\n          %s ' % name)
+            description.append_description_of(matcher)
+
+    def describe_mismatch(self, actual, description):
+        description.append_text(', '.join(
+            '%s was %s' % (name, value) for name, value in self.failed))
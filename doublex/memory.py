@@ -0,0 +1,278 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+# doublex
+#
+# Copyright © 2012-2018 David Villa Alises
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Approximate memory retained by a double: recorded invocations, stubbed
+invocations, method objects and the per-instance cloned class (precompiled
+doubles share their class). Each object
+is counted once, shared arguments are attributed to the first method that
+holds them.
+'''
+
+import sys
+import copy
+import heapq
+import types
+import reprlib
+import tracemalloc
+
+from .internal import Method, Property
+
+
+__all__ = ['memory_report']
+
+
+OPAQUE = (type, types.ModuleType, types.FunctionType, types.MethodType,
+          types.BuiltinFunctionType)
+
+# copying these runs no user code
+PLAIN = frozenset([str, bytes, bytearray, int, float, complex, bool, type(None),
+                   list, tuple, dict, set, frozenset, object])
+
+
+class Sizer(object):
+    '''deep sys.getsizeof(). In precise mode argument values made of builtin
+    types only are measured as the memory tracemalloc sees allocated by a
+    deep copy of them. User objects are never copied'''
+
+    def __init__(self, double, precise=False):
+        self.precise = precise
+        self.seen = set([id(double), id(double.__dict__.get('_proxy'))])
+
+    def shallow(self, *objs):
+        retval = 0
+        for obj in objs:
+            if id(obj) not in self.seen:
+                self.seen.add(id(obj))
+                retval += sys.getsizeof(obj)
+        return retval
+
+    def deep(self, obj):
+        total = 0
+        pending = [obj]
+        while pending:
+            obj = pending.pop()
+            if id(obj) in self.seen:
+                continue
+
+            self.seen.add(id(obj))
+            total += sys.getsizeof(obj)
+            if isinstance(obj, OPAQUE):
+                continue
+
+            if isinstance(obj, dict):
+                pending.extend(obj.keys())
+                pending.extend(obj.values())
+            elif isinstance(obj, (list, tuple, set, frozenset)):
+                pending.extend(obj)
+
+            try:
+                pending.append(object.__getattribute__(obj, '__dict__'))
+            except AttributeError:
+                pass
+
+        return total
+
+    def value(self, obj):
+        if not self.precise or id(obj) in self.seen or not is_plain(obj):
+            return self.deep(obj)
+
+        try:
+            size = traced_size(obj)
+        except Exception:
+            return self.deep(obj)
+
+        self.deep(obj)
+        return size
+
+
+def is_plain(obj):
+    seen = set()
+    pending = [obj]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+
+        seen.add(id(obj))
+        if type(obj) not in PLAIN:
+            return False
+
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+
+    return True
+
+
+def traced_size(obj):
+    before = tracemalloc.get_traced_memory()[0]
+    clone = copy.deepcopy(obj)
+    retval = tracemalloc.get_traced_memory()[0] - before
+    del clone
+    return max(retval, sys.getsizeof(obj))
+
+
+class MethodFootprint(object):
+    def __init__(self, name):
+        self.name = name
+        self.recorded = 0
+        self.stubbed = 0
+        self.bytes = 0
+
+    def __repr__(self):
+        return "<%s: recorded=%s stubbed=%s bytes=%s>" % (
+            self.name, self.recorded, self.stubbed, self.bytes)
+
+
+class MemoryReport(object):
+    def __init__(self, double, top=5):
+        self.double = double
+        self.methods = {}
+        self.class_bytes = 0
+        self.overhead_bytes = 0
+        self.largest = []
+        self._top = top
+
+    def to_method(self, name):
+        try:
+            return self.methods[name]
+        except KeyError:
+            return self.methods.setdefault(name, MethodFootprint(name))
+
+    def add_argument(self, size, name, value):
+        item = (size, len(self.largest), name, value)
+        if len(self.largest) < self._top:
+            heapq.heappush(self.largest, item)
+        elif size > self.largest[0][0]:
+            heapq.heapreplace(self.largest, item)
+
+    @property
+    def largest_arguments(self):
+        'the biggest retained argument values as (bytes, method name, repr)'
+        return [(size, name, reprlib.repr(value))
+                for size, _, name, value in sorted(self.largest, reverse=True)]
+
+    @property
+    def total(self):
+        return sum(x.bytes for x in self.methods.values()) + \
+            self.class_bytes + self.overhead_bytes
+
+    def __str__(self):
+        lines = ["%s retains ~%s bytes" % (self.double._classname(), self.total)]
+        for m in sorted(self.methods.values(), key=lambda x: -x.bytes):
+            lines.append("  %-20s recorded: %-8s stubbed: %-6s bytes: %s" % (
+                m.name, m.recorded, m.stubbed, m.bytes))
+        lines.append("  %-20s bytes: %s" % ('(class)', self.class_bytes))
+        lines.append("  %-20s bytes: %s" % ('(overhead)', self.overhead_bytes))
+
+        if self.largest:
+            lines.append("largest arguments:")
+            for size, name, value in self.largest_arguments:
+                lines.append("  %s bytes in %s: %s" % (size, name, value))
+
+        return str.join('\n', lines)
+
+
+def memory_report(double, precise=False, top=5):
+    '''per method breakdown of the memory retained by the given double. In
+    'precise' mode argument values are measured with tracemalloc'''
+    tracing = tracemalloc.is_tracing()
+    if precise and not tracing:
+        tracemalloc.start()
+
+    try:
+        return _build_report(double, Sizer(double, precise), top)
+    finally:
+        if precise and not tracing:
+            tracemalloc.stop()
+
+
+def _build_report(double, sizer, top):
+    report = MemoryReport(double, top)
+    attrs = double.__dict__
+
+    for record, field in [(attrs.get('_recorded'), 'recorded'),
+                          (attrs.get('_stubs'), 'stubbed')]:
+        if record is None:
+            continue
+
+        report.overhead_bytes += sizer.shallow(record, record._methods)
+        for method_record in record._methods.values():
+            invocations = method_record.invocations
+            if not invocations:
+                continue
+
+            footprint = report.to_method(invocations[0].name)
+            setattr(footprint, field, getattr(footprint, field) + len(invocations))
+            footprint.bytes += sizer.shallow(
+                method_record, invocations, method_record.sequence,
+                method_record.timestamps)
+            for invocation in invocations:
+                footprint.bytes += _invocation_size(report, sizer, invocation)
+
+    for name, attr in list(attrs.items()):
+        if isinstance(attr, Method):
+            report.to_method(name).bytes += _attr_size(sizer, attr)
+
+    cls = type(double)
+    properties = list(vars(cls).items()) + list(attrs.get('_properties', {}).items())
+    for name, attr in properties:
+        if isinstance(attr, Property):
+            report.to_method(name).bytes += _attr_size(sizer, attr)
+
+    if not double._precompiled:
+        report.class_bytes = sizer.shallow(cls) + sys.getsizeof(dict(vars(cls)))
+
+    return report
+
+
+def _invocation_size(report, sizer, invocation):
+    context = invocation.context
+    retval = sizer.shallow(invocation, invocation.__dict__, context, context.__dict__)
+
+    retval += sizer.shallow(context.args, context.kargs)
+    values = list(context.args) + list(context.kargs.values())
+    if getattr(invocation, 'value', None) is not None:
+        values.append(invocation.value)
+
+    for value in values:
+        size = sizer.value(value)
+        retval += size
+        if size:
+            report.add_argument(size, invocation.name, value)
+
+    # cached keys (see Invocation.canonical()) hold the same values
+    for key, value in invocation.__dict__.items():
+        if key not in ('double', 'context', 'name'):
+            retval += sizer.deep(value)
+
+    return retval + sizer.value(context.retval)
+
+
+def _attr_size(sizer, attr):
+    retval = sizer.shallow(attr, attr.__dict__, attr.observers)
+    for key, value in attr.__dict__.items():
+        if key not in ('double', 'observers'):
+            retval += sizer.deep(value)
+
+    return retval
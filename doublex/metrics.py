@@ -0,0 +1,222 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+# doublex
+#
+# Copyright © 2012-2018 David Villa Alises
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+import math
+import threading
+
+from .clock import get_clock
+from .internal import SpyBase, WrongApiUsage
+
+
+class ConcurrencyGauge(object):
+    'in-flight calls to a collaborator method'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+
+    def enter(self):
+        with self._lock:
+            self.current += 1
+            if self.current > self.peak:
+                self.peak = self.current
+
+    def exit(self):
+        with self._lock:
+            self.current -= 1
+
+    def __repr__(self):
+        return "<in-flight: %s, peak: %s>" % (self.current, self.peak)
+
+
+class LatencyHistogram(object):
+    '''HDR-like histogram: nanosecond values are grouped in log2 ranges split
+    in 2**(sub_bits-1) linear buckets, so relative error is below
+    1/2**(sub_bits-1) and the number of buckets is bounded.'''
+
+    sub_bits = 7
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+
+    @classmethod
+    def bucket_index(cls, value):
+        shift = value.bit_length() - cls.sub_bits
+        if shift <= 0:
+            return value
+
+        return (shift << (cls.sub_bits - 1)) + (value >> shift)
+
+    @classmethod
+    def bucket_highest(cls, index):
+        if index < 1 << cls.sub_bits:
+            return index
+
+        shift = (index >> (cls.sub_bits - 1)) - 1
+        mantissa = index - (shift << (cls.sub_bits - 1))
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, seconds):
+        self.record_ns(int(seconds * 1e9))
+
+    def record_ns(self, value):
+        value = max(0, value)
+        index = self.bucket_index(value)
+        with self._lock:
+            self._buckets[index] = self._buckets.get(index, 0) + 1
+            self.count += 1
+            self.total_ns += value
+            if self.min_ns is None or value < self.min_ns:
+                self.min_ns = value
+            if value > self.max_ns:
+                self.max_ns = value
+
+    def percentile_ns(self, percentile):
+        if not self.count:
+            return 0
+
+        with self._lock:
+            buckets = sorted(self._buckets.items())
+            count = self.count
+
+        rank = max(1, int(math.ceil(percentile / 100.0 * count)))
+        seen = 0
+        for index, amount in buckets:
+            seen += amount
+            if seen >= rank:
+                break
+
+        value = self.bucket_highest(index)
+        return min(max(value, self.min_ns), self.max_ns)
+
+    def percentile(self, percentile):
+        return self.percentile_ns(percentile) / 1e9
+
+    @property
+    def p50(self):
+        return self.percentile(50)
+
+    @property
+    def p90(self):
+        return self.percentile(90)
+
+    @property
+    def p99(self):
+        return self.percentile(99)
+
+    @property
+    def max(self):
+        return self.max_ns / 1e9
+
+    @property
+    def min(self):
+        return (self.min_ns or 0) / 1e9
+
+    @property
+    def mean(self):
+        if not self.count:
+            return 0
+        return self.total_ns / 1e9 / self.count
+
+    def __repr__(self):
+        return "<count: %s, p50: %s, p90: %s, p99: %s, max: %s>" % (
+            self.count, self.p50, self.p90, self.p99, self.max)
+
+
+class CallProbe(object):
+    'what ProxySpy measures for each collaborator method'
+
+    def __init__(self):
+        self.concurrency = ConcurrencyGauge()
+        self.latency = LatencyHistogram()
+
+    def enter(self):
+        self.concurrency.enter()
+        return get_clock().now_ns()
+
+    def exit(self, start):
+        self.latency.record_ns(get_clock().now_ns() - start)
+        self.concurrency.exit()
+
+
+def record_timestamps(spy, enabled=True):
+    'record when each call happens, see call_rate(), burst_size() and max_gap()'
+    if not isinstance(spy, SpyBase):
+        raise WrongApiUsage("record_timestamps() takes a spy, '%s' given" % spy)
+
+    spy._recorded.timestamps = enabled
+
+
+def in_order(timestamps):
+    for i in range(1, len(timestamps)):
+        if timestamps[i] < timestamps[i - 1]:
+            return sorted(timestamps)
+
+    return timestamps
+
+
+def max_calls_in_window(timestamps, window_ns):
+    'max amount of calls within any sliding window of the given width'
+    timestamps = in_order(timestamps)
+    retval = first = 0
+    for last, stamp in enumerate(timestamps):
+        while stamp - timestamps[first] >= window_ns:
+            first += 1
+        retval = max(retval, last - first + 1)
+
+    return retval
+
+
+def longest_burst(timestamps, gap_ns):
+    'longest run of calls separated by no more than the given gap'
+    timestamps = in_order(timestamps)
+    if not timestamps:
+        return 0
+
+    retval = current = 1
+    for i in range(1, len(timestamps)):
+        if timestamps[i] - timestamps[i - 1] <= gap_ns:
+            current += 1
+            retval = max(retval, current)
+        else:
+            current = 1
+
+    return retval
+
+
+def gap_bounds(timestamps):
+    'shortest and longest time between consecutive calls'
+    timestamps = in_order(timestamps)
+    shortest = longest = None
+    for i in range(1, len(timestamps)):
+        gap = timestamps[i] - timestamps[i - 1]
+        if shortest is None or gap < shortest:
+            shortest = gap
+        if longest is None or gap > longest:
+            longest = gap
+
+    return shortest, longest
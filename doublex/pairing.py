@@ -0,0 +1,339 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+# doublex
+#
+# Copyright © 2012-2018 David Villa Alises
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+One to one pairing of expected and actual invocations regardless of their
+order (maximum bipartite matching). Invocations with the same exact key (or
+the same invocation repeated) are interchangeable, so they are collapsed into
+a single node with a count and
+literal expectations are paired by hash. Matchers are only evaluated for
+expectations that could not be paired that way, once per distinct actual
+invocation.
+'''
+
+from collections import deque
+
+from .internal import ANY_ARG, same_invocation
+
+
+def method_key(invocation):
+    return invocation.double._proxy.method_key(invocation.name)
+
+
+class Node(object):
+    def __init__(self, invocation):
+        self.invocation = invocation
+        self.invocations = [invocation]
+        self.flow = {}
+        self.used = 0
+
+    @property
+    def size(self):
+        return len(self.invocations)
+
+
+def collapse(invocations):
+    nodes = []
+    by_key = {}
+    for invocation in invocations:
+        key = invocation.exact_key()
+        if key is None:
+            key = id(invocation)
+
+        if key in by_key:
+            by_key[key].invocations.append(invocation)
+        else:
+            by_key[key] = node = Node(invocation)
+            nodes.append(node)
+
+    return nodes
+
+
+class Pairing(object):
+    def __init__(self, expected, actual):
+        self.expected = collapse(expected)
+        self.actual = collapse(actual)
+        self.per_method = {}
+        self.per_canonical = {}
+        self.expected_per_method = {}
+        self.expected_per_canonical = {}
+        self.actual_keys = {}
+        self.edges = {}
+        self.reverse_edges = {}
+        self.checked = {}
+
+        for node in self.actual:
+            self._index(node, self.per_method, self.per_canonical)
+            key = node.invocation.exact_key()
+            if key is not None:
+                self.actual_keys[key] = node
+
+        for node in self.expected:
+            self._index(node, self.expected_per_method, self.expected_per_canonical)
+
+        self._pair_by_key()
+        for node in self.expected:
+            while node.used < node.size and \
+                    (self._pair_with_free(node) or self._augment(node)):
+                pass
+
+    @staticmethod
+    def _index(node, per_method, per_canonical):
+        per_method.setdefault(method_key(node.invocation), []).append(node)
+        key = node.invocation.canonical()
+        if key is not None:
+            per_canonical.setdefault(key, []).append(node)
+
+    def _pair_by_key(self):
+        for node in self.expected:
+            for other in self.per_canonical.get(node.invocation.canonical(), []):
+                self._add_flow(node, other, min(node.size - node.used,
+                                                other.size - other.used))
+
+    def _add_flow(self, node, other, amount):
+        if not amount:
+            return
+
+        for x, y in [(node, other), (other, node)]:
+            x.used += amount
+            x.flow[y] = x.flow.get(y, 0) + amount
+            if not x.flow[y]:
+                del x.flow[y]
+
+    def _candidates(self, node, per_method=None, per_canonical=None):
+        if per_method is None:
+            per_method, per_canonical = self.per_method, self.per_canonical
+        invocation = node.invocation
+        key = invocation.canonical()
+        retval = list(per_canonical.get(key, [])) if key is not None else []
+        for other in per_method.get(method_key(invocation), []):
+            if key is None or other.invocation.canonical() is None:
+                retval.append(other)
+        return retval
+
+    def _pairs(self, node, other):
+        key = node.invocation.canonical()
+        if key is not None and key == other.invocation.canonical():
+            return True
+
+        try:
+            return self.checked[node, other]
+        except KeyError:
+            retval = same_invocation(node.invocation, other.invocation)
+            self.checked[node, other] = retval
+            return retval
+
+    def _pair_with_free(self, node):
+        'no need to look for a path when there is a free actual invocation'
+        for other in self._candidates(node):
+            if other.used < other.size and self._pairs(node, other):
+                self._add_flow(node, other, 1)
+                return True
+
+        return False
+
+    def _adjacent(self, node):
+        'actual nodes the expected node may be paired with'
+        try:
+            return self.edges[node]
+        except KeyError:
+            pass
+
+        retval = [x for x in self._candidates(node) if self._pairs(node, x)]
+        self.edges[node] = retval
+        return retval
+
+    def _augment(self, source):
+        'pair one more invocation of source, moving others if required'
+        parent = {source: None}
+        pending = deque([source])
+        while pending:
+            node = pending.popleft()
+            for other in self._adjacent(node):
+                if other in parent:
+                    continue
+
+                parent[other] = node
+                if other.used < other.size:
+                    self._apply(parent, other)
+                    return True
+
+                for holder in other.flow:
+                    if holder not in parent:
+                        parent[holder] = other
+                        pending.append(holder)
+
+        return False
+
+    def _apply(self, parent, node):
+        while parent[node] is not None:
+            expected = parent[node]
+            self._add_flow(expected, node, 1)
+            node = parent[expected]
+            if node is None:
+                break
+
+            self._add_flow(expected, node, -1)
+
+    def add(self, invocation):
+        '''pair one more actual invocation, moving the others if required.
+        It is left out when it can not be paired'''
+        node, created = self._add_actual(invocation)
+        if self._augment_actual(node):
+            return True
+
+        node.invocations.pop()
+        if created:
+            self._remove_actual(node)
+        return False
+
+    def _add_actual(self, invocation):
+        key = invocation.exact_key()
+        node = self.actual_keys.get(key) if key is not None else None
+        if node is not None:
+            node.invocations.append(invocation)
+            return node, False
+
+        node = Node(invocation)
+        self.actual.append(node)
+        self._index(node, self.per_method, self.per_canonical)
+        if key is not None:
+            self.actual_keys[key] = node
+
+        for expected in self._reverse_adjacent(node):
+            if expected in self.edges:
+                self.edges[expected].append(node)
+
+        return node, True
+
+    def _remove_actual(self, node):
+        'undo _add_actual() of a new node, it is the last one everywhere'
+        self.actual.pop()
+        self.per_method[method_key(node.invocation)].pop()
+        if node.invocation.canonical() is not None:
+            self.per_canonical[node.invocation.canonical()].pop()
+        self.actual_keys.pop(node.invocation.exact_key(), None)
+        for expected in self.reverse_edges.pop(node):
+            if expected in self.edges:
+                self.edges[expected].pop()
+
+    def _reverse_adjacent(self, node):
+        'expected nodes the actual node may be paired with'
+        try:
+            return self.reverse_edges[node]
+        except KeyError:
+            pass
+
+        retval = [x for x in self._candidates(node, self.expected_per_method,
+                                              self.expected_per_canonical)
+                  if self._pairs(x, node)]
+        self.reverse_edges[node] = retval
+        return retval
+
+    def _augment_actual(self, source):
+        'pair one more invocation of the actual source node'
+        parent = {source: None}
+        pending = deque([source])
+        while pending:
+            node = pending.popleft()
+            for other in self._reverse_adjacent(node):
+                if other in parent:
+                    continue
+
+                parent[other] = node
+                if other.used < other.size:
+                    self._apply_actual(parent, other)
+                    return True
+
+                for holder in other.flow:
+                    if holder not in parent:
+                        parent[holder] = other
+                        pending.append(holder)
+
+        return False
+
+    def _apply_actual(self, parent, expected):
+        while expected is not None:
+            actual = parent[expected]
+            self._add_flow(expected, actual, 1)
+            expected = parent[actual]
+            if expected is not None:
+                self._add_flow(expected, actual, -1)
+
+    def paired(self):
+        return sum(node.used for node in self.expected)
+
+    def unmatched(self):
+        'expected invocations left without a pair'
+        retval = []
+        for node in self.expected:
+            retval.extend(node.invocations[node.used:])
+        return retval
+
+
+def unmatched_invocations(expected, actual):
+    return Pairing(expected, actual).unmatched()
+
+
+def matches_any_call(invocation):
+    context = invocation.context
+    return context.args == (ANY_ARG,) and not context.kargs
+
+
+def tally(invocations, record):
+    '''how many of the recorded invocations are equal to each of the given
+    ones, in a single pass per method. Literal invocations are counted by
+    key, the rest are checked once per distinct recorded invocation'''
+    counts = [0] * len(invocations)
+    per_method = {}
+    for index, invocation in enumerate(invocations):
+        per_method.setdefault(record._key(invocation), []).append(index)
+
+    for key, indexes in per_method.items():
+        method = record._methods.get(key)
+        if method is None:
+            continue
+
+        literal, loose = {}, []
+        for index in indexes:
+            invocation = invocations[index]
+            canonical = invocation.canonical()
+            if canonical is not None:
+                literal.setdefault(canonical, []).append(index)
+            elif matches_any_call(invocation):
+                counts[index] = len(method.invocations)
+            else:
+                loose.append(index)
+
+        for node in collapse(method.invocations):
+            actual = node.invocation
+            canonical = actual.canonical()
+            if canonical is not None:
+                candidates = loose
+                for index in literal.get(canonical, []):
+                    counts[index] += node.size
+            else:
+                candidates = [i for x in literal.values() for i in x] + loose
+
+            for index in candidates:
+                if actual == invocations[index]:
+                    counts[index] += node.size
+
+    return counts
@@ -17,15 +17,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
-import inspect
-from typing import NamedTuple
-
-try:
-    from inspect import getcallargs
-except ImportError:
-    from .py27_backports import getcallargs
-
 from .internal import ANY_ARG
+from .lazy import LazyModule
+from .introspection import class_info
+from . import counters
+
+inspect = LazyModule('inspect')
 
 
 def get_func(func):
@@ -47,13 +44,19 @@ class Proxy(object):
         return None
 
     def get_signature(self, method_name):
+        if counters.enabled:
+            counters.incr(self, 'signatures')
+
+        return SIGNATURES[self.get_signature_kind(method_name)](self, method_name)
+
+    def get_signature_kind(self, method_name):
         if self.is_property(method_name) or self.is_namedtuple_field(method_name):
-            return PropertySignature(self, method_name)
+            return 'property'
 
         if not self.is_method_or_func(method_name):
-            return BuiltinSignature(self, method_name)
+            return 'builtin'
 
-        return MethodSignature(self, method_name)
+        return 'method'
 
     def is_property(self, attr_name):
         attr = getattr(self.collaborator_class, attr_name)
@@ -81,8 +84,14 @@ class DummyProxy(Proxy):
     def same_method(self, name1, name2):
         return name1 == name2
 
+    def method_key(self, name):
+        return name
+
     def get_signature(self, method_name):
-        return DummySignature()
+        if counters.enabled:
+            counters.incr(self, 'signatures')
+
+        return DummySignature(self)
 
 
 def get_class(something):
@@ -97,6 +106,8 @@ class CollaboratorProxy(Proxy):
     def __init__(self, collaborator):
         self.collaborator = collaborator
         self.collaborator_class = get_class(collaborator)
+        self.info = class_info(self.collaborator_class)
+        self._method_keys = {}
 
     def isclass(self):
         return inspect.isclass(self.collaborator)
@@ -120,9 +131,13 @@ class CollaboratorProxy(Proxy):
                 (self.collaborator_classname(), key)
             raise AttributeError(reason)
 
+        typename = self.info.get('typenames', key)
+        if typename is not None:
+            return typename
+
         try:
             attr = getattr(self.collaborator_class, key)
-            return type(attr).__name__
+            return self.info.set('typenames', key, type(attr).__name__)
         except AttributeError:
             if self.collaborator is self.collaborator_class:
                 raise_no_attribute()
@@ -133,10 +148,49 @@ class CollaboratorProxy(Proxy):
         except AttributeError:
             raise_no_attribute()
 
+    def get_signature_kind(self, method_name):
+        kind = self.info.get('kinds', method_name)
+        if kind is not None:
+            return kind
+
+        kind = super(CollaboratorProxy, self).get_signature_kind(method_name)
+        if self.is_class_level(method_name):
+            self.info.set('kinds', method_name, kind)
+
+        return kind
+
+    def get_argspec(self, name, method):
+        if not self.is_class_level(name):
+            return getfullargspec(method)
+
+        return self.info.argspec(name, method)
+
+    def is_class_level(self, name):
+        'instance attributes may not share cached class introspection'
+        if self.collaborator is self.collaborator_class:
+            return True
+
+        return name not in getattr(self.collaborator, '__dict__', ())
+
     def same_method(self, name1, name2):
         return getattr(self.collaborator, name1) == \
             getattr(self.collaborator, name2)
 
+    def method_key(self, name):
+        '''hashable key shared by all the names of the same method (aliases)'''
+        try:
+            return self._method_keys[name]
+        except KeyError:
+            pass
+
+        key = name
+        attr = inspect.getattr_static(self.collaborator_class, name, None)
+        if isinstance(attr, (classmethod, staticmethod)) or inspect.isfunction(attr):
+            key = attr
+
+        self._method_keys[name] = key
+        return key
+
     def perform_invocation(self, invocation):
         method = getattr(self.collaborator, invocation.name)
         return invocation.context.apply_on(method)
@@ -164,8 +218,8 @@ class Signature(object):
 
 
 class DummySignature(Signature):
-    def __init__(self):
-        pass
+    def __init__(self, proxy):
+        self.proxy = proxy
 
 
 class BuiltinSignature(Signature):
@@ -175,7 +229,9 @@ class BuiltinSignature(Signature):
             args = context.args
             if self.proxy.isclass():
                 args = (None,) + args  # self
-            getcallargs(self.method, *args, **context.kargs)
+            if counters.enabled:
+                counters.incr(self.proxy, 'getcallargs')
+            inspect.getcallargs(self.method, *args, **context.kargs)
             return
         doc = self.method.__doc__
         if not ')' in doc:
@@ -201,10 +257,10 @@ class MethodSignature(Signature):
     "colaborator method signature"
     def __init__(self, proxy, name):
         super(MethodSignature, self).__init__(proxy, name)
-        self.argspec = getfullargspec(self.method)
+        self.argspec = proxy.get_argspec(name, self.method)
 
     def get_arg_spec(self):
-        retval = getfullargspec(self.method)
+        retval = self.proxy.get_argspec(self.name, self.method)
         del retval.args[0]
         return retval
 
@@ -219,7 +275,10 @@ class MethodSignature(Signature):
         if self.proxy.isclass() and not is_classmethod:
             args = (None,) + args  # self
 
-        retval = getcallargs(self.method, *args, **context.kargs)
+        if counters.enabled:
+            counters.incr(self.proxy, 'getcallargs')
+
+        retval = inspect.getcallargs(self.method, *args, **context.kargs)
         retval.pop('cls' if is_classmethod else 'self', None)
         return retval
 
@@ -244,3 +303,10 @@ class PropertySignature(Signature):
 
     def assure_matches(self, context):
         pass
+
+
+SIGNATURES = dict(
+    property = PropertySignature,
+    builtin = BuiltinSignature,
+    method = MethodSignature,
+)
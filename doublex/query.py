@@ -0,0 +1,223 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+# doublex
+#
+# Copyright © 2012-2018 David Villa Alises
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+'''
+Lazy queries over the calls recorded by a spy method. Filters are applied
+while iterating the method own record, the history is never copied.
+'''
+
+import re
+import threading
+import itertools
+import collections
+
+from .internal import Method, SpyBase, WrongApiUsage, is_literal
+from .clock import to_ns
+from .report import same_value
+
+
+__all__ = ['calls_to']
+
+
+MISSING = object()
+
+
+def matches(expected, value):
+    return value is not MISSING and same_value(expected, value)
+
+
+def calls_to(method):
+    'query over the recorded calls to the given spy method'
+    if not isinstance(method, Method) or not isinstance(method.double, SpyBase):
+        raise WrongApiUsage("calls_to() takes a spy method (got %s instead)" % method)
+
+    return Query(method)
+
+
+class Arguments(object):
+    '''gets an argument of a call by name. Positional arguments are named by
+    the collaborator signature or, for free doubles, arg0, arg1...'''
+    def __init__(self, double, name):
+        self.names, self.defaults = [], {}
+        spec = double._proxy.get_signature(name).get_arg_spec()
+        if spec is not None:
+            self.names = list(spec.args)
+            self.defaults = dict(zip(reversed(spec.args), reversed(spec.defaults or ())))
+            self.defaults.update(spec.kwonlydefaults or {})
+
+    def getter(self, name):
+        position = self.position(name)
+
+        def get(context):
+            try:
+                return context.kargs[name]
+            except KeyError:
+                pass
+
+            if position is not None and position < len(context.args):
+                return context.args[position]
+
+            return self.defaults.get(name, MISSING)
+
+        return get
+
+    def position(self, name):
+        if name in self.names:
+            return self.names.index(name)
+
+        match = re.match(r'arg(\d+)$', name)
+        if match and not self.names:
+            return int(match.group(1))
+
+        return None
+
+    def name_of(self, position):
+        if position < len(self.names):
+            return self.names[position]
+        return 'arg%s' % position
+
+
+class Query(object):
+    '''recorded calls to a spy method, as InvocationContext objects. Filters
+    return new queries, nothing is evaluated until the query is iterated'''
+    def __init__(self, method, filters=()):
+        self.method = method
+        self.filters = tuple(filters)
+        self.arguments = Arguments(method.double, method.name)
+
+    def _filter(self, func):
+        return Query(self.method, self.filters + (func,))
+
+    def where(self, *predicates, **criteria):
+        '''calls for which the predicates (taking the call context) are true
+        and whose arguments match the given values or hamcrest matchers'''
+        filters = [lambda invocation, func=func: func(invocation.context)
+                   for func in predicates]
+
+        for name, expected in criteria.items():
+            getter = self.arguments.getter(name)
+            if is_literal(expected):
+                filters.append(lambda invocation, get=getter, value=expected:
+                               get(invocation.context) == value)
+            else:
+                filters.append(lambda invocation, get=getter, value=expected:
+                               matches(value, get(invocation.context)))
+
+        retval = self
+        for func in filters:
+            retval = retval._filter(func)
+        return retval
+
+    def between(self, start=None, end=None):
+        '''calls within the given clock times, in seconds (see get_clock()).
+        The spy must record timestamps'''
+        self._assure_timestamps()
+        start = -1 if start is None else to_ns(start)
+        end = float('inf') if end is None else to_ns(end)
+        return self._filter(
+            lambda invocation: start <= getattr(invocation, 'timestamp', -1) <= end)
+
+    def in_thread(self, thread=None):
+        '''calls from the given thread (a Thread or its ident), the current
+        one by default. The spy must record timestamps'''
+        self._assure_timestamps()
+        if thread is None:
+            thread = threading.get_ident()
+        ident = getattr(thread, 'ident', thread)
+        return self._filter(lambda invocation: getattr(invocation, 'thread', None) == ident)
+
+    def _assure_timestamps(self):
+        if not self.method.double._recorded.timestamps:
+            raise WrongApiUsage("%s does not record timestamps. See record_timestamps()" %
+                                self.method.double._classname())
+
+    def _invocations(self):
+        retval = iter(self.method.double._get_invocations_to(self.method.name))
+        for func in self.filters:
+            retval = filter(func, retval)
+        return retval
+
+    def __iter__(self):
+        return (invocation.context for invocation in self._invocations())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if all(x is None or x >= 0 for x in (index.start, index.stop, index.step)):
+                return list(itertools.islice(self, index.start, index.stop, index.step))
+            return list(self)[index]
+
+        if index < 0:
+            items = collections.deque(self, maxlen=-index)
+            if len(items) < -index:
+                raise IndexError(index)
+            return items[0]
+
+        try:
+            return next(itertools.islice(self, index, None))
+        except StopIteration:
+            raise IndexError(index)
+
+    def count(self):
+        return sum(1 for invocation in self._invocations())
+
+    def first(self):
+        'the first matching call, None if there is not'
+        return next(iter(self), None)
+
+    def last(self):
+        'the last matching call, None if there is not'
+        items = collections.deque(self, maxlen=1)
+        return items[0] if items else None
+
+    def values(self, name):
+        'the given argument of each call'
+        getter = self.arguments.getter(name)
+        return (getter(context) for context in self)
+
+    def group_by(self, key):
+        'calls grouped by an argument name or by a function of the call context'
+        if not callable(key):
+            key = self.arguments.getter(key)
+        return Grouping(self, key)
+
+    def __repr__(self):
+        return "<Query %s.%s>" % (self.method.double._classname(), self.method.name)
+
+
+class Grouping(object):
+    def __init__(self, query, key):
+        self.query = query
+        self.key = key
+
+    def count(self):
+        'amount of calls per key'
+        return dict(collections.Counter(self.key(context) for context in self.query))
+
+    def first(self):
+        'first call per key'
+        retval = {}
+        for context in self.query:
+            retval.setdefault(self.key(context), context)
+        return retval
+
+    def last(self):
+        'last call per key'
+        return dict((self.key(context), context) for context in self.query)
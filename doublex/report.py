@@ -0,0 +1,266 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+# doublex
+#
+# Copyright © 2012-2018 David Villa Alises
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+'''
+Bounded descriptions of invocation lists for assertion failures. Short lists
+are shown as they are. Longer ones are summarized: the first invocations,
+with arguments rendered by reprlib, counts by method and argument types and,
+when a dump directory is set, the path of a file holding the whole list.
+Calls to the asserted method may be ranked by how close they are to the
+expected one.
+'''
+
+import os
+import heapq
+import difflib
+import reprlib
+import collections
+
+from hamcrest.core.matcher import Matcher
+
+from .lazy import LazyModule
+from .internal import (
+    InvocationFormatter, InvocationContext, PropertyGet, PropertySet,
+    add_indent, is_literal, WrongApiUsage)
+
+tempfile = LazyModule('tempfile')
+
+
+__all__ = ['set_report_limit']
+
+ENVIRON_KEY = 'DOUBLEX_REPORT_DIR'
+
+limit = 100
+shown = 20
+groups = 10
+closest = 3
+dump_dir = os.environ.get(ENVIRON_KEY)
+
+
+def set_report_limit(calls=100, shown=20, dump_dir=None, closest=3):
+    '''failure reports list up to 'calls' invocations, longer lists are
+    summarized. None disables summaries'''
+    if calls is not None and not 0 < shown <= calls:
+        raise WrongApiUsage(
+            "set_report_limit() 'shown' must be between 1 and 'calls'")
+
+    module = globals()
+    module['limit'] = calls
+    module['shown'] = shown
+    module['closest'] = closest
+    module['dump_dir'] = dump_dir or os.environ.get(ENVIRON_KEY)
+
+
+class _Repr(reprlib.Repr):
+    def __init__(self):
+        reprlib.Repr.__init__(self)
+        self.maxstring = self.maxother = 80
+        self.maxlong = 40
+
+    def repr_instance(self, obj, level):
+        'values without a specific reprlib method are shown by str()'
+        text = str(obj)
+        if len(text) <= self.maxother:
+            return text
+
+        half = (self.maxother - 3) // 2
+        return text[:half] + '...' + text[-half:]
+
+
+_repr = _Repr()
+
+
+class BoundedFormatter(InvocationFormatter):
+    @classmethod
+    def _format_value(cls, arg):
+        return _repr.repr(arg)
+
+
+def bounded(invocation):
+    'like repr(invocation), but with arguments of bounded size'
+    if isinstance(invocation, PropertyGet):
+        return repr(invocation)
+
+    classname = invocation.double._classname()
+    if isinstance(invocation, PropertySet):
+        return "set %s.%s to %s" % (
+            classname, invocation.name, _repr.repr(invocation.value))
+
+    retval = "%s.%s%s" % (classname, invocation.name,
+                          BoundedFormatter.format_call(invocation.context.args,
+                                                       invocation.context.kargs))
+    if invocation.context.retval is not None:
+        retval += "-> %s" % _repr.repr(invocation.context.retval)
+    return retval
+
+
+def shape(invocation):
+    'method and argument types of the invocation'
+    if isinstance(invocation, PropertyGet):
+        return repr(invocation)
+
+    classname = invocation.double._classname()
+    if isinstance(invocation, PropertySet):
+        return "set %s.%s to %s" % (
+            classname, invocation.name, type(invocation.value).__name__)
+
+    context = invocation.context
+    types = [type(x).__name__ for x in context.args]
+    types.extend('%s=%s' % (key, type(value).__name__)
+                 for key, value in sorted(context.kargs.items()))
+    return "%s.%s(%s)" % (classname, invocation.name, str.join(', ', types))
+
+
+def needs_summary(invocations):
+    return limit is not None and len(invocations) > limit
+
+
+def summarize(invocations, indent=0):
+    lines = [bounded(i) for i in invocations[:shown]]
+
+    counts = collections.Counter(shape(i) for i in invocations)
+    lines.append("... %s more (%s in total), by method and argument types:" % (
+        len(invocations) - shown, len(invocations)))
+    for text, count in counts.most_common(groups):
+        lines.append("%8s x %s" % (count, text))
+    if len(counts) > groups:
+        lines.append("     ... %s more kinds" % (len(counts) - groups))
+
+    if dump_dir is None:
+        lines.append("(set_report_limit(dump_dir=...) keeps the full list)")
+    else:
+        lines.append("full list in %s" % dump(invocations))
+
+    return str.join('\n', [add_indent(x, indent) for x in lines])
+
+
+def dump(invocations):
+    with tempfile.NamedTemporaryFile(
+            'w', dir=dump_dir, prefix='doublex-', suffix='.txt',
+            delete=False) as fd:
+        for invocation in invocations:
+            fd.write("%s\n" % (invocation,))
+
+    return fd.name
+
+
+def given_args(context):
+    'keyword arguments by name, positional ones by position'
+    retval = context.kargs.copy()
+    retval.update(('_positional_%s' % i, x) for i, x in enumerate(context.args))
+    return retval
+
+
+def bound_args(context, names=None):
+    'arguments by name, bound to the collaborator signature when possible'
+    try:
+        retval = context.signature.get_call_args(context)
+    except TypeError:
+        retval = given_args(context)
+
+    if names is not None:
+        retval = dict((k, v) for k, v in retval.items() if k in names)
+    return retval
+
+
+def same_value(expected, actual):
+    if is_literal(expected) and is_literal(actual):
+        return expected == actual
+
+    if isinstance(expected, Matcher):
+        return expected.matches(actual)
+
+    try:
+        InvocationContext._assert_values_match(expected, actual)
+        return True
+    except AssertionError:
+        return False
+
+
+def differences(expected, actual):
+    'names of the arguments not matching the expected ones'
+    return [k for k in set(expected) | set(actual)
+            if k not in expected or k not in actual or
+            not same_value(expected[k], actual[k])]
+
+
+def argument_name(key):
+    if key.startswith('_positional_'):
+        return '#%s' % key[len('_positional_'):]
+    return key
+
+
+class Ranking(object):
+    '''compares calls as given while they take the same arguments in the
+    same way, binding them to the signature (getcallargs) otherwise'''
+    def __init__(self, expected):
+        context = expected.context
+        self.names = set(context.kargs) if context.check_some_args else None
+        self.given = given_args(context)
+        self.bound = bound_args(context)
+
+    def differences(self, invocation, bind=False):
+        actual = given_args(invocation.context)
+        if bind or self.names is not None or set(actual) != set(self.given):
+            return differences(self.bound,
+                               bound_args(invocation.context, self.names))
+
+        return differences(self.given, actual)
+
+
+def closest_calls(expected, invocations):
+    '''the recorded invocations most similar to the expected one: fewer
+    differing arguments first, then by similarity of their text. None if any
+    of them matches'''
+    groups = collections.OrderedDict()
+    for invocation in invocations:
+        key = invocation.literal_key()
+        if key is None:
+            key = id(invocation)
+
+        try:
+            groups[key][1] += 1
+        except KeyError:
+            groups[key] = [invocation, 1]
+
+    ranking = Ranking(expected)
+    ranked = []
+    for invocation, count in groups.values():
+        amount = len(ranking.differences(invocation))
+        if not amount:
+            return None
+        ranked.append((amount, len(ranked), invocation, count))
+
+    text = bounded(expected)
+    candidates = heapq.nsmallest(closest * 4, ranked)
+    candidates.sort(key=lambda x: (x[0], -difflib.SequenceMatcher(
+        None, text, bounded(x[2])).ratio()))
+
+    retval = []
+    for amount, _, invocation, count in candidates[:closest]:
+        differ = sorted(ranking.differences(invocation, bind=True))
+        line = "%s -- differs in: %s" % (
+            bounded(invocation), str.join(', ', map(argument_name, differ)))
+        if count > 1:
+            line += " (%s times)" % count
+        retval.append(line)
+
+    return retval
@@ -0,0 +1,53 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+# doublex
+#
+# Copyright © 2012-2018 David Villa Alises
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+import json
+from unittest import TestCase
+
+from hamcrest import assert_that, is_, has_key, contains_exactly
+
+from doublex import benchmark
+
+
+class BenchmarkTests(TestCase):
+    def test_run_selected_cases(self):
+        report = benchmark.run(quick=True, select=['create/Stub', 'stub_any_arg'],
+                               repeat=1, min_time=0.001)
+
+        assert_that(sorted(report['results']),
+                    contains_exactly('create/Stub', 'stub_any_arg'))
+        assert_that(report['results']['create/Stub'], has_key('best'))
+        json.dumps(report)
+
+    def test_every_case_runs(self):
+        for item in benchmark.expand_cases(quick=True):
+            func = item.factory(item.size and min(item.size, 10))
+            func()
+
+    def test_compare_with_baseline(self):
+        baseline = dict(results={'a': dict(best=1.0), 'b': dict(best=1.0)})
+        current = dict(results={'a': dict(best=1.1), 'b': dict(best=2.0),
+                                'c': dict(best=1.0)})
+
+        rows = benchmark.compare(current, baseline, max_slowdown=1.2)
+
+        assert_that([(r[0], r[-1]) for r in rows],
+                    is_([('a', False), ('b', True)]))
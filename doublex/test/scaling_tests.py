@@ -0,0 +1,83 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+# doublex
+#
+# Copyright © 2012-2018 David Villa Alises
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+import os
+import math
+from unittest import TestCase, skipUnless
+
+from hamcrest import assert_that, is_, is_in, less_than
+
+from doublex import benchmark, collecting_stats
+
+
+class ClassifyTests(TestCase):
+    sizes = [10, 100, 1000, 10000]
+
+    def assert_complexity(self, func, expected):
+        timings = [func(n) for n in self.sizes]
+        assert_that(benchmark.classify(self.sizes, timings)[0], is_(expected))
+
+    def test_constant(self):
+        self.assert_complexity(lambda n: 1e-6, 'O(1)')
+
+    def test_logarithmic(self):
+        self.assert_complexity(lambda n: 1e-6 * math.log(n), 'O(log n)')
+
+    def test_linear(self):
+        self.assert_complexity(lambda n: 1e-6 + 1e-8 * n, 'O(n)')
+
+    def test_quadratic(self):
+        self.assert_complexity(lambda n: 1e-9 * n * n, 'O(n^2)')
+
+
+def operations(item, size):
+    '''counters of a single run. Scanned candidates are left out, as indexed
+    lookups get all the invocations to the method but compare few'''
+    func = item.factory(size)
+    with collecting_stats() as scope:
+        func()
+
+    return sum(value for name, value in scope.stats.items()
+               if not name.endswith('_scanned'))
+
+
+class SublinearPathsTests(TestCase):
+    'operations documented as sublinear must not regress to linear'
+
+    def test_sublinear_operation_counts(self):
+        for item in benchmark.SCALING:
+            if not item.sublinear:
+                continue
+
+            small, big = operations(item, 10), operations(item, 10000)
+            assert_that(big, less_than(10 * max(small, 1)),
+                        "%s regressed: %s operations for 10, %s for 10000" % (
+                            item.name, small, big))
+
+    @skipUnless(os.environ.get('DOUBLEX_SLOW_TESTS'), 'slow, timing dependent')
+    def test_sublinear_scenarios(self):
+        for item in benchmark.SCALING:
+            if not item.sublinear:
+                continue
+
+            result = benchmark.run_scenario(item, [100, 1000, 10000], repeat=3)
+            assert_that(result['complexity'], is_in(benchmark.SUBLINEAR),
+                        "%s regressed: %s" % (item.name, result))
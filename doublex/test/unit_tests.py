@@ -19,7 +19,16 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 
+import os
 import sys
+import json
+import random
+import shutil
+import inspect
+import tempfile
+import importlib
+import subprocess
+import asyncio
 import itertools
 import threading
 try:
@@ -36,21 +45,37 @@ from io import StringIO
 from hamcrest import (
     is_, is_not, instance_of, all_of, has_length, has_entry, starts_with,
     anything, greater_than, less_than, any_of,
-    contains_string, string_contains_in_order)
+    contains_string, string_contains_in_order, close_to, has_entries,
+    contains_exactly, contains_inanyorder, ends_with)
+from hamcrest.core.string_description import StringDescription
 
+import doublex
 from doublex import (
     set_default_behavior,
     ANY_ARG,
     assert_that,
-    when, called, never,
-    Stub, Spy, ProxySpy, Mock, Tracer, Mimic,
+    when, called, never, all_of_calls, called_in_order,
+    Stub, Spy, ProxySpy, Mock, StrictMock, Tracer, Mimic,
     property_set, property_got,
     method_returning, method_raising, expect_call, verify, any_order_verify,
+    precompile,
+    wait_that, get_clock, VirtualClock, record_timestamps,
+    stats, collecting_stats, memory_report, set_report_limit, calls_to,
+    record_argument_stats, argument_stats,
+    enable_introspection_cache, disable_introspection_cache, save_introspection_cache,
     WrongApiUsage
     )
 
-from doublex.matchers import MatcherRequiredError
-from doublex.internal import InvocationContext, Method
+from doublex.matchers import (
+    MatcherRequiredError, MeasureMatcher, at_least, at_most, max_concurrency,
+    in_flight, took, call_rate, burst_size, max_gap, min_gap)
+from doublex import introspection
+from doublex.metrics import LatencyHistogram
+from doublex.tracer import ListSink, CallableSink, JSONLinesSink
+from doublex.latency import Latency, Uniform, Exponential, Empirical
+from doublex.clock import Clock
+from doublex.internal import InvocationContext, Invocation, Method, ObservedMethod
+from doublex.pairing import Pairing
 
 T = TypeVar('T')
 
@@ -539,6 +564,251 @@ class ProxySpyTests(TestCase):
         assert_that(foo.value, is_(3))
 
 
+class TimestampTests(TestCase):
+    def setUp(self):
+        self.spy = Spy()
+        record_timestamps(self.spy)
+
+    def call_at(self, method, times):
+        with VirtualClock() as clock:
+            for t in times:
+                clock.advance(t - clock.now())
+                method()
+
+    def test_timestamps_are_not_recorded_by_default(self):
+        spy = Spy()
+        spy.foo()
+
+        with self.assertRaises(WrongApiUsage):
+            spy.foo.timestamps
+
+    def test_timestamps_per_method(self):
+        self.call_at(self.spy.foo, [1, 2])
+        self.call_at(self.spy.bar, [5])
+
+        assert_that(list(self.spy.foo.timestamps), is_([1000000000, 2000000000]))
+        assert_that(list(self.spy.bar.timestamps), is_([5000000000]))
+
+    def test_call_rate(self):
+        self.call_at(self.spy.publish, [0, 0.1, 0.5, 0.9, 1.5, 1.6, 3])
+
+        assert_that(self.spy.publish, call_rate(4))
+        assert_that(self.spy.publish, call_rate(at_most(4)))
+        assert_that(self.spy.publish, call_rate(2, per=0.2))
+
+        with self.assertRaises(AssertionError):
+            assert_that(self.spy.publish, call_rate(at_most(3)))
+
+    def test_burst_size(self):
+        self.call_at(self.spy.write, [0, 0.01, 0.02, 1, 1.01, 5])
+
+        assert_that(self.spy.write, burst_size(3, gap=0.01))
+        assert_that(self.spy.write, burst_size(1, gap=0.001))
+
+    def test_gaps(self):
+        self.call_at(self.spy.write, [0, 0.2, 0.3, 0.45])
+
+        assert_that(self.spy.write, max_gap(at_most(0.2)))
+        assert_that(self.spy.write, min_gap(at_least(0.1)))
+
+        with self.assertRaises(AssertionError) as cm:
+            assert_that(self.spy.write, max_gap(less_than(0.2)))
+
+        assert_that(str(cm.exception), contains_string('was 0.2'))
+
+    def test_gaps_require_two_calls(self):
+        self.spy.write()
+
+        with self.assertRaises(AssertionError):
+            assert_that(self.spy.write, max_gap(at_most(0.2)))
+
+    def test_measure_matchers_require_a_measure(self):
+        class calls(MeasureMatcher):
+            title = 'calls'
+
+        with self.assertRaises(TypeError):
+            calls(1)
+
+
+class ProxySpyConcurrencyTests(TestCase):
+    class Backend(object):
+        def __init__(self, nthreads):
+            self.barrier = threading.Barrier(nthreads)
+
+        def query(self, n):
+            self.barrier.wait(timeout=2)
+            return n
+
+        def ping(self):
+            pass
+
+    def call_concurrently(self, method, nthreads):
+        threads = [threading.Thread(target=method, args=(i,)) for i in range(nthreads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def test_peak_concurrency(self):
+        spy = ProxySpy(self.Backend(3))
+
+        self.call_concurrently(spy.query, 3)
+
+        assert_that(spy.query.concurrency.peak, is_(3))
+        assert_that(spy.query, max_concurrency(3))
+        assert_that(spy.query, max_concurrency(at_most(8)))
+        assert_that(spy.query, in_flight(0))
+        assert_that(spy.ping, max_concurrency(0))
+
+    def test_concurrency_exceeded(self):
+        spy = ProxySpy(self.Backend(4))
+
+        self.call_concurrently(spy.query, 4)
+
+        with self.assertRaises(AssertionError) as cm:
+            assert_that(spy.query, max_concurrency(at_most(2)))
+
+        assert_that(str(cm.exception), contains_string('was 4'))
+
+    def test_overlapping_awaits(self):
+        class AsyncBackend(object):
+            async def query(self, n):
+                await asyncio.sleep(0.01)
+                return n
+
+        spy = ProxySpy(AsyncBackend())
+
+        async def main():
+            return await asyncio.gather(*[spy.query(i) for i in range(10)])
+
+        assert_that(asyncio.run(main()), is_(list(range(10))))
+        assert_that(spy.query, max_concurrency(10))
+        assert_that(spy.query, in_flight(0))
+        assert_that(spy.query, called().times(10))
+
+    def test_in_flight_while_running(self):
+        entered = threading.Event()
+        release = threading.Event()
+
+        class Slow(object):
+            def run(self):
+                entered.set()
+                release.wait(2)
+
+        spy = ProxySpy(Slow())
+        worker = threading.Thread(target=spy.run)
+        worker.start()
+        entered.wait(2)
+
+        assert_that(spy.run, in_flight(1))
+        release.set()
+        worker.join()
+        assert_that(spy.run, in_flight(0))
+
+    def test_only_proxyspy_tracks_concurrency(self):
+        spy = Spy()
+        with self.assertRaises(WrongApiUsage):
+            assert_that(spy.foo, max_concurrency(1))
+
+
+class LatencyHistogramTests(TestCase):
+    def test_small_values_are_exact(self):
+        histogram = LatencyHistogram()
+        for value in range(1, 101):
+            histogram.record_ns(value)
+
+        assert_that(histogram.count, is_(100))
+        assert_that(histogram.percentile_ns(50), is_(50))
+        assert_that(histogram.percentile_ns(99), is_(99))
+        assert_that(histogram.max_ns, is_(100))
+
+    def test_relative_error_is_bounded(self):
+        for value in [1000, 123456, 10 ** 9 + 7, 3 * 10 ** 12]:
+            histogram = LatencyHistogram()
+            histogram.record_ns(value)
+            histogram.record_ns(value * 2)
+
+            assert_that(histogram.percentile_ns(50),
+                        close_to(value, value / 64.0))
+
+    def test_bucket_count_is_bounded(self):
+        histogram = LatencyHistogram()
+        for value in range(0, 10 ** 9, 9973):
+            histogram.record_ns(value)
+
+        assert_that(len(histogram._buckets), less_than(1500))
+
+
+class ProxySpyLatencyTests(TestCase):
+    class Database(object):
+        def __init__(self, delays):
+            self.delays = iter(delays)
+
+        def query(self):
+            get_clock().sleep(next(self.delays))
+
+    def test_latency_percentiles(self):
+        spy = ProxySpy(self.Database([0.01] * 98 + [0.2, 0.5]))
+
+        with VirtualClock():
+            for i in range(100):
+                spy.query()
+
+        histogram = spy.query.latency
+        assert_that(histogram.count, is_(100))
+        assert_that(histogram.p50, close_to(0.01, 0.001))
+        assert_that(histogram.p99, close_to(0.2, 0.01))
+        assert_that(histogram.max, is_(0.5))
+
+    def test_latency_matcher(self):
+        spy = ProxySpy(self.Database([0.01, 0.02, 0.03]))
+
+        with VirtualClock():
+            for i in range(3):
+                spy.query()
+
+        assert_that(spy.query, took(count=3, p99=less_than(0.05)))
+
+        with self.assertRaises(AssertionError) as cm:
+            assert_that(spy.query, took(max=less_than(0.02)))
+
+        assert_that(str(cm.exception), contains_string('max was 0.03'))
+
+    def test_async_latency_is_the_await(self):
+        class AsyncDatabase(object):
+            async def query(self):
+                await get_clock().async_sleep(0.05)
+
+        spy = ProxySpy(AsyncDatabase())
+
+        async def main():
+            await asyncio.gather(spy.query(), spy.query())
+
+        with VirtualClock():
+            asyncio.run(main())
+
+        assert_that(spy.query, took(count=2, min=close_to(0.05, 0.001)))
+
+    def test_unknown_statistic(self):
+        with self.assertRaises(WrongApiUsage):
+            took(p99=1, median=2)
+
+        with self.assertRaises(WrongApiUsage):
+            took(p101=1)
+
+    def test_percentile_names(self):
+        spy = ProxySpy(self.Database([0.01] * 1999 + [0.5]))
+
+        with VirtualClock():
+            for i in range(2000):
+                spy.query()
+
+        assert_that(spy.query, took(p10=close_to(0.01, 0.001),
+                                    p100=close_to(0.5, 0.01),
+                                    p999=close_to(0.01, 0.001),
+                                    p9999=close_to(0.5, 0.01)))
+
+
 class MockTests(TestCase):
     def test_with_args(self):
         mock = Mock()
@@ -672,6 +942,325 @@ class MockOrderTests(TestCase):
 
         assert_that(self.mock, any_order_verify())
 
+    def test_matcher_expectation_takes_the_call_literals_do_not_need(self):
+        with self.mock:
+            self.mock.foo(1)
+            self.mock.foo(instance_of(int))
+
+        self.mock.foo(1.0)
+        self.mock.foo(1)
+
+        assert_that(self.mock, any_order_verify())
+
+    def test_repeated_calls_with_any_order(self):
+        with self.mock:
+            for i in range(3):
+                self.mock.foo(1)
+                self.mock.foo(ANY_ARG)
+                self.mock.bar(2)
+
+        for i in range(3):
+            self.mock.bar(2)
+            self.mock.foo(3, 4)
+        for i in range(3):
+            self.mock.foo(1)
+
+        assert_that(self.mock, any_order_verify())
+
+    def test_unmatched_expectations_are_reported(self):
+        with self.mock:
+            self.mock.foo(1)
+            self.mock.foo(greater_than(5))
+            self.mock.bar()
+
+        self.mock.foo(6)
+        self.mock.bar()
+
+        with self.assertRaises(AssertionError) as cm:
+            assert_that(self.mock, any_order_verify())
+
+        unmatched = str(cm.exception).split('expectations not matched:\n')[1]
+        assert_that(unmatched, is_('          Mock.foo(1)\n'))
+
+    def test_matching_does_not_depend_on_order(self):
+        with self.mock:
+            self.mock.foo(anything())
+            self.mock.foo(2)
+
+        self.mock.foo(2)
+        self.mock.foo(3)
+
+        assert_that(self.mock, any_order_verify())
+
+
+class MockTimesTests(TestCase):
+    def test_times(self):
+        mock = Mock()
+        with mock:
+            mock.foo(1).times(3)
+            mock.bar()
+
+        for i in range(3):
+            mock.foo(1)
+        mock.bar()
+
+        assert_that(mock, verify())
+
+    def test_expectation_is_stored_once(self):
+        mock = Mock()
+        with mock:
+            mock.foo(1).times(3)
+
+        assert_that(len(mock._stubs), is_(1))
+        assert_that(mock._stubs.show(), is_("Mock.foo(1)\nMock.foo(1)\nMock.foo(1)"))
+
+    def test_excess_call_fails_at_once(self):
+        mock = Mock()
+        with mock:
+            mock.foo(1).times(2)
+
+        mock.foo(1)
+        mock.foo(1)
+
+        with self.assertRaises(AssertionError) as cm:
+            mock.foo(1)
+
+        assert_that(str(cm.exception),
+                    contains_string("this call was expected fewer times"))
+
+    def test_times_with_expect_call(self):
+        mock = Mock()
+        expect_call(mock).foo(1).times(2)
+
+        mock.foo(1)
+        mock.foo(1)
+
+        assert_that(mock, verify())
+
+    def test_times_with_matchers(self):
+        mock = Mock()
+        with mock:
+            mock.foo(anything()).times(2)
+
+        mock.foo(1)
+        mock.foo('a')
+
+        with self.assertRaises(AssertionError):
+            mock.foo(2)
+
+    def test_calls_may_take_other_expectations_with_any_order(self):
+        with Mock() as mock:
+            mock.foo(anything())
+            mock.foo(1)
+
+        mock.foo(1)
+        mock.foo(2)
+
+        assert_that(mock, any_order_verify())
+
+    def test_calls_after_a_reassignment_are_paired_incrementally(self):
+        for seed in range(20):
+            rnd = random.Random(seed)
+            mock = Mock()
+            with mock:
+                for i in range(12):
+                    arg = rnd.choice([anything(), greater_than(2), 1, 2, 3, 4])
+                    getattr(mock, rnd.choice(['foo', 'bar']))(arg)
+
+            for i in range(15):
+                name, arg = rnd.choice(['foo', 'bar']), rnd.randint(0, 5)
+                actual = list(mock._recorded) + [Invocation._from_args(mock, name, (arg,))]
+                pairable = Pairing(mock._stubs.expanded(), actual).paired() == len(actual)
+
+                try:
+                    getattr(mock, name)(arg)
+                    accepted = True
+                except AssertionError:
+                    accepted = False
+
+                assert_that(accepted, is_(pairable))
+
+    def test_concurrent_calls_take_one_expectation_each(self):
+        mock = Mock()
+        with mock:
+            mock.foo(anything()).times(400)
+
+        def call():
+            for i in range(100):
+                mock.foo(i)
+
+        threads = [threading.Thread(target=call) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert_that(sum(mock._expectations.used.values()), is_(400))
+        with self.assertRaises(AssertionError):
+            mock.foo(1)
+
+    def test_concurrent_calls_take_one_step_each(self):
+        mock = StrictMock()
+        with mock:
+            for i in range(400):
+                mock.foo(anything()).returns(i)
+
+        results = []
+
+        def call():
+            for i in range(100):
+                results.append(mock.foo(i))
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=call) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            sys.setswitchinterval(interval)
+
+        assert_that(sorted(results), is_(list(range(400))))
+        assert_that(mock, verify())
+
+    def test_strict_mock_times(self):
+        mock = StrictMock()
+        with mock:
+            mock.foo().times(2)
+            mock.bar()
+
+        mock.foo()
+        mock.foo()
+
+        with self.assertRaises(AssertionError):
+            mock.foo()
+
+        mock.bar()
+        assert_that(mock, verify())
+
+
+class StrictMockTests(TestCase):
+    def setUp(self):
+        self.mock = StrictMock(Collaborator)
+        with self.mock:
+            self.mock.hello()
+            self.mock.one_arg_method(anything()).returns(1)
+            self.mock.one_arg_method(2).returns(2)
+
+    def test_calls_in_order(self):
+        self.mock.hello()
+        assert_that(self.mock.one_arg_method(2), is_(1))
+        assert_that(self.mock.one_arg_method(2), is_(2))
+
+        assert_that(self.mock, verify())
+
+    def test_call_out_of_order_fails_at_once(self):
+        self.mock.hello()
+
+        with self.assertRaises(AssertionError) as cm:
+            self.mock.hello()
+
+        assert_that(str(cm.exception), contains_string(
+            "call #2 to be:\n"
+            "          Collaborator.one_arg_method(ANYTHING)-> 1\n"
+            "     but: this call was received:\n"
+            "          Collaborator.hello()"))
+
+    def test_extra_call_fails(self):
+        self.mock.hello()
+        self.mock.one_arg_method(1)
+        self.mock.one_arg_method(2)
+
+        with self.assertRaises(AssertionError) as cm:
+            self.mock.hello()
+
+        assert_that(str(cm.exception), contains_string("no more calls after 3"))
+
+    def test_missing_calls_fail_on_verify(self):
+        self.mock.hello()
+
+        with self.assertRaises(AssertionError):
+            assert_that(self.mock, verify())
+
+    def test_expect_call(self):
+        mock = StrictMock()
+        expect_call(mock).foo(1)
+        mock.foo(1)
+        expect_call(mock).bar()
+        mock.bar()
+
+        assert_that(mock, verify())
+
+
+class VerifyLiteralsTests(TestCase):
+    def test_positional_and_keyword_forms_match(self):
+        mock = Mock(Collaborator)
+        with mock:
+            mock.two_args_method(1, arg2=2)
+
+        mock.two_args_method(arg1=1, arg2=2)
+
+        assert_that(mock, verify())
+
+    def test_default_values_match(self):
+        mock = Mock(Collaborator)
+        with mock:
+            mock.kwarg_method()
+
+        mock.kwarg_method(key_param=False)
+
+        assert_that(mock, verify())
+
+    def test_literals_in_other_order_fail(self):
+        mock = Mock(Collaborator)
+        with mock:
+            mock.two_args_method(1, 2)
+            mock.two_args_method(1, 3)
+
+        mock.two_args_method(1, 3)
+        mock.two_args_method(arg1=1, arg2=2)
+
+        with self.assertRaises(AssertionError):
+            assert_that(mock, verify())
+
+    def test_equal_literals_of_different_types(self):
+        mock = Mock()
+        with mock:
+            mock.foo(1, (2, 'a'))
+
+        mock.foo(1.0, (2.0, 'a'))
+
+        assert_that(mock, verify())
+
+    def test_mixed_literals_and_matchers(self):
+        mock = Mock()
+        with mock:
+            mock.foo(1)
+            mock.foo(anything())
+            mock.bar(ANY_ARG)
+
+        mock.foo(1)
+        mock.foo([2])
+        mock.bar(3, 4)
+
+        assert_that(mock, verify())
+
+    def test_matchers_are_not_evaluated_for_literals(self):
+        mock = Mock()
+        with mock:
+            for i in range(10):
+                mock.foo(i, key=str(i))
+
+        for i in range(10):
+            mock.foo(i, key=str(i))
+
+        with collecting_stats() as scope:
+            assert_that(mock, verify())
+
+        assert_that(scope.stats.get('matcher_evaluations', 0), is_(0))
+
 
 class DisplayResultsTests(TestCase):
     def setUp(self):
@@ -989,6 +1578,31 @@ class StubObserverTests(TestCase):
 
         assert_that(observer.update, called().with_args(2))
 
+    def test_detached_observer_is_not_called(self):
+        observer = Observer()
+        self.stub.foo.attach(observer.update)
+        self.stub.foo.detach(observer.update)
+        self.stub.foo(2)
+
+        assert_that(observer.state, is_(None))
+
+    def test_only_observed_methods_notify(self):
+        observer = Observer()
+        self.assertIs(type(self.stub.foo), Method)
+
+        self.stub.foo.attach(observer.update)
+        self.assertIs(type(self.stub.foo), ObservedMethod)
+
+        self.stub.foo.detach(observer.update)
+        self.assertIs(type(self.stub.foo), Method)
+
+    def test_event_is_created_on_demand(self):
+        spy = Spy()
+        spy.foo()
+
+        assert_that(spy.foo._event, is_(None))
+        assert_that(spy.foo, called().async_mode(timeout=1))
+
 
 class StubDelegateTests(TestCase):
     def setUp(self):
@@ -1064,30 +1678,104 @@ class StubDelegateTests(TestCase):
         assert_that(self.stub.foo(1), is_(7))
 
 
-class MockDelegateTest(TestCase):
-    def setUp(self):
-        self.mock = Mock()
+class StubLatencyTests(TestCase):
+    def test_fixed_latency(self):
+        with Stub() as stub:
+            stub.foo(ANY_ARG).returns(1).with_latency(0.2)
 
-    def assert_012(self, method):
-        for x in range(3):
-            assert_that(method(), is_(x))
+        with VirtualClock() as clock:
+            assert_that(stub.foo(3), is_(1))
 
-    def test_delegate_to_list_is_only_an_expectation(self):
-        with self.mock:
-            self.mock.foo().delegates(list(range(3)))
+        assert_that(clock.now(), is_(0.2))
 
-        self.mock.foo()
-        assert_that(self.mock, verify())
+    def test_latency_keeps_raises(self):
+        with Stub() as stub:
+            stub.foo().raises(SomeException).with_latency(2)
 
+        with VirtualClock() as clock:
+            with self.assertRaises(SomeException):
+                stub.foo()
 
-class MimicTests(TestCase):
-    class A(object):
-        def method_a(self, n):
-            return n + 1
+        assert_that(clock.now(), is_(2))
 
-    class B(A):
-        def method_b(self):
-            return "hi"
+    def test_latency_per_call_sequence(self):
+        with Stub() as stub:
+            stub.foo().with_latency([1, 2, 3])
+
+        with VirtualClock() as clock:
+            for expected in [1, 3, 6, 9]:
+                stub.foo()
+                assert_that(clock.now(), is_(expected))
+
+    def test_seeded_distributions_are_repeatable(self):
+        for latency in [Uniform(0.1, 0.2, seed=1), Exponential(0.1, seed=1),
+                        Empirical({50: 0.01, 99: 0.5}, seed=1)]:
+            with Stub() as stub:
+                stub.foo().with_latency(latency)
+
+            with VirtualClock() as clock:
+                stub.foo()
+
+            assert_that(clock.now(), greater_than(0))
+
+        assert_that(Uniform(0, 1, seed=7).next_delay(),
+                    is_(Uniform(0, 1, seed=7).next_delay()))
+
+    def test_empirical_percentiles_interpolation(self):
+        latency = Empirical({50: 0.1, 90: 0.5, 99: 1.0})
+
+        assert_that(latency.delay_at(10), is_(0.1))
+        assert_that(latency.delay_at(70), close_to(0.3, 1e-9))
+        assert_that(latency.delay_at(100), is_(1.0))
+
+    def test_async_latency(self):
+        with Spy() as spy:
+            spy.fetch(ANY_ARG).returns(10).with_latency(0.5, async_mode=True)
+
+        with VirtualClock() as clock:
+            retval = asyncio.run(spy.fetch(1))
+
+        assert_that(retval, is_(10))
+        assert_that(clock.now(), is_(0.5))
+        assert_that(spy.fetch, called().with_args(1))
+
+    def test_wrong_latency(self):
+        with self.assertRaises(WrongApiUsage):
+            with Stub() as stub:
+                stub.foo().with_latency(None)
+
+    def test_latency_requires_next_delay(self):
+        class Unknown(Latency):
+            pass
+
+        with self.assertRaises(TypeError):
+            Unknown()
+
+
+class MockDelegateTest(TestCase):
+    def setUp(self):
+        self.mock = Mock()
+
+    def assert_012(self, method):
+        for x in range(3):
+            assert_that(method(), is_(x))
+
+    def test_delegate_to_list_is_only_an_expectation(self):
+        with self.mock:
+            self.mock.foo().delegates(list(range(3)))
+
+        self.mock.foo()
+        assert_that(self.mock, verify())
+
+
+class MimicTests(TestCase):
+    class A(object):
+        def method_a(self, n):
+            return n + 1
+
+    class B(A):
+        def method_b(self):
+            return "hi"
 
     class GenericSubclass(Generic[T]):
         def method_c(self):
@@ -1292,10 +1980,9 @@ class PropertyMockTests(TestCase):
             mock.prop
 
         mock.prop
-        mock.prop
 
         with self.assertRaises(AssertionError):
-            assert_that(mock, verify())
+            mock.prop
 
     def test_mock_set(self):
         with Mock(ObjCollaborator) as mock:
@@ -1317,10 +2004,9 @@ class PropertyMockTests(TestCase):
             mock.prop = 5
 
         mock.prop = 5
-        mock.prop = 5
 
         with self.assertRaises(AssertionError):
-            assert_that(mock, verify())
+            mock.prop = 5
 
     def test_mock_set_wrong_value(self):
         with Mock(ObjCollaborator) as mock:
@@ -1407,6 +2093,650 @@ class AsyncTests(TestCase):
         assert_that(spy.write, called().async_mode(timeout=1))
 
 
+class VirtualClockTests(TestCase):
+    def test_clock_is_installed_as_context(self):
+        original = get_clock()
+        with VirtualClock() as clock:
+            assert_that(get_clock(), is_(clock))
+
+        assert_that(get_clock(), is_(original))
+
+    def test_clocks_implement_every_method(self):
+        class Frozen(Clock):
+            def now(self):
+                return 0
+
+        with self.assertRaises(TypeError):
+            Frozen()
+
+    def test_advance_by_hand(self):
+        clock = VirtualClock(start=10)
+        clock.advance(2.5)
+
+        assert_that(clock.now(), is_(12.5))
+        assert_that(clock.now_ns(), is_(12500000000))
+
+    def test_async_timeout_is_consumed_without_waiting(self):
+        spy = Spy()
+
+        with VirtualClock() as clock:
+            assert_that(spy.write, is_not(called().async_mode(timeout=5)))
+
+        assert_that(clock.now(), is_(5))
+
+    def test_async_already_called_does_not_advance(self):
+        spy = Spy()
+        spy.write(1)
+
+        with VirtualClock() as clock:
+            assert_that(spy.write, called().async_mode(timeout=5))
+
+        assert_that(clock.now(), is_(0))
+
+    def test_wait_that_polls_on_virtual_time(self):
+        spy = Spy()
+
+        with VirtualClock() as clock:
+            with self.assertRaises(AssertionError):
+                wait_that(spy.write, called(), delta=1, timeout=5)
+
+        assert_that(clock.now(), greater_than(5))
+
+    def test_sleep_blocks_until_other_thread_advances(self):
+        clock = VirtualClock(autojump=False)
+        threading.Timer(0.01, clock.advance, (3,)).start()
+
+        clock.sleep(3)
+
+        assert_that(clock.now(), is_(3))
+
+
+class StatsTests(TestCase):
+    def test_counters_are_disabled_by_default(self):
+        before = stats()
+        spy = Spy(Collaborator)
+        spy.hello()
+
+        assert_that(stats(), is_(before))
+        assert_that(stats(spy), is_({}))
+
+    def test_collecting_stats_in_a_block(self):
+        with collecting_stats() as scope:
+            with Spy(Collaborator) as spy:
+                spy.one_arg_method(1).returns(2)
+
+            spy.one_arg_method(1)
+            spy.one_arg_method(2)
+            assert_that(spy.one_arg_method, called().with_args(2))
+
+        assert_that(scope.stats['class_clones'], is_(1))
+        assert_that(scope.stats['stubs_scans'], is_(2))
+        assert_that(scope.stats['stubs_scanned'], is_(2))
+        assert_that(scope.stats['hamcrest_exceptions'], greater_than(0))
+        assert_that(scope.stats['getcallargs'], greater_than(0))
+        assert_that(scope.stats['matcher_evaluations'], greater_than(0))
+        assert_that(scope.stats['signatures'], greater_than(2))
+
+    def test_per_double_stats(self):
+        with collecting_stats():
+            spy1 = Spy()
+            spy2 = Spy()
+            spy1.foo()
+            spy1.foo()
+            spy2.foo()
+
+        assert_that(stats(spy1)['signatures'], is_(2))
+        assert_that(stats(spy2)['signatures'], is_(1))
+
+    def test_mimic_hooks(self):
+        with collecting_stats() as scope:
+            spy = Mimic(Spy, Collaborator)
+            spy.hello()
+
+        assert_that(scope.stats['mimic_hooks'], greater_than(0))
+        assert_that(stats(spy)['mimic_hooks'], greater_than(0))
+
+
+class AllOfCallsTests(TestCase):
+    def setUp(self):
+        self.spy = Spy(Collaborator)
+        for i in range(20):
+            self.spy.one_arg_method(i % 5)
+        self.spy.two_args_method(1, arg2=2)
+        self.spy.mixed_method([1])
+
+    def items(self):
+        spy = self.spy
+        return [
+            (spy.one_arg_method, called().with_args(3).times(4)),
+            (spy.one_arg_method, called().with_args(arg1=3).times(4)),
+            (spy.one_arg_method, called().with_args(greater_than(2)).times(8)),
+            (spy.one_arg_method, called().times(20)),
+            (spy.two_args_method, called().with_args(1, 2)),
+            (spy.two_args_method, called().with_some_args(arg2=2)),
+            (spy.mixed_method, called().with_args([1])),
+            (spy.hello, never(called())),
+            (spy.one_arg_method, never(called().with_args(7))),
+        ]
+
+    def test_same_results_as_separate_matchers(self):
+        for method, matcher in self.items():
+            assert_that(method, matcher)
+
+        assert_that(self.spy, all_of_calls(self.items()))
+
+    def test_all_failures_are_reported(self):
+        spy = self.spy
+        items = self.items() + [
+            (spy.one_arg_method, called().with_args(3).times(5)),
+            (spy.one_arg_method, never(called().with_args(4))),
+            (Spy().foo, called()),
+        ]
+
+        with self.assertRaises(AssertionError) as cm:
+            assert_that(spy, all_of_calls(items))
+
+        assert_that(str(cm.exception), string_contains_in_order(
+            "all these calls:\n",
+            "          Collaborator.one_arg_method(3) -- times: 5\n",
+            "          none of Collaborator.one_arg_method(4)\n",
+            "          these calls:\n          Spy.foo(ANY_ARG)",
+            "but: calls that actually ocurred were:"))
+
+    def test_single_pass_over_literal_calls(self):
+        items = [(self.spy.one_arg_method, called().with_args(i)) for i in range(5)]
+
+        with collecting_stats() as scope:
+            assert_that(self.spy, all_of_calls(items))
+
+        assert_that(scope.stats.get('matcher_evaluations', 0), is_(0))
+
+    def test_wrong_items(self):
+        with self.assertRaises(WrongApiUsage):
+            all_of_calls([called()])
+
+        with self.assertRaises(WrongApiUsage):
+            assert_that(Stub(), all_of_calls([]))
+
+
+class ReportLimitTests(TestCase):
+    def setUp(self):
+        self.spy = Spy(Collaborator)
+        for i in range(150):
+            self.spy.one_arg_method(i % 3)
+        self.spy.mixed_method('x' * 1000)
+
+    def tearDown(self):
+        set_report_limit()
+
+    def mismatch(self, matcher, item):
+        assert_that(matcher.matches(item), is_(False))
+        description = StringDescription()
+        matcher.describe_mismatch(item, description)
+        return str(description)
+
+    def test_short_history_is_shown_in_full(self):
+        set_report_limit(calls=200)
+
+        text = self.mismatch(called().times(1), self.spy.one_arg_method)
+
+        assert_that(text.splitlines(), has_length(152))
+        assert_that(text, contains_string('x' * 1000))
+
+    def test_long_history_is_summarized(self):
+        text = self.mismatch(called().times(1), self.spy.one_arg_method)
+
+        assert_that(text.splitlines(), has_length(25))
+        assert_that(text, string_contains_in_order(
+            "          Collaborator.one_arg_method(0)\n",
+            "... 131 more (151 in total), by method and argument types:\n",
+            "     150 x Collaborator.one_arg_method(int)\n",
+            "       1 x Collaborator.mixed_method(str)\n",
+            "set_report_limit(dump_dir=...)"))
+
+    def test_arguments_are_bounded(self):
+        set_report_limit(calls=10, shown=10)
+        text = self.mismatch(called().times(1), self.spy.one_arg_method)
+        assert_that(text, is_not(contains_string('x' * 100)))
+
+        self.spy.one_arg_method('y' * 1000)
+        for i in range(10):
+            self.spy.mixed_method(i)
+        set_report_limit(calls=10, shown=1)
+        text = self.mismatch(called().times(1), self.spy.one_arg_method)
+        assert_that(text, is_not(contains_string('y' * 100)))
+
+    def test_dump_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        set_report_limit(dump_dir=directory)
+
+        text = self.mismatch(called().times(1), self.spy.one_arg_method)
+
+        path = text.splitlines()[-1].split(' in ')[-1]
+        assert_that(os.path.dirname(path), is_(directory))
+        with open(path) as fd:
+            lines = fd.read().splitlines()
+        assert_that(lines, has_length(151))
+        assert_that(lines[-1], contains_string('x' * 1000))
+
+    def test_mock_reports(self):
+        with Mock() as mock:
+            for i in range(151):
+                mock.foo(i)
+
+        for i in range(150):
+            mock.foo(i)
+
+        text = self.mismatch(verify(), mock)
+        assert_that(text, contains_string("150 x Mock.foo(int)"))
+
+    def test_disabled(self):
+        set_report_limit(calls=None)
+        text = self.mismatch(called().times(1), self.spy.one_arg_method)
+        assert_that(text.splitlines(), has_length(152))
+
+    def test_wrong_limits(self):
+        with self.assertRaises(WrongApiUsage):
+            set_report_limit(calls=10, shown=20)
+
+
+class ClosestCallsTests(TestCase):
+    def setUp(self):
+        self.spy = Spy(Collaborator)
+        for i in range(5):
+            self.spy.two_args_method(i, 2)
+        self.spy.two_args_method(3, 3)
+        self.spy.two_args_method(3, 3)
+        self.spy.one_arg_method(3)
+
+    def tearDown(self):
+        set_report_limit()
+
+    def failure(self, method, matcher):
+        with self.assertRaises(AssertionError) as cm:
+            assert_that(method, matcher)
+        return str(cm.exception)
+
+    def test_ranked_by_differing_arguments(self):
+        text = self.failure(self.spy.two_args_method, called().with_args(3, arg2=5))
+
+        assert_that(text, ends_with('''
+     closest calls to Collaborator.two_args_method were:
+          Collaborator.two_args_method(3, 2) -- differs in: arg2
+          Collaborator.two_args_method(3, 3) -- differs in: arg2 (2 times)
+          Collaborator.two_args_method(0, 2) -- differs in: arg1, arg2
+'''))
+
+    def test_matcher_arguments(self):
+        text = self.failure(self.spy.two_args_method,
+                            called().with_args(greater_than(3), 3))
+
+        assert_that(text, contains_string(
+            "Collaborator.two_args_method(4, 2) -- differs in: arg2\n"))
+
+    def test_with_some_args(self):
+        text = self.failure(self.spy.two_args_method,
+                            called().with_some_args(arg1=7))
+
+        assert_that(text, contains_string(
+            "Collaborator.two_args_method(0, 2) -- differs in: arg1\n"))
+
+    def test_free_spy(self):
+        spy = Spy()
+        spy.foo(1, 'a')
+        spy.foo(1, 'b', key=2)
+
+        text = self.failure(spy.foo, called().with_args(1, 'b'))
+
+        assert_that(text, ends_with('''
+          Spy.foo(1, 'a') -- differs in: #1
+          Spy.foo(1, 'b', key=2) -- differs in: key
+'''))
+
+    def test_limited_amount(self):
+        set_report_limit(closest=1)
+        text = self.failure(self.spy.two_args_method, called().with_args(3, 5))
+
+        assert_that(text.splitlines()[-2:], is_([
+            "     closest calls to Collaborator.two_args_method were:",
+            "          Collaborator.two_args_method(3, 2) -- differs in: arg2"]))
+
+    def test_not_shown_without_calls_to_the_method(self):
+        text = self.failure(self.spy.method_one, called().with_args(3))
+        assert_that(text, is_not(contains_string("closest calls")))
+
+    def test_not_shown_when_arguments_match(self):
+        text = self.failure(self.spy.two_args_method, called().with_args(3, 3).times(3))
+        assert_that(text, is_not(contains_string("closest calls")))
+
+        text = self.failure(self.spy.one_arg_method, never(called().with_args(3)))
+        assert_that(text, is_not(contains_string("closest calls")))
+
+    def test_not_shown_for_any_arg(self):
+        text = self.failure(self.spy.two_args_method, called().times(2))
+        assert_that(text, is_not(contains_string("closest calls")))
+
+
+class CalledInOrderTests(TestCase):
+    def setUp(self):
+        self.db = Spy(Collaborator)
+        self.queue = Spy()
+        self.db.method_one(1)
+        self.queue.publish('a')
+        self.db.method_one(2)
+        self.queue.publish('b')
+
+    def test_across_doubles(self):
+        assert_that([self.db.method_one, self.queue.publish], called_in_order())
+        assert_that([self.queue.publish, self.db.method_one], called_in_order())
+        assert_that([self.db.method_one, self.queue.publish, self.db.method_one,
+                     self.queue.publish], called_in_order())
+
+    def test_with_args(self):
+        assert_that([(self.queue.publish, called().with_args('a')),
+                     (self.db.method_one, called().with_args(2))],
+                    called_in_order())
+
+        assert_that([(self.db.method_one, called().with_args(2)),
+                     (self.queue.publish, called().with_args('a'))],
+                    is_not(called_in_order()))
+
+    def test_same_method_twice(self):
+        assert_that([self.queue.publish, self.queue.publish], called_in_order())
+        assert_that([self.queue.publish] * 3, is_not(called_in_order()))
+
+    def test_concurrent_calls_are_stored_in_order(self):
+        spy = Spy()
+        record_timestamps(spy)
+
+        def call():
+            for i in range(500):
+                spy.foo(i)
+
+        threads = [threading.Thread(target=call) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        record = spy._recorded.to_method(spy._proxy.method_key('foo'))
+        assert_that(record.sequence.tolist(), is_(sorted(record.sequence)))
+        assert_that(record.timestamps.tolist(), is_(sorted(record.timestamps)))
+        assert_that(list(record.timestamps),
+                    is_([i.timestamp for i in record.invocations]))
+
+    def test_not_called(self):
+        assert_that([self.db.method_one, self.queue.other], is_not(called_in_order()))
+        assert_that([self.db.hello, self.queue.publish], is_not(called_in_order()))
+
+    def test_failure_message(self):
+        with self.assertRaises(AssertionError) as cm:
+            assert_that([self.queue.publish, (self.db.method_one, called().with_args(1))],
+                        called_in_order())
+
+        assert_that(str(cm.exception), is_('''
+Expected: calls in this order:
+          Spy.publish(ANY_ARG)
+          Collaborator.method_one(1)
+     but: Collaborator.method_one(1) was not called after Spy.publish(ANY_ARG)
+     calls that actually ocurred were:
+          Collaborator.method_one(1)
+          Spy.publish('a')
+          Collaborator.method_one(2)
+          Spy.publish('b')
+'''))
+
+    def test_only_calls_after_the_previous_are_compared(self):
+        spy = Spy()
+        for i in range(1000):
+            spy.foo(i)
+        spy.bar()
+        spy.foo(-1)
+
+        with collecting_stats() as scope:
+            assert_that([spy.bar, (spy.foo, called().with_args(less_than(0)))],
+                        called_in_order())
+
+        assert_that(scope.stats['matcher_evaluations'], is_(1))
+
+    def test_wrong_items(self):
+        with self.assertRaises(WrongApiUsage):
+            assert_that([], called_in_order())
+
+        with self.assertRaises(WrongApiUsage):
+            assert_that([Stub().foo], called_in_order())
+
+        with self.assertRaises(WrongApiUsage):
+            assert_that([(self.queue.publish, called().times(2))], called_in_order())
+
+        with self.assertRaises(WrongApiUsage):
+            assert_that([(self.queue.publish, never(called()))], called_in_order())
+
+
+class CallsToTests(TestCase):
+    def setUp(self):
+        self.spy = Spy()
+        for i in range(10):
+            self.spy.send(i, topic='odd' if i % 2 else 'even')
+        self.spy.send('bye')
+
+    def test_iterate(self):
+        calls = calls_to(self.spy.send)
+
+        assert_that(list(calls), is_(self.spy.send.calls))
+        assert_that(calls.count(), is_(11))
+        assert_that(calls.first().args, is_((0,)))
+        assert_that(calls.last().args, is_(('bye',)))
+
+    def test_where(self):
+        calls = calls_to(self.spy.send)
+
+        assert_that(calls.where(topic='odd').count(), is_(5))
+        assert_that(calls.where(arg0=greater_than(6)).count(), is_(3))
+        assert_that(calls.where(arg0=instance_of(int), topic='even').count(), is_(5))
+        assert_that(calls.where(lambda call: not call.kargs).count(), is_(1))
+        assert_that(calls.where(arg1=1).count(), is_(0))
+
+    def test_lazy(self):
+        odd = calls_to(self.spy.send).where(topic='odd')
+        self.spy.send(11, topic='odd')
+
+        assert_that(odd.count(), is_(6))
+
+    def test_arguments_by_signature(self):
+        spy = Spy(Collaborator)
+        spy.mixed_method(1)
+        spy.mixed_method(2, key_param=True)
+        spy.mixed_method(arg1=3)
+
+        calls = calls_to(spy.mixed_method)
+
+        assert_that(list(calls.values('arg1')), is_([1, 2, 3]))
+        assert_that(list(calls.values('key_param')), is_([False, True, False]))
+        assert_that(calls.where(key_param=False).count(), is_(2))
+
+    def test_slicing(self):
+        calls = calls_to(self.spy.send).where(arg0=instance_of(int))
+
+        assert_that([x.args[0] for x in calls[2:4]], is_([2, 3]))
+        assert_that([x.args[0] for x in calls[-2:]], is_([8, 9]))
+        assert_that([x.args[0] for x in calls[::4]], is_([0, 4, 8]))
+        assert_that(calls[1].args, is_((1,)))
+        assert_that(calls[-1].args, is_((9,)))
+
+        with self.assertRaises(IndexError):
+            calls[10]
+
+        with self.assertRaises(IndexError):
+            calls[-11]
+
+    def test_group_by(self):
+        calls = calls_to(self.spy.send).where(arg0=instance_of(int))
+
+        assert_that(calls.group_by('topic').count(), is_({'odd': 5, 'even': 5}))
+        assert_that(calls.group_by(lambda call: call.args[0] // 5).count(),
+                    is_({0: 5, 1: 5}))
+        assert_that(calls.group_by('topic').last()['even'].args, is_((8,)))
+        assert_that(calls.group_by('topic').first()['odd'].args, is_((1,)))
+
+    def test_time_window(self):
+        spy = Spy()
+        record_timestamps(spy)
+        with VirtualClock() as clock:
+            for i in range(10):
+                spy.tick(i)
+                clock.advance(1)
+
+        calls = calls_to(spy.tick)
+
+        assert_that([x.args[0] for x in calls.between(2, 4)], is_([2, 3, 4]))
+        assert_that(calls.between(start=7).count(), is_(3))
+
+    def test_thread(self):
+        spy = Spy()
+        record_timestamps(spy)
+        spy.foo(1)
+        thread = threading.Thread(target=spy.foo, args=(2,))
+        thread.start()
+        thread.join()
+
+        calls = calls_to(spy.foo)
+
+        assert_that([x.args for x in calls.in_thread()], is_([(1,)]))
+        assert_that([x.args for x in calls.in_thread(thread)], is_([(2,)]))
+
+    def test_metadata_requires_timestamps(self):
+        with self.assertRaises(WrongApiUsage):
+            calls_to(self.spy.send).between(0, 1)
+
+        with self.assertRaises(WrongApiUsage):
+            calls_to(self.spy.send).in_thread()
+
+    def test_wrong_method(self):
+        with self.assertRaises(WrongApiUsage):
+            calls_to(Stub().foo)
+
+
+class ArgumentStatsTests(TestCase):
+    def test_counts(self):
+        spy = Spy()
+        record_argument_stats(spy)
+        for i in range(1000):
+            spy.send(i % 10 if i % 2 else i, topic='hot' if i % 4 else 'cold')
+
+        stats = argument_stats(spy.send)
+
+        assert_that(stats.calls, is_(1000))
+        assert_that(stats['arg0'].count, is_(1000))
+        assert_that(stats['arg0'].distinct, close_to(505, 25))
+        assert_that(stats['topic'].distinct, is_(2))
+        assert_that(stats['topic'].top(), is_([('hot', 750), ('cold', 250)]))
+        assert_that([value for value, count in stats['arg0'].top(5)],
+                    contains_inanyorder(1, 3, 5, 7, 9))
+
+    def test_hostile_arguments_are_recorded(self):
+        class BadLen(object):
+            def __len__(self):
+                raise TypeError('no len')
+
+        class BadRepr(list):
+            def __repr__(self):
+                raise RuntimeError('no repr')
+
+        spy = Spy()
+        record_argument_stats(spy)
+        bad_len, bad_repr = BadLen(), BadRepr()
+        spy.send(bad_len)
+        spy.send(bad_repr)
+        spy.send(1)
+
+        stats = argument_stats(spy.send)['arg0']
+        assert_that(stats.count, is_(3))
+        assert_that(stats.unsized, is_(1))
+        assert_that(stats.unrepresentable, is_(1))
+        assert_that(repr(stats), contains_string('unrepresentable: 1, unsized: 1'))
+        assert_that(spy.send.calls, has_length(3))
+
+    def test_history_is_kept_by_default(self):
+        spy = Spy()
+        record_argument_stats(spy)
+        spy.send(1)
+
+        assert_that(spy.send, called().with_args(1))
+
+    def test_without_history(self):
+        spy = Spy()
+        record_argument_stats(spy, history=False)
+        for i in range(100):
+            spy.send(i)
+
+        assert_that(argument_stats(spy.send).calls, is_(100))
+        assert_that(spy.send.calls, is_([]))
+
+    def test_named_by_signature(self):
+        spy = Spy(Collaborator)
+        record_argument_stats(spy)
+        spy.mixed_method(1)
+        spy.mixed_method(2, key_param=True)
+
+        stats = argument_stats(spy.mixed_method)
+
+        assert_that(sorted(stats.arguments), is_(['arg1', 'key_param']))
+        assert_that(stats['arg1'].count, is_(2))
+
+    def test_sizes(self):
+        spy = Spy()
+        record_argument_stats(spy)
+        for i in range(100):
+            spy.write(b'x' * i, [i])
+
+        stats = argument_stats(spy.write)
+
+        assert_that(stats['arg0'].sizes.max, is_(99))
+        assert_that(stats['arg0'].sizes.percentile(50), is_(49))
+        assert_that(stats['arg1'].distinct, close_to(100, 5))
+        assert_that(stats['arg1'].sizes.mean, is_(1))
+
+    def test_bounded_memory(self):
+        spy = Spy()
+        record_argument_stats(spy, top=5, history=False)
+        for i in range(20000):
+            spy.send(i)
+
+        stats = argument_stats(spy.send)['arg0']
+        assert_that(len(stats.heavy.counts), less_than(21))
+        assert_that(stats.distinct, close_to(20000, 1000))
+
+    def test_report(self):
+        spy = Spy()
+        record_argument_stats(spy)
+        spy.send('a')
+
+        assert_that(str(argument_stats(spy.send)), is_(
+            "Spy.send: 1 calls\n"
+            "  arg0: <count: 1, distinct: ~1, top: 'a' (1), "
+            "sizes: <count: 1, p50: 1, p90: 1, p99: 1, max: 1>>"))
+
+    def test_disabled(self):
+        spy = Spy()
+        record_argument_stats(spy)
+        record_argument_stats(spy, enabled=False)
+
+        with self.assertRaises(WrongApiUsage):
+            argument_stats(spy.send)
+
+    def test_wrong_usage(self):
+        with self.assertRaises(WrongApiUsage):
+            record_argument_stats(Stub())
+
+        with self.assertRaises(WrongApiUsage):
+            record_argument_stats(Mock(), history=False)
+
+        with self.assertRaises(WrongApiUsage):
+            argument_stats(Stub().foo)
+
+
 # new on 1.7
 class with_some_args_matcher_tests(TestCase):
     def test_one_arg(self):
@@ -1710,6 +3040,296 @@ class VarArgsTest(TestCase):
                         contains_string('with_some_args() can not be applied to method Collaborator.varargs(self, *args, **kargs)'))
 
 
+class PrecompiledTests(TestCase):
+    def test_instances_share_the_class(self):
+        PrecompiledSpy = precompile(Spy, Collaborator)
+
+        self.assertIs(type(PrecompiledSpy()), PrecompiledSpy)
+        assert_that(PrecompiledSpy(), instance_of(Spy))
+
+    def test_instances_are_not_counted_as_clones(self):
+        PrecompiledSpy = precompile(Spy, Collaborator)
+        with collecting_stats() as scope:
+            PrecompiledSpy()
+            PrecompiledSpy()
+
+        assert_that(scope.stats.get('class_clones', 0), is_(0))
+
+    def test_stub_and_spy_methods(self):
+        PrecompiledSpy = precompile(Spy, Collaborator)
+        spy = PrecompiledSpy()
+        other = PrecompiledSpy()
+
+        with spy:
+            spy.one_arg_method(1).returns(2)
+
+        assert_that(spy.one_arg_method(1), is_(2))
+        assert_that(spy.one_arg_method, called().with_args(1))
+        assert_that(other.one_arg_method, never(called()))
+
+    def test_signature_is_checked(self):
+        spy = precompile(Spy, Collaborator)()
+
+        with self.assertRaises(TypeError):
+            spy.hello(1)
+
+    def test_missing_attribute(self):
+        spy = precompile(Spy, Collaborator)()
+
+        with self.assertRaises(AttributeError):
+            spy.missing()
+
+    def test_properties(self):
+        PrecompiledSpy = precompile(Spy, ObjCollaborator)
+        spy = PrecompiledSpy()
+        other = PrecompiledSpy()
+
+        with spy:
+            spy.prop = 3
+
+        assert_that(spy.prop, is_(3))
+        assert_that(spy, property_got('prop'))
+        assert_that(other, never(property_got('prop')))
+
+        other.prop = 5
+        assert_that(other, property_set('prop').to(5))
+
+    def test_mock(self):
+        mock = precompile(Mock, Collaborator)()
+        with mock:
+            mock.hello()
+
+        mock.hello()
+        assert_that(mock, verify())
+
+    def test_proxyspy(self):
+        spy = precompile(ProxySpy, Collaborator)(Collaborator())
+
+        assert_that(spy.hello(), is_("hello"))
+        assert_that(spy.hello, called())
+
+    def test_adhoc_attributes_are_per_instance(self):
+        PrecompiledStub = precompile(Stub, Collaborator)
+        stub = PrecompiledStub()
+        stub.hello = method_returning(3)
+
+        assert_that(stub.hello(), is_(3))
+        assert_that(PrecompiledStub().hello(), is_(None))
+
+    def test_new_attributes_are_traced(self):
+        out = StringIO()
+        spy = precompile(Spy, ObjCollaborator)()
+        Tracer(out.write).trace(spy)
+
+        spy.no_args()
+        spy.prop
+
+        assert_that(out.getvalue(),
+                    is_("ObjCollaborator.no_args()ObjCollaborator.prop gotten"))
+
+    def test_takes_a_double_class(self):
+        with self.assertRaises(WrongApiUsage):
+            precompile(Collaborator, Collaborator)
+
+
+class MemoryReportTests(TestCase):
+    def test_per_method_breakdown(self):
+        with Spy() as spy:
+            spy.foo(1).returns(2)
+
+        for i in range(10):
+            spy.foo(i)
+        spy.bar()
+
+        report = memory_report(spy)
+
+        assert_that(report.methods['foo'].recorded, is_(10))
+        assert_that(report.methods['foo'].stubbed, is_(1))
+        assert_that(report.methods['bar'].recorded, is_(1))
+        assert_that(report.methods['foo'].bytes,
+                    greater_than(report.methods['bar'].bytes))
+        assert_that(report.total, greater_than(report.class_bytes))
+
+    def test_shared_arguments_are_counted_once(self):
+        big = list(range(10000))
+        spy = Spy()
+        spy.send(big)
+        single = memory_report(spy).methods['send'].bytes
+
+        for i in range(9):
+            spy.send(big)
+
+        assert_that(memory_report(spy).methods['send'].bytes,
+                    less_than(single * 2))
+
+    def test_largest_arguments(self):
+        spy = Spy()
+        spy.send('small')
+        spy.send('x' * 10000)
+        spy.write(list(range(100)))
+
+        report = memory_report(spy, top=2)
+
+        assert_that([(x[1], x[2][:3]) for x in report.largest_arguments],
+                    is_([('send', "'xx"), ('write', '[0,')]))
+        assert_that(str(report), contains_string("largest arguments:"))
+
+    def test_precise(self):
+        spy = Spy()
+        spy.send([object() for i in range(1000)])
+
+        report = memory_report(spy, precise=True)
+
+        assert_that(report.largest_arguments[0][0], greater_than(16000))
+
+    def test_precise_does_not_copy_user_objects(self):
+        copies = []
+
+        class Payload(object):
+            def __init__(self):
+                self.data = list(range(1000))
+
+            def __deepcopy__(self, memo):
+                copies.append(self)
+                return Payload()
+
+        spy = Spy()
+        spy.send(Payload())
+        spy.send([Payload()])
+
+        report = memory_report(spy, precise=True)
+
+        assert_that(copies, is_([]))
+        assert_that([x[0] for x in report.largest_arguments],
+                    contains_exactly(greater_than(8000), greater_than(8000)))
+
+
+class IntrospectionCacheTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        disable_introspection_cache()
+        shutil.rmtree(self.directory)
+
+    def test_cached_argspec_is_the_actual_one(self):
+        class Collab(object):
+            def method(self, a, b=1, *args, c, d=2, **kargs) -> int:
+                pass
+
+            @classmethod
+            def klass(cls, a: str = 'a'):
+                pass
+
+        info = introspection.ClassInfo()
+        for name in ['method', 'klass']:
+            method = getattr(Collab(), name)
+            expected = inspect.getfullargspec(method)
+            assert_that(info.argspec(name, method), is_(expected))
+            assert_that(info.argspec(name, method), is_(expected))
+
+    def test_results_are_kept_on_disk(self):
+        enable_introspection_cache(self.directory)
+        spy = Spy(Collaborator)
+        spy.hello()
+        spy.mixed_method(1, key_param=True)
+        save_introspection_cache()
+
+        assert_that(os.listdir(self.directory), has_length(1))
+
+        enable_introspection_cache(self.directory)
+        info = introspection.class_info(Collaborator)
+        assert_that(info.kinds, has_entry('hello', 'method'))
+        assert_that(info.layouts, has_entry('mixed_method',
+                                            [['self', 'arg1', 'key_param'], None, None, []]))
+
+        spy = Spy(Collaborator)
+        with self.assertRaises(TypeError):
+            spy.hello(1)
+
+    def test_changed_class_gets_other_entry(self):
+        def make_class(body):
+            class Collab(object):
+                pass
+
+            Collab.method = body
+            return Collab
+
+        first = make_class(lambda self, a: None)
+        second = make_class(lambda self, a, b: None)
+
+        self.assertNotEqual(introspection.fingerprint(first),
+                            introspection.fingerprint(second))
+        assert_that(introspection.fingerprint(first),
+                    is_(introspection.fingerprint(make_class(lambda self, a: None))))
+
+    def test_patched_class_is_introspected_again(self):
+        class Collab(object):
+            def method(self):
+                pass
+
+        self.assertIsInstance(Spy(Collab).method, Method)
+
+        Collab.method = property(lambda self: 3)
+
+        self.assertNotIsInstance(Spy(Collab).method, Method)
+
+    def test_patched_class_entries_are_not_saved(self):
+        class Collab(object):
+            def method(self):
+                pass
+
+        enable_introspection_cache(self.directory)
+        Spy(Collab).method()
+        Collab.method = lambda self, a: None
+        Spy(Collab).method(1)
+        save_introspection_cache()
+
+        assert_that(os.listdir(self.directory), is_([]))
+
+
+class LazyImportTests(TestCase):
+    def run_python(self, code):
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env = dict(os.environ, PYTHONPATH=root)
+        return subprocess.check_output([sys.executable, '-c', code], env=env).decode()
+
+    def test_import_does_not_load_hamcrest(self):
+        out = self.run_python(
+            "import sys, doublex\n"
+            "print('hamcrest' in sys.modules, 'doublex.doubles' in sys.modules)")
+
+        assert_that(out.strip(), is_("False False"))
+
+    def test_recording_does_not_load_hamcrest(self):
+        out = self.run_python(
+            "import sys\n"
+            "from doublex import Spy\n"
+            "Spy().foo(1)\n"
+            "print('hamcrest' in sys.modules, 'inspect' in sys.modules)")
+
+        assert_that(out.strip(), is_("False False"))
+
+    def test_exported_names(self):
+        for module, names in doublex._exports.items():
+            module = importlib.import_module('doublex.' + module)
+            assert_that(set(names), is_(set(getattr(module, '__all__', names))))
+            for name in names:
+                self.assertIs(getattr(doublex, name), getattr(module, name))
+
+    def test_submodules_after_bare_import(self):
+        out = self.run_python(
+            "import doublex\n"
+            "print(doublex.internal.WrongApiUsage.__name__, doublex.proxy.__name__)\n"
+            "namespace = {}\n"
+            "exec('from doublex import *', namespace)\n"
+            "print(sorted(x for x in doublex._submodules if x in namespace))")
+
+        assert_that(out.splitlines(), is_([
+            "WrongApiUsage doublex.proxy",
+            "['doubles', 'internal', 'matchers', 'proxy', 'safeunicode', 'tracer']"]))
+
+
 # new on 1.7.2
 class TracerTests(TestCase):
     def setUp(self):
@@ -1769,6 +3389,177 @@ class TracerTests(TestCase):
                     is_("ObjCollaborator.prop set to 2"))
 
 
+class BufferedTracerTests(TestCase):
+    def test_records_are_written_when_buffer_is_full(self):
+        sink = ListSink()
+        tracer = Tracer(sink=sink, buffer_size=2)
+        stub = Stub()
+        tracer.trace(stub)
+
+        stub.foo(1)
+        assert_that(sink.records, is_([]))
+
+        stub.bar(two=2)
+        assert_that(sink.lines, is_(["Stub.foo(1)", "Stub.bar(two=2)"]))
+
+    def test_flush(self):
+        sink = ListSink()
+        tracer = Tracer(sink=sink)
+        stub = Stub(ObjCollaborator)
+        tracer.trace(stub)
+
+        stub.prop = 2
+        stub.prop
+        tracer.flush()
+
+        assert_that(sink.lines, is_(["ObjCollaborator.prop set to 2",
+                                     "ObjCollaborator.prop gotten"]))
+
+    def test_pending_records_are_written_at_exit(self):
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        code = (
+            "from doublex import Stub, Tracer\n"
+            "from doublex.tracer import CallableSink\n"
+            "stub = Stub()\n"
+            "Tracer(sink=CallableSink(lambda records: print(records[0].format())))"
+            ".trace(stub)\n"
+            "stub.foo(1)\n")
+        out = subprocess.check_output([sys.executable, '-c', code],
+                                      env=dict(os.environ, PYTHONPATH=root))
+
+        assert_that(out.decode().strip(), is_("Stub.foo(1)"))
+
+    def test_structured_record(self):
+        sink = ListSink()
+        stub = Stub()
+
+        with VirtualClock(start=3):
+            with Tracer(sink=sink) as tracer:
+                tracer.trace(stub.foo)
+                stub.foo(1, 'two', three=3)
+
+        record = sink.records[0].to_dict()
+        assert_that(record, has_entries(
+            double='Stub', method='foo', kind='call',
+            args=['1', "'two'"], kargs={'three': '3'},
+            timestamp=3000000000, thread=threading.get_ident()))
+
+    def test_callable_sink_gets_batches(self):
+        batches = []
+        tracer = Tracer(sink=CallableSink(batches.append), buffer_size=2)
+        stub = Stub()
+        tracer.trace(stub.foo)
+
+        for i in range(5):
+            stub.foo(i)
+        tracer.flush()
+
+        assert_that([len(x) for x in batches], is_([2, 2, 1]))
+
+    def test_json_lines_sink(self):
+        out = StringIO()
+        stub = Stub()
+        with Tracer(sink=JSONLinesSink(out)) as tracer:
+            tracer.trace(stub.foo)
+            stub.foo(1)
+            stub.foo(2)
+
+        lines = [json.loads(x) for x in out.getvalue().splitlines()]
+        assert_that([x['args'] for x in lines], is_([['1'], ['2']]))
+
+    def test_logger_or_sink_required(self):
+        with self.assertRaises(WrongApiUsage):
+            Tracer()
+
+
+class TracerFilteringTests(TestCase):
+    def setUp(self):
+        self.sink = ListSink()
+
+    def trace(self, **options):
+        self.tracer = Tracer(sink=self.sink, buffer_size=1, **options)
+        stub = Stub()
+        self.tracer.trace(stub)
+        return stub
+
+    def test_selected_methods(self):
+        stub = self.trace(methods=['foo'])
+
+        stub.foo(1)
+        stub.bar(2)
+
+        assert_that(self.sink.lines, is_(["Stub.foo(1)"]))
+        tracers = [x for x in stub.bar.observers
+                   if getattr(x, 'tracer', None) is self.tracer]
+        assert_that(tracers, is_([]))
+
+    def test_every(self):
+        stub = self.trace(every=3)
+
+        for i in range(7):
+            stub.foo(i)
+
+        assert_that(self.sink.lines, is_(["Stub.foo(0)", "Stub.foo(3)", "Stub.foo(6)"]))
+
+    def test_every_with_concurrent_calls(self):
+        stub = self.trace(every=2)
+
+        def call():
+            for i in range(500):
+                stub.foo(i)
+
+        threads = [threading.Thread(target=call) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert_that(self.sink.records, has_length(1000))
+
+    def test_probability_is_reproducible(self):
+        stub = self.trace(probability=0.5, seed=1)
+        for i in range(100):
+            stub.foo(i)
+
+        first = self.sink.lines
+        self.sink = ListSink()
+        stub = self.trace(probability=0.5, seed=1)
+        for i in range(100):
+            stub.foo(i)
+
+        assert_that(self.sink.lines, is_(first))
+        assert_that(len(first), all_of(greater_than(30), less_than(70)))
+
+    def test_rate_limit_per_method(self):
+        with VirtualClock() as clock:
+            stub = self.trace(rate_limit=2)
+            for i in range(5):
+                stub.foo(i)
+                stub.bar(i)
+
+            clock.advance(1)
+            stub.foo(5)
+
+        assert_that(self.sink.lines, is_([
+            "Stub.foo(0)", "Stub.bar(0)", "Stub.foo(1)", "Stub.bar(1)", "Stub.foo(5)"]))
+
+    def test_where_matcher(self):
+        stub = self.trace(where=contains_exactly(greater_than(2)))
+
+        for i in range(5):
+            stub.foo(i)
+
+        assert_that(self.sink.lines, is_(["Stub.foo(3)", "Stub.foo(4)"]))
+
+    def test_where_predicate(self):
+        stub = self.trace(where=lambda *args, **kargs: kargs.get('user') == 'bob')
+
+        stub.foo(user='alice')
+        stub.foo(user='bob')
+
+        assert_that(self.sink.lines, is_(["Stub.foo(user='bob')"]))
+
+
 # new on 1.8.3
 # issue: https://bitbucket.org/DavidVilla/python-doublex/issues/25/support-from-python-35-type-hints-when
 class TypeHintTests(TestCase):
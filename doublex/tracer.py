@@ -1,34 +1,235 @@
 # -*- coding:utf-8; tab-width:4; mode:python -*-
 
+import json
+import random
+import weakref
+import threading
+
 from .doubles import Stub
-from .internal import Method, Property, WrongApiUsage
+from .internal import Method, Property, WrongApiUsage, InvocationFormatter
+from .clock import get_clock
+
+
+class TraceRecord(object):
+    '''A traced operation. Arguments are kept as given and only formatted
+    when the record is written by the sink.'''
+    __slots__ = ('double', 'name', 'kind', 'args', 'kargs', 'timestamp', 'thread')
+
+    def __init__(self, double, name, kind, args=(), kargs=None):
+        self.double = double
+        self.name = name
+        self.kind = kind
+        self.args = args
+        self.kargs = kargs or {}
+        self.timestamp = get_clock().now_ns()
+        self.thread = threading.get_ident()
+
+    def format(self):
+        target = "%s.%s" % (self.double._classname(), self.name)
+        if self.kind == 'call':
+            return target + InvocationFormatter.format_call(self.args, self.kargs)
+
+        if self.kind == 'set':
+            return "%s set to %s" % (target, self.args[0])
+
+        return "%s gotten" % target
 
+    def to_dict(self):
+        return dict(
+            double=self.double._classname(),
+            method=self.name,
+            kind=self.kind,
+            args=[repr(x) for x in self.args],
+            kargs=dict((k, repr(v)) for k, v in self.kargs.items()),
+            timestamp=self.timestamp,
+            thread=self.thread)
 
-class MethodTracer(object):
-    def __init__(self, logger, method):
+    def __repr__(self):
+        return "<TraceRecord %s>" % self.format()
+
+
+def flush_buffer(buffer, sink, lock):
+    with lock:
+        if not buffer:
+            return
+
+        batch = buffer[:]
+        del buffer[:]
+        sink.write(batch)
+
+
+class LoggerSink(object):
+    'calls the logger with the text of each record'
+    def __init__(self, logger):
         self.logger = logger
+
+    def write(self, records):
+        for record in records:
+            self.logger(record.format())
+
+
+class CallableSink(object):
+    'calls the given function with each batch of records'
+    def __init__(self, func):
+        self.func = func
+
+    def write(self, records):
+        self.func(records)
+
+
+class ListSink(object):
+    def __init__(self):
+        self.records = []
+
+    def write(self, records):
+        self.records.extend(records)
+
+    @property
+    def lines(self):
+        return [r.format() for r in self.records]
+
+
+class JSONLinesSink(object):
+    'writes a JSON object per record to the given path or file object'
+    def __init__(self, target):
+        self.path = None
+        self.fd = target
+        if isinstance(target, str):
+            self.path = target
+            self.fd = open(target, 'a')
+
+    def write(self, records):
+        self.fd.write(''.join(json.dumps(r.to_dict()) + '\n' for r in records))
+        self.fd.flush()
+
+    def close(self):
+        if self.path is not None:
+            self.fd.close()
+
+
+class TracerHook(object):
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.seen = 0
+        self.window_start = None
+        self.window_count = 0
+        self._lock = threading.Lock()
+
+    def accepts(self, args, kargs):
+        tracer = self.tracer
+        if tracer.where is not None and not tracer.where(*args, **kargs):
+            return False
+
+        with self._lock:
+            return self._sampled(tracer)
+
+    def _sampled(self, tracer):
+        self.seen += 1
+        if tracer.every and (self.seen - 1) % tracer.every:
+            return False
+
+        if tracer.probability is not None and \
+                tracer.random.random() >= tracer.probability:
+            return False
+
+        if tracer.rate_limit is not None:
+            now = get_clock().now()
+            if self.window_start is None or now - self.window_start >= 1:
+                self.window_start = now
+                self.window_count = 0
+            if self.window_count >= tracer.rate_limit:
+                return False
+            self.window_count += 1
+
+        return True
+
+
+class MethodTracer(TracerHook):
+    def __init__(self, tracer, method):
+        TracerHook.__init__(self, tracer)
         self.method = method
 
     def __call__(self, *args, **kargs):
-        self.logger(str(self.method._create_invocation(args, kargs)))
+        if self.tracer.filtered and not self.accepts(args, kargs):
+            return
 
+        self.tracer.emit(
+            TraceRecord(self.method.double, self.method.name, 'call', args, kargs))
 
-class PropertyTracer(object):
-    def __init__(self, logger, prop):
-        self.logger = logger
+
+class PropertyTracer(TracerHook):
+    def __init__(self, tracer, prop):
+        TracerHook.__init__(self, tracer)
         self.prop = prop
 
     def __call__(self, *args, **kargs):
-        propname = "%s.%s" % (self.prop.double._classname(), self.prop.key)
-        if args:
-            self.logger("%s set to %s" % (propname, args[0]))
-        else:
-            self.logger("%s gotten" % (propname))
+        if self.tracer.filtered and not self.accepts(args, kargs):
+            return
+
+        kind = 'set' if args else 'get'
+        self.tracer.emit(TraceRecord(self.prop.double, self.prop.key, kind, args))
 
 
 class Tracer(object):
-    def __init__(self, logger):
+    '''Traces double invocations into a sink. Records are buffered and
+    written in batches of 'buffer_size', and the pending ones when the
+    tracer is closed or the process exits. A plain 'logger' callable gets
+    the text of each record as it happens.
+
+    Tracing may be restricted to the given 'methods' (names), to calls whose
+    arguments satisfy 'where' (a predicate or a hamcrest matcher for the
+    positional arguments), and then sampled: one of 'every' N calls, with
+    the given 'probability' (reproducible with 'seed') and no more than
+    'rate_limit' calls per second and method.'''
+
+    def __init__(self, logger=None, sink=None, buffer_size=None,
+                 methods=None, where=None, every=None, probability=None,
+                 seed=None, rate_limit=None):
+        if (logger is None) == (sink is None):
+            raise WrongApiUsage("Tracer takes either a logger or a sink")
+
+        if hasattr(where, 'matches'):
+            where = self._args_predicate(where)
+
+        self.methods = None if methods is None else set(methods)
+        self.where = where
+        self.every = every
+        self.probability = probability
+        self.random = random.Random(seed)
+        self.rate_limit = rate_limit
+        self.filtered = any(x is not None for x in
+                            [where, every, probability, rate_limit])
+
+        if logger is not None:
+            sink = LoggerSink(logger)
+            buffer_size = buffer_size or 1
+
         self.logger = logger
+        self.sink = sink
+        self.buffer_size = buffer_size or 1000
+        self._buffer = []
+        self._lock = threading.RLock()
+        weakref.finalize(self, flush_buffer, self._buffer, self.sink, self._lock)
+
+    def emit(self, record):
+        with self._lock:
+            self._buffer.append(record)
+            if len(self._buffer) >= self.buffer_size:
+                self.flush()
+
+    def flush(self):
+        flush_buffer(self._buffer, self.sink, self._lock)
+
+    def close(self):
+        self.flush()
+        if hasattr(self.sink, 'close'):
+            self.sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def trace(self, target):
         if isinstance(target, Method):
@@ -38,14 +239,25 @@ class Tracer(object):
         else:
             raise WrongApiUsage('Can not trace %s' % target)
 
+    def _selected(self, name):
+        return self.methods is None or name in self.methods
+
+    @staticmethod
+    def _args_predicate(matcher):
+        def predicate(*args, **kargs):
+            return matcher.matches(args)
+        return predicate
+
     def trace_method(self, method):
-        method.attach(MethodTracer(self.logger, method))
+        method.attach(MethodTracer(self, method))
 
     def trace_class(self, double):
         def attach_new_method(attr):
             if isinstance(attr, Method):
-                attr.attach(MethodTracer(self.logger, attr))
+                if self._selected(attr.name):
+                    attr.attach(MethodTracer(self, attr))
             elif isinstance(attr, Property):
-                attr.attach(PropertyTracer(self.logger, attr))
+                if self._selected(attr.key):
+                    attr.attach(PropertyTracer(self, attr))
 
         double._new_attr_hooks.append(attach_new_method)